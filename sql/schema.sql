@@ -24,9 +24,113 @@ CREATE TABLE IF NOT EXISTS player_game_stats (
   team_id INTEGER,
   minutes REAL,
   points INTEGER,
+  rebounds INTEGER,
+  assists INTEGER,
+  threes INTEGER,
+  ingested_ts TIMESTAMP DEFAULT NOW(),
   PRIMARY KEY (game_id, player_id)
 );
 
+-- Existing databases created before ingested_ts was added
+ALTER TABLE player_game_stats ADD COLUMN IF NOT EXISTS ingested_ts TIMESTAMP DEFAULT NOW();
+
+-- ... and before rebounds / assists / threes were kept (older rows stay NULL)
+ALTER TABLE player_game_stats ADD COLUMN IF NOT EXISTS rebounds INTEGER;
+ALTER TABLE player_game_stats ADD COLUMN IF NOT EXISTS assists INTEGER;
+ALTER TABLE player_game_stats ADD COLUMN IF NOT EXISTS threes INTEGER;
+
+CREATE INDEX IF NOT EXISTS idx_player_game_stats_ingested_ts ON player_game_stats (ingested_ts);
+CREATE INDEX IF NOT EXISTS idx_player_game_stats_player_id ON player_game_stats (player_id);
+
+-- Rolling window state per player, maintained on ingest (see src/rolling_state.py).
+-- Rings hold the last 10 games, ring_pos is the next slot to overwrite.
+CREATE TABLE IF NOT EXISTS player_rolling_state (
+  player_id INTEGER PRIMARY KEY,
+  team_id INTEGER,
+  last_game_id TEXT,
+  last_game_date DATE,
+  n_games INTEGER NOT NULL,
+  ring_pos INTEGER NOT NULL,
+  pts_ring REAL[] NOT NULL,
+  min_ring REAL[] NOT NULL,
+  updated_ts TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_player_rolling_state_team_id ON player_rolling_state (team_id);
+
+-- Decayed sums behind the exponentially weighted features (src.ewma), as of each player's
+-- last processed game. sums is laid out [stat][half-life][s0, s1, s2, q] for the half_lives
+-- it was computed with.
+CREATE TABLE IF NOT EXISTS player_ewm_state (
+  player_id INTEGER PRIMARY KEY,
+  last_game_id TEXT,
+  last_game_date DATE,
+  n_games INTEGER NOT NULL,
+  half_lives REAL[] NOT NULL,
+  sums DOUBLE PRECISION[] NOT NULL,
+  updated_ts TIMESTAMP DEFAULT NOW()
+);
+
+-- Per-date / per-game completion of backfill_games runs
+CREATE TABLE IF NOT EXISTS backfill_ledger (
+  scope TEXT NOT NULL,     -- 'date' (YYYY-MM-DD) or 'game' (game_id)
+  item_key TEXT NOT NULL,
+  season TEXT,
+  status TEXT NOT NULL,    -- 'done' or 'failed'
+  detail TEXT,
+  updated_ts TIMESTAMP DEFAULT NOW(),
+  PRIMARY KEY (scope, item_key)
+);
+
+-- Last processed position of incremental jobs (e.g. build_features)
+CREATE TABLE IF NOT EXISTS pipeline_watermarks (
+  name TEXT PRIMARY KEY,
+  watermark_ts TIMESTAMP NOT NULL,
+  updated_ts TIMESTAMP DEFAULT NOW()
+);
+
+-- One row per pipeline run: per-span timings / row counts and counters (src/instrument.py)
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+  run_id BIGSERIAL PRIMARY KEY,
+  pipeline TEXT NOT NULL,
+  started_ts TIMESTAMP NOT NULL,
+  finished_ts TIMESTAMP,
+  status TEXT,
+  duration_s REAL,
+  spans JSONB,
+  counters JSONB,
+  host TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_pipeline_started ON pipeline_runs (pipeline, started_ts);
+
+-- One row per (game, team): points for / allowed, points allowed to the opponent's players by
+-- minutes tier and team minutes. Refreshed per ingested game by build_features (src/team_aggregates.py).
+CREATE TABLE IF NOT EXISTS team_game_stats (
+  game_id TEXT REFERENCES games(game_id),
+  team_id INTEGER,
+  opponent_team_id INTEGER,
+  game_date DATE NOT NULL,
+  pts_for INTEGER,
+  team_minutes REAL,
+  n_players INTEGER,
+  pts_allowed INTEGER,
+  opp_minutes REAL,
+  allowed_starter_pts INTEGER,
+  allowed_starter_n INTEGER,
+  allowed_rotation_pts INTEGER,
+  allowed_rotation_n INTEGER,
+  allowed_bench_pts INTEGER,
+  allowed_bench_n INTEGER,
+  updated_ts TIMESTAMP DEFAULT NOW(),
+  PRIMARY KEY (game_id, team_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_team_game_stats_team_date ON team_game_stats (team_id, game_date);
+
+-- player_features_daily and predictions_daily are range-partitioned by as_of_date, one partition
+-- per day, created ahead of writes and expired by src/partitions.py. Databases created before
+-- partitioning: python -m src.partitions --migrate
 CREATE TABLE IF NOT EXISTS player_features_daily (
   as_of_date DATE NOT NULL,
   game_id TEXT,
@@ -46,8 +150,67 @@ CREATE TABLE IF NOT EXISTS player_features_daily (
   last_game_pts REAL,
   last_game_min REAL,
 
+  opp_pts_allowed_10 REAL,
+  opp_pts_allowed_tier_10 REAL,
+  opp_pace_10 REAL,
+  team_pace_10 REAL,
+
+  rolling_reb_10 REAL,
+  reb_std_10 REAL,
+  rolling_ast_10 REAL,
+  ast_std_10 REAL,
+  rolling_fg3m_10 REAL,
+  fg3m_std_10 REAL,
+
+  -- exponentially weighted mean / std of points and minutes, half-lives in games (src.ewma)
+  ew_pts_mean_3 REAL,
+  ew_pts_std_3 REAL,
+  ew_min_mean_3 REAL,
+  ew_min_std_3 REAL,
+  ew_pts_mean_7 REAL,
+  ew_pts_std_7 REAL,
+  ew_min_mean_7 REAL,
+  ew_min_std_7 REAL,
+  ew_pts_mean_15 REAL,
+  ew_pts_std_15 REAL,
+  ew_min_mean_15 REAL,
+  ew_min_std_15 REAL,
+
   PRIMARY KEY (as_of_date, game_id, player_id)
-);
+) PARTITION BY RANGE (as_of_date);
+
+-- Existing databases created before the team aggregate features were added
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS opp_pts_allowed_10 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS opp_pts_allowed_tier_10 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS opp_pace_10 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS team_pace_10 REAL;
+
+-- ... and before the exponentially weighted features
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_pts_mean_3 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_pts_std_3 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_min_mean_3 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_min_std_3 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_pts_mean_7 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_pts_std_7 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_min_mean_7 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_min_std_7 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_pts_mean_15 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_pts_std_15 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_min_mean_15 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ew_min_std_15 REAL;
+
+-- ... and before the rebound / assist / three features
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS rolling_reb_10 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS reb_std_10 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS rolling_ast_10 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS ast_std_10 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS rolling_fg3m_10 REAL;
+ALTER TABLE player_features_daily ADD COLUMN IF NOT EXISTS fg3m_std_10 REAL;
+
+-- latest row per player, and per game (also the DISTINCT ON (game_id, player_id) latest view);
+-- by-date reads prune to one partition and use the primary key
+CREATE INDEX IF NOT EXISTS idx_player_features_daily_player_date ON player_features_daily (player_id, as_of_date DESC);
+CREATE INDEX IF NOT EXISTS idx_player_features_daily_game_player ON player_features_daily (game_id, player_id);
 
 CREATE TABLE IF NOT EXISTS predictions_daily (
   as_of_date DATE NOT NULL,
@@ -62,8 +225,85 @@ CREATE TABLE IF NOT EXISTS predictions_daily (
   p25 REAL,
   p30 REAL,
 
+  conf20 REAL,
+  conf25 REAL,
+  conf30 REAL,
+
+  -- rebounds / assists / threes, same layout (src.distribution.STATS)
+  mu_reb REAL,
+  sigma_reb REAL,
+  reb_p4 REAL,
+  reb_p6 REAL,
+  reb_p8 REAL,
+  reb_p10 REAL,
+  reb_conf6 REAL,
+  reb_conf8 REAL,
+
+  mu_ast REAL,
+  sigma_ast REAL,
+  ast_p2 REAL,
+  ast_p4 REAL,
+  ast_p6 REAL,
+  ast_p8 REAL,
+  ast_conf4 REAL,
+  ast_conf6 REAL,
+
+  mu_fg3m REAL,
+  sigma_fg3m REAL,
+  fg3m_p1 REAL,
+  fg3m_p2 REAL,
+  fg3m_p3 REAL,
+  fg3m_p4 REAL,
+  fg3m_conf2 REAL,
+  fg3m_conf3 REAL,
+
   model_version TEXT,
   created_ts TIMESTAMP DEFAULT NOW(),
 
   PRIMARY KEY (as_of_date, game_id, player_id)
-);
+) PARTITION BY RANGE (as_of_date);
+
+CREATE INDEX IF NOT EXISTS idx_predictions_daily_player_date ON predictions_daily (player_id, as_of_date DESC);
+CREATE INDEX IF NOT EXISTS idx_predictions_daily_game_player ON predictions_daily (game_id, player_id);
+-- rows written since the export watermark (src/export.py), one index probe per partition
+CREATE INDEX IF NOT EXISTS idx_predictions_daily_created ON predictions_daily (created_ts);
+
+-- Existing databases created before the confidence columns were added
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS conf20 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS conf25 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS conf30 REAL;
+
+-- ... and before rebounds / assists / threes were scored
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS mu_reb REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS sigma_reb REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS reb_p4 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS reb_p6 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS reb_p8 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS reb_p10 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS reb_conf6 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS reb_conf8 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS mu_ast REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS sigma_ast REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS ast_p2 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS ast_p4 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS ast_p6 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS ast_p8 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS ast_conf4 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS ast_conf6 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS mu_fg3m REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS sigma_fg3m REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS fg3m_p1 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS fg3m_p2 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS fg3m_p3 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS fg3m_p4 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS fg3m_conf2 REAL;
+ALTER TABLE predictions_daily ADD COLUMN IF NOT EXISTS fg3m_conf3 REAL;
+
+-- Shadow predictions of challenger models (src/registry.py), written next to the champion's
+-- predictions_daily rows in the same scoring pass, one row per model version
+CREATE TABLE IF NOT EXISTS predictions_shadow (
+  LIKE predictions_daily INCLUDING DEFAULTS,
+  PRIMARY KEY (as_of_date, game_id, player_id, model_version)
+) PARTITION BY RANGE (as_of_date);
+
+CREATE INDEX IF NOT EXISTS idx_predictions_shadow_version_date ON predictions_shadow (model_version, as_of_date);
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+# On-disk cache of raw nba_api responses, one entry per (endpoint, params):
+#   <cache_dir>/<endpoint>/<key>.<i>.parquet   one zstd Parquet file per result frame
+#   <cache_dir>/<endpoint>/<key>.json          metadata, written last so it marks a complete entry
+#
+# Entries for finished games never expire. Anything else (games in progress, scoreboards of
+# today's slate) is only served for live_ttl seconds. When the cache grows past max_bytes the
+# least recently read entries are removed, down to EVICT_TO of max_bytes so a backfill doesn't
+# rescan the cache on every put once it sits at the cap. put() keeps a running byte total
+# (seeded from one scan) and only walks the cache directory when that total crosses max_bytes.
+
+CACHE_DIR = os.getenv("NBA_API_CACHE_DIR", os.path.join("data", "cache", "nba_api"))
+MAX_BYTES = int(float(os.getenv("NBA_API_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+LIVE_TTL_SECONDS = int(os.getenv("NBA_API_CACHE_LIVE_TTL", "300"))
+ENABLED = os.getenv("NBA_API_CACHE", "1") != "0"
+EVICT_TO = 0.9
+
+
+def cache_key(endpoint, params):
+    blob = json.dumps({"endpoint": endpoint, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES, live_ttl=LIVE_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.live_ttl = live_ttl
+        self.hits = 0
+        self.misses = 0
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def _paths(self, endpoint, params):
+        d = os.path.join(self.cache_dir, endpoint)
+        key = cache_key(endpoint, params)
+        return d, os.path.join(d, f"{key}.json"), os.path.join(d, key)
+
+    def get(self, endpoint, params):
+        _, meta_path, prefix = self._paths(endpoint, params)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            if not meta["final"] and time.time() - meta["created"] > self.live_ttl:
+                raise FileNotFoundError(meta_path)
+            frames = [pd.read_parquet(f"{prefix}.{i}.parquet") for i in range(meta["n_frames"])]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # mtime of the metadata file doubles as "last read" for eviction
+        os.utime(meta_path, None)
+        with self._lock:
+            self.hits += 1
+        return frames
+
+    def put(self, endpoint, params, frames, final):
+        d, meta_path, prefix = self._paths(endpoint, params)
+        os.makedirs(d, exist_ok=True)
+        try:
+            with open(meta_path, "r") as f:
+                replaced = json.load(f).get("bytes", 0)
+        except (OSError, json.JSONDecodeError):
+            replaced = 0
+
+        size = 0
+        for i, frame in enumerate(frames):
+            path = f"{prefix}.{i}.parquet"
+            tmp = f"{path}.tmp{threading.get_ident()}"
+            frame.to_parquet(tmp, compression="zstd", index=False)
+            os.replace(tmp, path)
+            size += os.path.getsize(path)
+
+        meta = {
+            "endpoint": endpoint,
+            "params": params,
+            "final": bool(final),
+            "created": time.time(),
+            "n_frames": len(frames),
+            "bytes": size,
+        }
+        tmp = f"{meta_path}.tmp{threading.get_ident()}"
+        with open(tmp, "w") as f:
+            json.dump(meta, f, default=str)
+        os.replace(tmp, meta_path)
+
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += size - replaced
+            over = self._bytes is None or self._bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        # Full scan of the cache directory; also resets the running total put() keeps
+        if not os.path.isdir(self.cache_dir):
+            with self._lock:
+                self._bytes = 0
+            return 0
+
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                meta_path = os.path.join(root, name)
+                try:
+                    with open(meta_path, "r") as f:
+                        meta = json.load(f)
+                    atime = os.path.getmtime(meta_path)
+                except (OSError, json.JSONDecodeError):
+                    continue
+                entries.append((atime, meta_path, meta.get("n_frames", 0), meta.get("bytes", 0)))
+                total += meta.get("bytes", 0)
+
+        removed = 0
+        with self._lock:
+            target = self.max_bytes * EVICT_TO if total > self.max_bytes else total
+            for _, meta_path, n_frames, size in sorted(entries):
+                if total <= target:
+                    break
+                prefix = meta_path[: -len(".json")]
+                for path in [meta_path] + [f"{prefix}.{i}.parquet" for i in range(n_frames)]:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+                removed += 1
+            self._bytes = total
+        return removed
+
+
+_default_cache = None
+
+
+def get_cache():
+    # Process-wide cache, or None when disabled with NBA_API_CACHE=0
+    global _default_cache
+    if not ENABLED:
+        return None
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
+
+
+def is_final_status(status):
+    return status is not None and str(status).strip().lower().startswith("final")
@@ -1,22 +1,158 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import text
+
 from src.db import get_engine
+from src.bulk_load import bulk_upsert
+from src.fetch import TokenBucket
+from src.instrument import pipeline_run
 from src.ingest_last7days import ingest_games, ingest_boxscores
 
+# Dates are spread over a small worker pool; every worker goes through the same token
+# bucket so the pool as a whole respects the API rate limit. Completed dates and games are
+# recorded in backfill_ledger, so a crashed or interrupted backfill only redoes what's left.
+
+DATE_WORKERS = 3
+GAME_WORKERS_PER_DATE = 2
+
+
 def daterange(start_date, end_date):
     d = start_date
     while d <= end_date:
         yield d
         d += timedelta(days=1)
 
-if __name__ == "__main__":
-    engine = get_engine()
 
-    # Pick a range that gives players enough history
-    start = datetime.strptime("2025-10-01", "%Y-%m-%d").date()
-    end   = datetime.strptime("2025-12-30", "%Y-%m-%d").date()
+def season_for_date(d):
+    # NBA seasons start in October: 2025-10-21 -> "2025-26"
+    start_year = d.year if d.month >= 8 else d.year - 1
+    return f"{start_year}-{(start_year + 1) % 100:02d}"
+
+
+def season_bounds(season):
+    start_year = int(season.split("-")[0])
+    return datetime(start_year, 10, 1).date(), datetime(start_year + 1, 6, 30).date()
+
+
+def done_items(engine, scope, keys):
+    if not keys:
+        return set()
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                """
+                SELECT item_key FROM backfill_ledger
+                WHERE scope = :scope AND status = 'done' AND item_key = ANY(:keys)
+                """
+            ),
+            {"scope": scope, "keys": list(keys)},
+        ).fetchall()
+    return {r[0] for r in rows}
+
+
+def record(engine, scope, keys, season, status, detail=None):
+    if not keys:
+        return
+    df = pd.DataFrame(
+        {
+            "scope": scope,
+            "item_key": list(keys),
+            "season": season,
+            "status": status,
+            "detail": detail,
+        }
+    )
+    with engine.begin() as conn:
+        bulk_upsert(conn, "backfill_ledger", df, ["scope", "item_key"], extra_set="updated_ts = NOW()")
+
+
+def backfill_date(engine, ds, season, limiter):
+    game_ids = ingest_games(engine, ds, limiter, season=season)
+
+    already = done_items(engine, "game", game_ids)
+    pending = [gid for gid in game_ids if gid not in already]
+    loaded = ingest_boxscores(engine, pending, limiter, max_workers=GAME_WORKERS_PER_DATE) if pending else []
+    record(engine, "game", loaded, season, "done")
 
-    for d in daterange(start, end):
-        ds = d.strftime("%Y-%m-%d")
-        print(f"\n=== {ds} ===")
-        game_ids = ingest_games(engine, ds)
-        ingest_boxscores(engine, game_ids)
+    failed = sorted(set(pending) - set(loaded))
+    record(engine, "game", failed, season, "failed", "boxscore fetch failed or empty")
+    if failed:
+        record(engine, "date", [ds], season, "failed", f"{len(failed)} of {len(game_ids)} games missing")
+    else:
+        record(engine, "date", [ds], season, "done", f"{len(game_ids)} games")
+    return len(game_ids), len(failed)
+
+
+def backfill(engine, start, end, season=None, workers=DATE_WORKERS, limiter=None):
+    limiter = limiter or TokenBucket()
+
+    dates = [d.strftime("%Y-%m-%d") for d in daterange(start, end)]
+    if not dates:
+        print(f"Backfill: no dates between {start} and {end}, nothing to do")
+        return
+    done = done_items(engine, "date", dates)
+    todo = [ds for ds in dates if ds not in done]
+    print(f"Backfill {dates[0]}..{dates[-1]}: {len(todo)} dates pending, {len(done)} already done")
+    if not todo:
+        return
+
+    def season_of(ds):
+        return season or season_for_date(datetime.strptime(ds, "%Y-%m-%d").date())
+
+    t0 = time.perf_counter()
+    n_done = n_games = n_failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(backfill_date, engine, ds, season_of(ds), limiter): ds for ds in todo}
+        for fut in as_completed(futures):
+            ds = futures[fut]
+            n_done += 1
+            try:
+                games, failed = fut.result()
+                n_games += games
+                n_failed += failed
+                msg = f"{games} games" + (f", {failed} failed" if failed else "")
+            except Exception as e:
+                n_failed += 1
+                msg = f"ERROR {e}"
+                record(engine, "date", [ds], season_of(ds), "failed", str(e)[:500])
+
+            elapsed = time.perf_counter() - t0
+            eta = elapsed / n_done * (len(todo) - n_done)
+            print(f"[{n_done}/{len(todo)}] {ds}: {msg} | elapsed {elapsed:.0f}s, eta {eta:.0f}s")
+
+    print(f"Backfill finished: {n_games} games over {len(todo)} dates, {n_failed} failures "
+          f"(rerun the same command to retry them)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill games and boxscores for a date range or season")
+    parser.add_argument("--season", help='e.g. "2024-25"; alone it covers Oct 1 - Jun 30 of that season')
+    parser.add_argument("--start", help="first date, YYYY-MM-DD")
+    parser.add_argument("--end", help="last date, YYYY-MM-DD (default: yesterday)")
+    parser.add_argument("--workers", type=int, default=DATE_WORKERS, help="dates processed in parallel")
+    args = parser.parse_args()
+
+    if args.season:
+        start, end = season_bounds(args.season)
+    elif args.start:
+        start, end = None, None
+    else:
+        parser.error("give --season and/or --start")
+
+    if args.start:
+        start = datetime.strptime(args.start, "%Y-%m-%d").date()
+    if args.end:
+        end = datetime.strptime(args.end, "%Y-%m-%d").date()
+    yesterday = datetime.utcnow().date() - timedelta(days=1)
+    end = min(end or yesterday, yesterday)
+
+    engine = get_engine()
+    with pipeline_run("backfill_games", engine):
+        backfill(engine, start, end, season=args.season, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
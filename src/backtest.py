@@ -0,0 +1,323 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+
+from src.distribution import CONF_THRESHOLDS, probs_ge, save_avg_sigma
+
+# Walk-forward backtest over the materialized training set (src.train_cache, rows sorted by
+# date). Origins step through the history every STEP_DAYS once MIN_TRAIN_DAYS are available;
+# each fold trains on everything before its origin and is scored on the next STEP_DAYS.
+#
+#   retrain  fit a fresh model per fold (last VAL_FRACTION of the training rows drives early
+#            stopping), folds run in parallel on a spawn process pool like src.sweep
+#   rescore  score every fold with the current model artifacts in one vectorized pass; fast,
+#            but rows before the model's own training cutoff are in-sample
+#
+# Metrics are computed once over all out-of-sample rows and split per fold with bincount:
+# Gaussian NLL, MAE, closed-form CRPS, a randomized PIT histogram (points are integers) and
+# reliability curves / Brier / ECE at the confidence thresholds. The mean predicted sigma is
+# the data-derived confidence normalizer; --write-normalizer saves it next to the model.
+# Models train on every stat head, the metrics are for points (head 0).
+#
+#   python -m src.backtest --workers 4 --epochs 20
+#   python -m src.backtest --mode rescore --write-normalizer
+
+OUTPUT_DIR = os.path.join("outputs", "backtest")
+STEP_DAYS = 14
+MIN_TRAIN_DAYS = 60
+VAL_FRACTION = 0.1
+PIT_BINS = 10
+RELIABILITY_BINS = 10
+
+_worker_data = None
+
+
+def walk_forward_folds(dates, step_days=STEP_DAYS, min_train_days=MIN_TRAIN_DAYS, start=None, end=None):
+    # Row ranges per fold; training is rows[:test_start], testing rows[test_start:test_end]
+    days = np.asarray(dates).astype("datetime64[D]").astype(np.int64)
+    if len(days) == 0:
+        return []
+    origin = days[0] + min_train_days
+    if start is not None:
+        origin = max(origin, np.datetime64(start, "D").astype(np.int64))
+    last = days[-1] if end is None else min(days[-1], np.datetime64(end, "D").astype(np.int64))
+
+    folds = []
+    while origin <= last:
+        a = int(np.searchsorted(days, origin, side="left"))
+        b = int(np.searchsorted(days, min(origin + step_days, last + 1), side="left"))
+        if b > a:
+            folds.append({
+                "fold": len(folds),
+                "origin": str(np.datetime64(int(origin), "D")),
+                "test_start": a,
+                "test_end": b,
+            })
+        origin += step_days
+    return folds
+
+
+def _init_worker(data_path, threads):
+    from src.sweep import pin_threads
+    from src.train_cache import load_training_set
+
+    pin_threads(threads)
+    global _worker_data
+    _worker_data = load_training_set(data_path)[:3]
+
+
+def run_fold(fold, cfg):
+    # Trains on everything before the fold's origin, returns (fold, mu, sigma, info)
+    from sklearn.preprocessing import StandardScaler
+    from src.train_cache import time_split_index
+    from src.train_model import train
+
+    X, y, dates = _worker_data
+    a, b = fold["test_start"], fold["test_end"]
+    v = time_split_index(dates[:a], 1.0 - VAL_FRACTION)
+    if v == 0 or v == a:
+        raise ValueError(f"fold {fold['fold']} has too little history to split off a validation set")
+
+    t0 = time.perf_counter()
+    scaler = StandardScaler().fit(X[:v])
+    model, history = train(
+        scaler.transform(X[:v]).astype(np.float32), np.asarray(y[:v]).reshape(v, -1),
+        scaler.transform(X[v:a]).astype(np.float32), np.asarray(y[v:a]).reshape(a - v, -1),
+        epochs=cfg["epochs"],
+        batch_size=cfg["batch_size"],
+        learning_rate=cfg["learning_rate"],
+        patience=cfg["patience"],
+        seed=cfg["seed"],
+        verbose=False,
+    )
+    mu, log_var = model.predict(scaler.transform(X[a:b]).astype(np.float32), batch_size=4096, verbose=0)
+    info = {"train_rows": v, "epochs_run": len(history), "fit_seconds": round(time.perf_counter() - t0, 1)}
+    return fold, mu[:, 0], np.sqrt(np.exp(log_var[:, 0])), info
+
+
+def retrain_folds(data_path, folds, cfg, workers, threads_per_worker):
+    n = folds[-1]["test_end"] - folds[0]["test_start"]
+    mu, sigma = np.full(n, np.nan), np.full(n, np.nan)
+    infos = {}
+    offset = folds[0]["test_start"]
+
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(data_path, threads_per_worker),
+    ) as pool:
+        futures = {pool.submit(run_fold, fold, cfg): fold for fold in folds}
+        for i, fut in enumerate(as_completed(futures), start=1):
+            fold = futures[fut]
+            try:
+                fold, m, s, info = fut.result()
+            except Exception as e:
+                print(f"[{i}/{len(folds)}] fold {fold['fold']} ({fold['origin']}) FAILED: {e}")
+                continue
+            a, b = fold["test_start"] - offset, fold["test_end"] - offset
+            mu[a:b], sigma[a:b] = m, s
+            infos[fold["fold"]] = info
+            print(f"[{i}/{len(folds)}] fold {fold['fold']} ({fold['origin']}): {info['train_rows']} train rows, "
+                  f"{b - a} test rows, {info['epochs_run']} epochs in {info['fit_seconds']}s")
+    return mu, sigma, infos
+
+
+def rescore_folds(X, folds, backend=None, version=None):
+    from src.score_today import load_model_handle
+    from src.train_model import FEATURES
+
+    a, b = folds[0]["test_start"], folds[-1]["test_end"]
+    handle = load_model_handle(backend, version)
+    mu, sigma = handle.predict(pd.DataFrame(np.asarray(X[a:b]), columns=FEATURES))
+    j = handle.stats.index("pts")
+    return mu[:, j], sigma[:, j], {}
+
+
+def row_metrics(y, mu, sigma):
+    # Per-row Gaussian NLL, absolute error and CRPS (closed form for a normal forecast)
+    z = (y - mu) / sigma
+    nll = 0.5 * np.log(2.0 * np.pi * sigma ** 2) + 0.5 * z ** 2
+    pdf = np.exp(-0.5 * z ** 2) / np.sqrt(2.0 * np.pi)
+    crps = sigma * (z * (2.0 * ndtr(z) - 1.0) + 2.0 * pdf - 1.0 / np.sqrt(np.pi))
+    return {"nll": nll, "mae": np.abs(y - mu), "crps": crps}
+
+
+def randomized_pit(y, mu, sigma, seed=0):
+    # Points are integers: draw uniformly between F(y - 1) and F(y), with the same continuity
+    # correction as probs_ge, so a calibrated model gives a flat histogram
+    lo = ndtr((y - 0.5 - mu) / sigma)
+    hi = ndtr((y + 0.5 - mu) / sigma)
+    return lo + np.random.default_rng(seed).random(len(y)) * (hi - lo)
+
+
+def evaluate(y, mu, sigma, fold_idx, n_folds, thresholds=CONF_THRESHOLDS):
+    # Overall and per-fold metrics in a handful of vectorized passes
+    y, mu, sigma = (np.asarray(a, dtype=float).reshape(-1) for a in (y, mu, sigma))
+    per_fold_n = np.bincount(fold_idx, minlength=n_folds)
+    safe_n = np.maximum(per_fold_n, 1)
+
+    rows = row_metrics(y, mu, sigma)
+    overall = {k: float(v.mean()) for k, v in rows.items()}
+    folds = {k: np.bincount(fold_idx, weights=v, minlength=n_folds) / safe_n for k, v in rows.items()}
+
+    pit = randomized_pit(y, mu, sigma)
+    pit_bin = np.minimum((pit * PIT_BINS).astype(int), PIT_BINS - 1)
+    pit_hist = np.bincount(pit_bin, minlength=PIT_BINS) / len(y)
+    fold_hist = np.bincount(fold_idx * PIT_BINS + pit_bin, minlength=n_folds * PIT_BINS).reshape(n_folds, PIT_BINS)
+    folds["pit_dev"] = np.abs(fold_hist / safe_n[:, None] - 1.0 / PIT_BINS).sum(axis=1)
+    overall["pit_dev"] = float(np.abs(pit_hist - 1.0 / PIT_BINS).sum())
+    for c in (0.5, 0.8, 0.9):
+        overall[f"cov{int(c * 100)}"] = float(np.mean(np.abs(pit - 0.5) <= c / 2))
+
+    probs = probs_ge(mu, sigma, thresholds)
+    hits = (y.reshape(-1, 1) >= np.asarray(thresholds).reshape(1, -1)).astype(float)
+    n_t = len(thresholds)
+    bins = np.minimum((probs * RELIABILITY_BINS).astype(int), RELIABILITY_BINS - 1) + RELIABILITY_BINS * np.arange(n_t)
+    size = n_t * RELIABILITY_BINS
+    counts = np.bincount(bins.ravel(), minlength=size)
+    mean_p = np.bincount(bins.ravel(), weights=probs.ravel(), minlength=size) / np.maximum(counts, 1)
+    freq = np.bincount(bins.ravel(), weights=hits.ravel(), minlength=size) / np.maximum(counts, 1)
+    sq = (probs - hits) ** 2
+
+    reliability = {}
+    for j, k in enumerate(thresholds):
+        sl = slice(j * RELIABILITY_BINS, (j + 1) * RELIABILITY_BINS)
+        c = counts[sl]
+        overall[f"brier{k}"] = float(sq[:, j].mean())
+        overall[f"ece{k}"] = float(np.sum(c * np.abs(mean_p[sl] - freq[sl])) / len(y))
+        folds[f"brier{k}"] = np.bincount(fold_idx, weights=sq[:, j], minlength=n_folds) / safe_n
+        reliability[str(k)] = [
+            {"bin": i, "n": int(c[i]), "mean_p": round(float(mean_p[sl][i]), 4), "hit_rate": round(float(freq[sl][i]), 4)}
+            for i in range(RELIABILITY_BINS) if c[i]
+        ]
+
+    overall["avg_sigma"] = float(sigma.mean())
+    folds["avg_sigma"] = np.bincount(fold_idx, weights=sigma, minlength=n_folds) / safe_n
+    folds["rows"] = per_fold_n
+    return overall, folds, [round(float(h), 4) for h in pit_hist], reliability
+
+
+def run_backtest(engine, mode="retrain", step_days=STEP_DAYS, min_train_days=MIN_TRAIN_DAYS, start=None, end=None,
+                 cfg=None, workers=1, threads_per_worker=2, backend=None, refresh=False, version=None):
+    # version: registered model for --mode rescore (default: the champion)
+    from src.score_today import SIGMA_MAX, SIGMA_MIN
+    from src.train_cache import load_training_set, materialize
+    from src.train_model import FEATURES, TARGETS
+
+    data_path = materialize(engine, FEATURES, TARGETS, refresh=refresh)
+    X, y, dates, index = load_training_set(data_path)
+    y_pts = np.asarray(y).reshape(len(y), -1)[:, 0]
+    folds = walk_forward_folds(dates, step_days, min_train_days, start, end)
+    if not folds:
+        raise ValueError(f"no folds: {len(y)} rows, need more than {min_train_days} days of history")
+    print(f"{len(folds)} folds of {step_days} days from {folds[0]['origin']} ({mode}, data {index['version']})")
+
+    t0 = time.perf_counter()
+    if mode == "retrain":
+        mu, sigma, infos = retrain_folds(data_path, folds, cfg, workers, threads_per_worker)
+    else:
+        mu, sigma, infos = rescore_folds(X, folds, backend, version)
+
+    a, b = folds[0]["test_start"], folds[-1]["test_end"]
+    fold_idx = np.repeat(np.arange(len(folds)), [f["test_end"] - f["test_start"] for f in folds])
+    ok = np.isfinite(mu) & np.isfinite(sigma)
+    sigma = np.clip(sigma, SIGMA_MIN, SIGMA_MAX)  # same clamp as the scorers
+    overall, per_fold, pit_hist, reliability = evaluate(
+        y_pts[a:b][ok], mu[ok], sigma[ok], fold_idx[ok], len(folds)
+    )
+
+    fold_rows = []
+    for f in folds:
+        row = {"fold": f["fold"], "origin": f["origin"], "train_rows": f["test_start"]}
+        row.update({k: (int(v[f["fold"]]) if k == "rows" else round(float(v[f["fold"]]), 4)) for k, v in per_fold.items()})
+        row.update(infos.get(f["fold"], {}))
+        fold_rows.append(row)
+
+    return {
+        "mode": mode,
+        "data_version": index["version"],
+        "seconds": round(time.perf_counter() - t0, 1),
+        "rows": int(ok.sum()),
+        "overall": {k: round(v, 4) for k, v in overall.items()},
+        "pit_hist": pit_hist,
+        "reliability": reliability,
+        "folds": fold_rows,
+        "config": cfg,
+    }
+
+
+def print_report(result):
+    o = result["overall"]
+    folds = pd.DataFrame(result["folds"])
+    cols = [c for c in ["fold", "origin", "rows", "nll", "mae", "crps", "pit_dev", "brier20", "avg_sigma",
+                        "epochs_run"] if c in folds.columns]
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(folds[cols].to_string(index=False))
+    print(f"\n{result['rows']} out-of-sample rows, {len(folds)} folds, {result['seconds']}s ({result['mode']})")
+    print(f"NLL {o['nll']:.4f}  MAE {o['mae']:.3f}  CRPS {o['crps']:.3f}  "
+          f"coverage 50/80/90: {o['cov50']:.3f}/{o['cov80']:.3f}/{o['cov90']:.3f}")
+    print("PIT histogram: " + " ".join(f"{h:.3f}" for h in result["pit_hist"]))
+    for k in CONF_THRESHOLDS:
+        curve = " ".join(f"{r['mean_p']:.2f}->{r['hit_rate']:.2f}" for r in result["reliability"][str(k)])
+        print(f"P{k}: brier {o[f'brier{k}']:.4f}  ece {o[f'ece{k}']:.4f}  | {curve}")
+    print(f"confidence normalizer (mean sigma): {o['avg_sigma']:.3f}")
+
+
+def main():
+    from src.db import get_engine
+    from src.registry import artifact_paths, champion
+    from src.train_model import BATCH_SIZE, LEARNING_RATE
+
+    parser = argparse.ArgumentParser(description="Walk-forward backtest with calibration metrics")
+    parser.add_argument("--mode", choices=["retrain", "rescore"], default="retrain")
+    parser.add_argument("--step-days", type=int, default=STEP_DAYS)
+    parser.add_argument("--min-train-days", type=int, default=MIN_TRAIN_DAYS)
+    parser.add_argument("--start", help="first origin (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last test date (YYYY-MM-DD)")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--patience", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--learning-rate", type=float, default=LEARNING_RATE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--threads-per-worker", type=int, default=2)
+    parser.add_argument("--backend", help="scoring backend for --mode rescore")
+    parser.add_argument("--version", help="registered model for --mode rescore and --write-normalizer (default: the champion)")
+    parser.add_argument("--refresh-data", action="store_true", help="re-export the training set even if unchanged")
+    parser.add_argument("--write-normalizer", action="store_true",
+                        help="save the mean out-of-sample sigma as the model version's confidence normalizer")
+    args = parser.parse_args()
+
+    cfg = {"epochs": args.epochs, "patience": args.patience, "batch_size": args.batch_size,
+           "learning_rate": args.learning_rate, "seed": args.seed}
+    result = run_backtest(
+        get_engine(), args.mode, args.step_days, args.min_train_days, args.start, args.end,
+        cfg if args.mode == "retrain" else None, args.workers, args.threads_per_worker, args.backend, args.refresh_data,
+        args.version,
+    )
+    print_report(result)
+
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    out = os.path.join(OUTPUT_DIR, f"backtest_{args.mode}_{stamp}.json")
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {out}")
+
+    if args.write_normalizer:
+        calibration_path = artifact_paths(args.version or champion())["calibration"]
+        save_avg_sigma(calibration_path, result["overall"]["avg_sigma"], source=f"backtest {args.mode} {stamp}",
+                       rows=result["rows"], data_version=result["data_version"])
+        print(f"confidence normalizer written to {calibration_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from statistics import median
+
+import numpy as np
+
+from sqlalchemy import create_engine
+
+from src.bench.synth import generate, load
+from src.instrument import pipeline_run
+
+# Timed scenarios over synthetic data, in a throwaway Postgres schema (search_path), so the
+# real tables are never touched. The pipeline needs COPY, DISTINCT ON and window aggregates,
+# so there is no SQLite mode. Results land in outputs/bench/<stamp>_<commit>.json and are
+# compared against the previous results file.
+#
+#   python -m src.bench.run --sizes small,medium --repeat 3
+#   python -m src.bench.run --compare outputs/bench/<older>.json
+
+SCHEMA = "nba_bench"
+OUTPUT_DIR = os.path.join("outputs", "bench")
+SCHEMA_SQL = os.path.join("sql", "schema.sql")
+
+SIZES = {
+    "small": {"n_teams": 8, "players_per_team": 12, "seasons": 1},
+    "medium": {"n_teams": 30, "players_per_team": 14, "seasons": 1},
+    "large": {"n_teams": 30, "players_per_team": 15, "seasons": 3},
+}
+SCENARIOS = [
+    "load",
+    "build_features",
+    "build_features_incremental",
+    "model_load",
+    "score_today",
+    "score_today_cached",
+    "score_historical",
+    "train_materialize",
+    "train_fit",
+]
+
+# Stand-ins for the two views the scorers / trainer read, which live in the production
+# database rather than in sql/: latest feature row per game and player, and the same rows
+# labeled with the points actually scored in that game.
+VIEWS_SQL = """
+CREATE OR REPLACE VIEW v_player_features_latest AS
+SELECT DISTINCT ON (game_id, player_id) *
+FROM player_features_daily
+ORDER BY game_id, player_id, as_of_date DESC;
+
+CREATE OR REPLACE VIEW player_model_train AS
+SELECT f.*, s.points AS next_points, s.rebounds AS next_rebounds, s.assists AS next_assists,
+       s.threes AS next_threes, g.game_date AS next_game_date
+FROM v_player_features_latest f
+JOIN player_game_stats s ON s.game_id = f.game_id AND s.player_id = f.player_id
+JOIN games g ON g.game_id = f.game_id;
+"""
+
+
+def bench_engine(url, schema=SCHEMA):
+    # Fresh schema with the repo's DDL; every connection from the engine sees only it
+    admin = create_engine(url, isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        conn.exec_driver_sql(f"CREATE SCHEMA {schema}")
+    admin.dispose()
+
+    engine = create_engine(url, connect_args={"options": f"-csearch_path={schema}"})
+    with open(SCHEMA_SQL, "r") as f:
+        ddl = f.read()
+    with engine.begin() as conn:
+        conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql(VIEWS_SQL)
+    return engine
+
+
+def drop_schema(engine, schema=SCHEMA):
+    engine.dispose()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    engine.dispose()
+
+
+def timed(out, name, fn):
+    # fn returns a row count (or None); spans recorded during the call are kept with it
+    with pipeline_run(f"bench.{name}", quiet=True) as rec:
+        t0 = time.perf_counter()
+        rows = fn()
+        seconds = time.perf_counter() - t0
+    out[name] = {"seconds": round(seconds, 4), "rows": rows, "spans": rec.summary()}
+    rate = f", {rows / seconds:,.0f} rows/s" if rows and seconds > 0 else ""
+    print(f"  {name:<28} {seconds:>9.3f}s{rate}")
+
+
+def run_once(url, size, backend, work_dir, skip_train, train_epochs, seed):
+    # Imported here: the prediction cache reads PREDICTION_CACHE_DIR at import time and
+    # main() points it at the scratch directory first.
+    from src.build_features import build_features
+    from src.score_historical import score_historical
+    from src.score_today import load_model_handle, score_today
+
+    teams, players, games, stats = generate(**SIZES[size], seed=seed)
+    last_date = games["game_date"].max()
+    late_games = games.loc[games["game_date"] == last_date, "game_id"]
+    late = stats["game_id"].isin(late_games)
+
+    engine = bench_engine(url)
+    res = {}
+    try:
+        timed(res, "load", lambda: load(engine, teams, players, games, stats[~late]))
+        timed(res, "build_features", lambda: build_features(engine, incremental=False))
+        load(engine, teams.iloc[:0], players.iloc[:0], games.iloc[:0], stats[late])
+        timed(res, "build_features_incremental", lambda: build_features(engine, incremental=True))
+
+        handle = load_model_handle(backend)
+        timed(res, "model_load", lambda: handle.load() and None)
+        timed(res, "score_today", lambda: score_today(engine, [handle], use_cache=False))
+        score_today(engine, [handle], use_cache=True)  # warm the prediction cache
+        timed(res, "score_today_cached", lambda: score_today(engine, [handle], use_cache=True))
+        checkpoint = os.path.join(work_dir, "score_historical_checkpoint.json")
+        timed(res, "score_historical",
+              lambda: score_historical(engine, [handle], checkpoint_path=checkpoint, use_cache=False))
+
+        if not skip_train:
+            from src.train_cache import load_training_set, materialize, time_split_index
+            from src.train_model import FEATURES, TARGETS, train
+
+            cache_dir = os.path.join(work_dir, "train")
+            paths = []
+
+            def export():
+                paths.append(materialize(engine, FEATURES, TARGETS, cache_dir=cache_dir))
+                return load_training_set(paths[0])[3]["n_rows"]
+
+            timed(res, "train_materialize", export)
+
+            X, y, dates, _ = load_training_set(paths[0])
+            split = time_split_index(dates)
+            X = (X - X[:split].mean(axis=0)) / (X[:split].std(axis=0) + 1e-6)
+            y = np.asarray(y).reshape(len(y), -1)
+
+            def fit():
+                _, history = train(X[:split], y[:split], X[split:], y[split:],
+                                   epochs=train_epochs, patience=train_epochs + 1, seed=0, verbose=False)
+                return len(history) * split
+
+            timed(res, "train_fit", fit)
+    finally:
+        drop_schema(engine)
+
+    data = {"teams": len(teams), "players": len(players), "games": len(games), "player_game_stats": len(stats)}
+    return data, res
+
+
+def git_state():
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(status)}
+
+
+def aggregate(runs):
+    # Median seconds per scenario over the repetitions (spans from the median run)
+    out = {}
+    for name in SCENARIOS:
+        got = [r[name] for r in runs if name in r]
+        if not got:
+            continue
+        got.sort(key=lambda r: r["seconds"])
+        mid = got[len(got) // 2]
+        out[name] = {
+            "seconds": round(median(r["seconds"] for r in got), 4),
+            "all": [r["seconds"] for r in got],
+            "rows": mid["rows"],
+            "spans": mid["spans"],
+        }
+    return out
+
+
+def latest_results(exclude=None):
+    paths = sorted(p for p in glob.glob(os.path.join(OUTPUT_DIR, "*.json")) if p != exclude)
+    return paths[-1] if paths else None
+
+
+def compare(base_path, new):
+    with open(base_path, "r") as f:
+        base = json.load(f)
+    print(f"\n=== vs {os.path.basename(base_path)} (commit {base.get('commit')}) ===")
+    print(f"{'size':<8} {'scenario':<28} {'base':>9} {'new':>9} {'ratio':>7}")
+    for size, cur in new["results"].items():
+        old = base["results"].get(size)
+        if old is None:
+            continue
+        if old["data"] != cur["data"]:
+            print(f"{size:<8} (data differs, different generator or seed; skipped)")
+            continue
+        for name, sc in cur["scenarios"].items():
+            if name not in old["scenarios"]:
+                continue
+            a, b = old["scenarios"][name]["seconds"], sc["seconds"]
+            ratio = b / a if a > 0 else float("inf")
+            flag = "  slower" if ratio > 1.2 else ("  faster" if ratio < 0.8 else "")
+            print(f"{size:<8} {name:<28} {a:>8.3f}s {b:>8.3f}s {ratio:>6.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic seasons")
+    parser.add_argument("--sizes", default="small,medium", help=f"comma separated, from {', '.join(SIZES)}")
+    parser.add_argument("--repeat", type=int, default=1, help="repetitions per size (median is reported)")
+    parser.add_argument("--backend", default="numpy", help="scoring backend (numpy, keras or auto)")
+    parser.add_argument("--skip-train", action="store_true", help="skip the TensorFlow scenarios")
+    parser.add_argument("--train-epochs", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="Postgres URL (default: BENCH_DATABASE_URL, else the .env database)")
+    parser.add_argument("--compare", help="results file to compare against (default: the previous one)")
+    parser.add_argument("--compare-only", action="store_true", help="just compare --compare with the latest results")
+    args = parser.parse_args()
+
+    if args.compare_only:
+        latest = latest_results(exclude=args.compare)
+        with open(latest, "r") as f:
+            compare(args.compare, json.load(f))
+        return
+
+    sizes = [s for s in args.sizes.split(",") if s]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes {unknown}, pick from {list(SIZES)}")
+
+    url = args.url
+    if url is None:
+        from src.config import DATABASE_URL
+        url = DATABASE_URL
+
+    work_dir = tempfile.mkdtemp(prefix="nba_bench_")
+    os.environ["PREDICTION_CACHE_DIR"] = os.path.join(work_dir, "predictions")
+    try:
+        results = {}
+        for size in sizes:
+            runs = []
+            for i in range(args.repeat):
+                print(f"\n=== {size} ({i + 1}/{args.repeat}) {SIZES[size]} ===")
+                data, res = run_once(url, size, args.backend, work_dir, args.skip_train, args.train_epochs, args.seed)
+                runs.append(res)
+                shutil.rmtree(os.environ["PREDICTION_CACHE_DIR"], ignore_errors=True)
+            results[size] = {"data": data, "scenarios": aggregate(runs)}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    out = {
+        **git_state(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "args": {"repeat": args.repeat, "backend": args.backend, "train_epochs": args.train_epochs, "seed": args.seed},
+        "results": results,
+    }
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(OUTPUT_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}_{out['commit'] or 'nogit'}.json")
+    with open(path, "w") as f:
+        json.dump(out, f, indent=2, default=str)
+    print(f"\nresults written to {path}")
+
+    base = args.compare or latest_results(exclude=path)
+    if base:
+        compare(base, out)
+
+if __name__ == "__main__":
+    main()
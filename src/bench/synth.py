@@ -0,0 +1,109 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from src.bulk_load import bulk_upsert
+
+# Synthetic seasons shaped like the real tables: an ~82 game schedule per team spread over
+# ~170 days (back-to-backs included), rotations of decreasing minutes, per-player scoring
+# rates, DNPs, and a per-team-game pace factor so teammates' points are correlated.
+# Rebounds, assists and threes are Poisson in minutes at per-player rates.
+# Everything comes from one seed, so a given size always produces the same data.
+
+SEASON_DAYS = 170
+GAMES_PER_TEAM = 82
+FIRST_TEAM_ID = 1610612737
+FIRST_PLAYER_ID = 1_000_001
+
+
+def _season_schedule(rng, team_ids, season_start):
+    n_teams = len(team_ids)
+    played = np.zeros(n_teams, dtype=int)
+    per_day = 1.1 * GAMES_PER_TEAM * n_teams / (2 * SEASON_DAYS)  # a little slack for the cap below
+    rows = []
+    for day in range(SEASON_DAYS):
+        k = min(n_teams // 2, rng.poisson(per_day))
+        if k == 0:
+            continue
+        # teams furthest behind on games go first, with some noise
+        order = np.argsort(played + rng.random(n_teams) * 3)
+        playing = rng.permutation(order[: 2 * k])
+        for home, away in zip(playing[::2], playing[1::2]):
+            if played[home] >= GAMES_PER_TEAM or played[away] >= GAMES_PER_TEAM:
+                continue
+            played[home] += 1
+            played[away] += 1
+            rows.append((season_start + timedelta(days=day), team_ids[home], team_ids[away]))
+
+    yy = season_start.year % 100
+    return pd.DataFrame(
+        {
+            "game_id": [f"002{yy:02d}{i + 1:05d}" for i in range(len(rows))],
+            "game_date": [r[0] for r in rows],
+            "season": f"{season_start.year}-{(season_start.year + 1) % 100:02d}",
+            "home_team_id": [int(r[1]) for r in rows],
+            "away_team_id": [int(r[2]) for r in rows],
+            "status": "Final",
+        }
+    )
+
+
+def generate(n_teams=30, players_per_team=14, seasons=1, first_season=2022, seed=0):
+    # Returns (teams, players, games, player_game_stats) DataFrames
+    rng = np.random.default_rng(seed)
+    team_ids = np.arange(FIRST_TEAM_ID, FIRST_TEAM_ID + n_teams)
+    teams = pd.DataFrame(
+        {"team_id": team_ids, "team_abbr": [f"T{i:02d}" for i in range(n_teams)],
+         "team_name": [f"Team {i}" for i in range(n_teams)]}
+    )
+
+    n_players = n_teams * players_per_team
+    player_ids = np.arange(FIRST_PLAYER_ID, FIRST_PLAYER_ID + n_players)
+    players = pd.DataFrame({"player_id": player_ids, "player_name": [f"Player {p}" for p in player_ids]})
+
+    # roster slot 0 is the star: most minutes and, on average, the highest scoring rate
+    slot = np.tile(np.arange(players_per_team), n_teams)
+    base_minutes = np.clip(36.0 - 2.4 * slot, 4.0, None)
+    rate = np.exp(rng.normal(np.log(0.50) - 0.025 * slot, 0.22))  # points per minute
+    play_prob = np.clip(0.97 - 0.02 * slot, 0.6, None)
+    # rebounds / assists / threes per minute, from their own generator so points stay as before
+    extra = np.random.default_rng([seed, 1])
+    extra_rate = {
+        "rebounds": np.exp(extra.normal(np.log(0.18), 0.35, n_players)),
+        "assists": np.exp(extra.normal(np.log(0.10), 0.45, n_players)),
+        "threes": np.exp(extra.normal(np.log(0.045), 0.5, n_players)),
+    }
+    roster = {t: np.flatnonzero(np.repeat(team_ids, players_per_team) == t) for t in team_ids}
+
+    games = pd.concat(
+        [_season_schedule(rng, team_ids, date(first_season + s, 10, 22)) for s in range(seasons)],
+        ignore_index=True,
+    )
+
+    cols = {"game_id": [], "player_id": [], "team_id": [], "minutes": [], "points": [],
+            "rebounds": [], "assists": [], "threes": []}
+    for g in games.itertuples(index=False):
+        for team in (g.home_team_id, g.away_team_id):
+            idx = roster[team]
+            idx = idx[rng.random(len(idx)) < play_prob[idx]]
+            pace = np.exp(rng.normal(0.0, 0.08))  # shared by the whole team this game
+            minutes = np.clip(rng.normal(base_minutes[idx], 5.0), 1.0, 48.0)
+            cols["game_id"].append(np.full(len(idx), g.game_id, dtype=object))
+            cols["player_id"].append(player_ids[idx])
+            cols["team_id"].append(np.full(len(idx), team))
+            cols["minutes"].append(np.round(minutes, 2))
+            cols["points"].append(rng.poisson(rate[idx] * minutes * pace))
+            for c, r in extra_rate.items():
+                cols[c].append(extra.poisson(r[idx] * minutes))
+    stats = pd.DataFrame({c: np.concatenate(v) for c, v in cols.items()})
+    return teams, players, games, stats
+
+
+def load(engine, teams, players, games, stats):
+    with engine.begin() as conn:
+        bulk_upsert(conn, "teams", teams, ["team_id"])
+        bulk_upsert(conn, "players", players, ["player_id"])
+        bulk_upsert(conn, "games", games, ["game_id"])
+        bulk_upsert(conn, "player_game_stats", stats, ["game_id", "player_id"], on_conflict="nothing")
+    return len(stats)
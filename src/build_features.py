@@ -1,31 +1,103 @@
+import argparse
 from datetime import date
 import pandas as pd
 from sqlalchemy import text
-from src.db import get_engine
+from src.db import INGEST_APP, get_engine, open_writer_cap
+from src.bulk_load import bulk_upsert
+from src.ewma import ew_features, feature_columns as ew_feature_columns, save_states as save_ewm_states
+from src.instrument import count, pipeline_run, span
+from src.partitions import ensure_partitions
+from src.team_aggregates import TEAM_WINDOW_SQL, TIER_CASE_SQL, refresh_team_aggregates
 import numpy as np
 
 
-def build_features(engine):
-    # We compute features for rows that exist in player_game_stats (your labels table)
-    # and write one row per (as_of_date, game_id, player_id) into player_features_daily.
+WATERMARK_NAME = "build_features"
 
-    q = """
-    WITH base AS (
-        SELECT
+# Upper bound of a build: the newest ingested_ts, kept below the start of every ingest
+# transaction still open (src.db.open_writer_cap). ingested_ts is the writing transaction's
+# start time (DEFAULT NOW()), so an ingest that started before this read but commits after it
+# writes rows at or below MAX(ingested_ts); with the cap they fall after the watermark and the
+# next build picks them up.
+HIGH_WATERMARK_SQL = "SELECT MAX(ingested_ts) FROM player_game_stats"
+
+# Feature rows missing any of these are not written
+REQUIRED_COLUMNS = [
+    "rolling_pts_10", "pts_std_10", "rolling_min_10",
+    "opp_pts_allowed_10", "opp_pts_allowed_tier_10", "opp_pace_10", "team_pace_10",
+    *ew_feature_columns(),
+]
+
+# Rows of player_game_stats joined to their game, shared by the full and incremental builds
+BASE_COLUMNS = """
             pgs.game_id,
             pgs.player_id,
             pgs.team_id,
             pgs.minutes,
             pgs.points,
+            pgs.rebounds,
+            pgs.assists,
+            pgs.threes,
             g.game_date::date AS game_date,
             g.home_team_id,
             g.away_team_id,
             CASE WHEN pgs.team_id = g.home_team_id THEN 1 ELSE 0 END AS home_flag,
             CASE WHEN pgs.team_id = g.home_team_id THEN g.away_team_id ELSE g.home_team_id END AS opponent_team_id
+"""
+
+FULL_BASE_SQL = f"""
+    base AS (
+        SELECT
+            {BASE_COLUMNS},
+            TRUE AS is_target
+        FROM player_game_stats pgs
+        JOIN games g ON g.game_id = pgs.game_id
+        WHERE g.game_date IS NOT NULL
+    ),
+"""
+
+# Only players with game logs ingested after the watermark. For each of them we keep
+# every game from their earliest changed game onwards (these are the rows we write)
+# plus the 10 games before it, which is all the rolling windows can look back at.
+INCREMENTAL_BASE_SQL = f"""
+    changed AS (
+        SELECT pgs.player_id, MIN(g.game_date::date) AS first_changed
         FROM player_game_stats pgs
         JOIN games g ON g.game_id = pgs.game_id
         WHERE g.game_date IS NOT NULL
+          AND pgs.ingested_ts > :watermark
+          AND pgs.ingested_ts <= :high_watermark
+        GROUP BY pgs.player_id
+    ),
+    prior AS (
+        SELECT
+            {BASE_COLUMNS},
+            ROW_NUMBER() OVER (PARTITION BY pgs.player_id ORDER BY g.game_date DESC) AS rn
+        FROM player_game_stats pgs
+        JOIN games g ON g.game_id = pgs.game_id
+        JOIN changed c ON c.player_id = pgs.player_id
+        WHERE g.game_date::date < c.first_changed
+    ),
+    base AS (
+        SELECT
+            {BASE_COLUMNS},
+            TRUE AS is_target
+        FROM player_game_stats pgs
+        JOIN games g ON g.game_id = pgs.game_id
+        JOIN changed c ON c.player_id = pgs.player_id
+        WHERE g.game_date::date >= c.first_changed
+
+        UNION ALL
+
+        SELECT
+            game_id, player_id, team_id, minutes, points, rebounds, assists, threes, game_date,
+            home_team_id, away_team_id, home_flag, opponent_team_id,
+            FALSE AS is_target
+        FROM prior
+        WHERE rn <= 10
     ),
+"""
+
+WINDOW_SQL = TEAM_WINDOW_SQL + f"""
     w AS (
         SELECT
             b.*,
@@ -41,48 +113,139 @@ def build_features(engine):
             AVG(b.minutes) OVER (PARTITION BY b.player_id ORDER BY b.game_date ROWS BETWEEN 5 PRECEDING AND 1 PRECEDING)  AS rolling_min_5,
             AVG(b.minutes) OVER (PARTITION BY b.player_id ORDER BY b.game_date ROWS BETWEEN 10 PRECEDING AND 1 PRECEDING) AS rolling_min_10,
 
-            STDDEV_SAMP(b.minutes) OVER (PARTITION BY b.player_id ORDER BY b.game_date ROWS BETWEEN 10 PRECEDING AND 1 PRECEDING) AS min_std_10
+            STDDEV_SAMP(b.minutes) OVER (PARTITION BY b.player_id ORDER BY b.game_date ROWS BETWEEN 10 PRECEDING AND 1 PRECEDING) AS min_std_10,
+
+            AVG(b.rebounds) OVER (PARTITION BY b.player_id ORDER BY b.game_date ROWS BETWEEN 10 PRECEDING AND 1 PRECEDING) AS rolling_reb_10,
+            STDDEV_SAMP(b.rebounds) OVER (PARTITION BY b.player_id ORDER BY b.game_date ROWS BETWEEN 10 PRECEDING AND 1 PRECEDING) AS reb_std_10,
+            AVG(b.assists) OVER (PARTITION BY b.player_id ORDER BY b.game_date ROWS BETWEEN 10 PRECEDING AND 1 PRECEDING) AS rolling_ast_10,
+            STDDEV_SAMP(b.assists) OVER (PARTITION BY b.player_id ORDER BY b.game_date ROWS BETWEEN 10 PRECEDING AND 1 PRECEDING) AS ast_std_10,
+            AVG(b.threes) OVER (PARTITION BY b.player_id ORDER BY b.game_date ROWS BETWEEN 10 PRECEDING AND 1 PRECEDING) AS rolling_fg3m_10,
+            STDDEV_SAMP(b.threes) OVER (PARTITION BY b.player_id ORDER BY b.game_date ROWS BETWEEN 10 PRECEDING AND 1 PRECEDING) AS fg3m_std_10
         FROM base b
     )
     SELECT
         CURRENT_DATE AS as_of_date,
-        game_id,
-        player_id,
-        opponent_team_id,
-        home_flag,
+        w.game_id,
+        w.player_id,
+        w.opponent_team_id,
+        w.home_flag,
         CASE
-            WHEN prev_game_date IS NULL THEN NULL
-            ELSE (game_date - prev_game_date)
+            WHEN w.prev_game_date IS NULL THEN NULL
+            ELSE (w.game_date - w.prev_game_date)
         END AS rest_days,
-        rolling_pts_5,
-        rolling_pts_10,
-        pts_std_10,
-        rolling_min_5,
-        rolling_min_10,
-        min_std_10,
-        last_game_pts,
-        last_game_min
-    FROM w;
-    """
+        w.rolling_pts_5,
+        w.rolling_pts_10,
+        w.pts_std_10,
+        w.rolling_min_5,
+        w.rolling_min_10,
+        w.min_std_10,
+        w.last_game_pts,
+        w.last_game_min,
+        w.rolling_reb_10,
+        w.reb_std_10,
+        w.rolling_ast_10,
+        w.ast_std_10,
+        w.rolling_fg3m_10,
+        w.fg3m_std_10,
+
+        -- opponent defense / pace and own pace over the teams' previous games (team_game_stats)
+        opp.pts_allowed_10 AS opp_pts_allowed_10,{TIER_CASE_SQL} AS opp_pts_allowed_tier_10,
+        opp.pace_10 AS opp_pace_10,
+        own.pace_10 AS team_pace_10
+    FROM w
+    LEFT JOIN team_roll opp ON opp.game_id = w.game_id AND opp.team_id = w.opponent_team_id
+    LEFT JOIN team_roll own ON own.game_id = w.game_id AND own.team_id = w.team_id
+    WHERE w.is_target;
+"""
+
+
+def get_watermark(conn, name=WATERMARK_NAME):
+    row = conn.execute(
+        text("SELECT watermark_ts FROM pipeline_watermarks WHERE name = :name"),
+        {"name": name},
+    ).fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(conn, value, name=WATERMARK_NAME):
+    conn.execute(
+        text(
+            """
+            INSERT INTO pipeline_watermarks (name, watermark_ts, updated_ts)
+            VALUES (:name, :watermark_ts, NOW())
+            ON CONFLICT (name) DO UPDATE SET
+                watermark_ts = EXCLUDED.watermark_ts,
+                updated_ts = NOW()
+            """
+        ),
+        {"name": name, "watermark_ts": value},
+    )
+
+
+def build_features(engine, incremental=False):
+    # We compute features for rows that exist in player_game_stats (your labels table)
+    # and write one row per (as_of_date, game_id, player_id) into player_features_daily.
+    #
+    # incremental=True only recomputes players whose game logs were ingested after the
+    # stored watermark, and only writes their new or affected rows. Without a stored
+    # watermark it behaves like a full build. Both modes advance the watermark.
+
+    with engine.connect() as conn:
+        open_cap = open_writer_cap(conn, INGEST_APP)
+        high_watermark = conn.execute(text(HIGH_WATERMARK_SQL)).scalar()
+        if high_watermark is not None and open_cap is not None and open_cap < high_watermark:
+            print(f"An ingest started at {open_cap} is still open, building up to it only.")
+            high_watermark = open_cap
+        watermark = get_watermark(conn) if incremental else None
+
+    if high_watermark is None:
+        print("player_game_stats is empty, nothing to build.")
+        return 0
+
+    if incremental and watermark is not None:
+        if watermark >= high_watermark:
+            print(f"No game logs ingested since {watermark}, nothing to build.")
+            return 0
+        q = "WITH" + INCREMENTAL_BASE_SQL + WINDOW_SQL
+        params = {"watermark": watermark, "high_watermark": high_watermark}
+    else:
+        q = "WITH" + FULL_BASE_SQL + WINDOW_SQL
+        params = {}
 
-    df = pd.read_sql(q, engine)
+    # team aggregates first, only for the newly ingested games in incremental mode
+    with span("features.team_aggregates") as s, engine.begin() as conn:
+        s.rows = refresh_team_aggregates(conn, params.get("watermark"), params.get("high_watermark"))
 
-    #Debug
-    print("raw df shape:", df.shape)
-    print(df.columns.tolist())
-    print(df[["game_id","player_id","rolling_pts_10","pts_std_10","rolling_min_10"]].isna().mean())
+    with span("features.sql", mode="incremental" if "watermark" in params else "full") as s:
+        df = pd.read_sql(text(q), engine, params=params)
+        s.rows = len(df)
+        # share of rows without enough history, recorded with the span instead of printed
+        s.attrs.update(
+            {f"nan_{c}": round(float(v), 4)
+             for c, v in df[["rolling_pts_10", "pts_std_10", "rolling_min_10"]].isna().mean().items()}
+        )
 
+    # exponentially weighted recency features, resumed from each player's stored EW state
+    with span("features.ewm") as s, engine.connect() as conn:
+        df, ewm_states = ew_features(conn, df, incremental="watermark" in params)
+        s.rows = len(ewm_states)
 
     df["as_of_date"] = pd.Timestamp.today().date()
     df["as_of_date"] = df["as_of_date"].astype(str)  # keeps it simple for SQLAlchemy
 
 
-        # Optional, drop rows that have no history (first game for a player)
-    df = df.dropna(subset=["rolling_pts_10", "pts_std_10", "rolling_min_10"], how="any")
+        # Optional, drop rows that have no history (first game for a player, or against / for a
+        # team without games yet): the model can't score a NULL input
+    n_raw = len(df)
+    df = df.dropna(subset=REQUIRED_COLUMNS, how="any")
+    count("features.dropped_no_history", n_raw - len(df))
 
     # If no rows survive, do not execute an INSERT with no params
     if df.empty:
         print("No feature rows to upsert (df is empty after dropna).")
+        with engine.begin() as conn:
+            save_ewm_states(conn, ewm_states, replace="watermark" not in params)
+            set_watermark(conn, high_watermark)
         return 0
     
     df["game_id"] = df["game_id"].astype(str)
@@ -94,43 +257,22 @@ def build_features(engine):
         if c in df.columns:
             df[c] = pd.to_numeric(df[c], errors="coerce").astype("Int64")
 
-    # Convert pandas NA/NaN to Python None so psycopg2 sends SQL NULL
-    df = df.replace({pd.NA: None, np.nan: None})
-
-    upsert_sql = """
-    INSERT INTO player_features_daily (
-        as_of_date, game_id, player_id, opponent_team_id, home_flag, rest_days,
-        rolling_pts_5, rolling_pts_10, pts_std_10,
-        rolling_min_5, rolling_min_10, min_std_10,
-        last_game_pts, last_game_min
-    )
-    VALUES (
-        CURRENT_DATE, :game_id, :player_id, :opponent_team_id, :home_flag, :rest_days,
-        :rolling_pts_5, :rolling_pts_10, :pts_std_10,
-        :rolling_min_5, :rolling_min_10, :min_std_10,
-        :last_game_pts, :last_game_min
-    )
-    ON CONFLICT (as_of_date, game_id, player_id) DO UPDATE SET
-        opponent_team_id = EXCLUDED.opponent_team_id,
-        home_flag = EXCLUDED.home_flag,
-        rest_days = EXCLUDED.rest_days,
-        rolling_pts_5 = EXCLUDED.rolling_pts_5,
-        rolling_pts_10 = EXCLUDED.rolling_pts_10,
-        pts_std_10 = EXCLUDED.pts_std_10,
-        rolling_min_5 = EXCLUDED.rolling_min_5,
-        rolling_min_10 = EXCLUDED.rolling_min_10,
-        min_std_10 = EXCLUDED.min_std_10,
-        last_game_pts = EXCLUDED.last_game_pts,
-        last_game_min = EXCLUDED.last_game_min;
-    """
-
     with engine.begin() as conn:
-        conn.execute(text(upsert_sql), df.to_dict(orient="records"))
+        ensure_partitions(conn, "player_features_daily", df["as_of_date"].unique())
+        res = bulk_upsert(conn, "player_features_daily", df, ["as_of_date", "game_id", "player_id"])
+        save_ewm_states(conn, ewm_states, replace="watermark" not in params)
+        set_watermark(conn, high_watermark)
 
+    print(f"player_features_daily: {res.inserted} inserted, {res.updated} updated")
     return len(df)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="Recompute every player instead of only new game logs")
+    args = parser.parse_args()
+
     engine = get_engine()
-    n = build_features(engine)
+    with pipeline_run("build_features", engine):
+        n = build_features(engine, incremental=not args.full)
     print(f"Upserted {n} feature rows into player_features_daily")
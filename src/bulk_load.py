@@ -0,0 +1,111 @@
+import io
+from collections import namedtuple
+
+from src.instrument import span
+
+LoadResult = namedtuple("LoadResult", ["staged", "inserted", "updated", "skipped"])
+
+COPY_CHUNK_ROWS = 50_000
+
+
+def _copy_chunks(df, chunk_rows):
+    # CSV text for COPY, one chunk at a time so a big frame is never duplicated in full
+    for start in range(0, len(df), chunk_rows):
+        buf = io.StringIO()
+        df.iloc[start:start + chunk_rows].to_csv(buf, index=False, header=False, na_rep="\\N")
+        buf.seek(0)
+        yield buf
+
+
+def bulk_upsert(conn, table, df, key_cols, update_cols=None, on_conflict="update",
+                extra_set=None, where=None, update_where=None, chunk_rows=COPY_CHUNK_ROWS):
+    # Loads df into `table` inside the caller's transaction (conn comes from engine.begin()):
+    #   1. COPY the rows into a temp table shaped like the target
+    #   2. one INSERT ... SELECT ... ON CONFLICT merge
+    #
+    # on_conflict="update" overwrites update_cols (default: every non-key column in df),
+    # on_conflict="nothing" keeps the existing row. extra_set adds raw assignments to the
+    # update (e.g. "created_ts = NOW()"). where filters staged rows before the merge; rows
+    # dropped by it are reported as skipped. update_where limits which conflicting rows are
+    # updated (the rest count as skipped; not counted exactly on partitioned tables).
+    if on_conflict not in ("update", "nothing"):
+        raise ValueError(f"on_conflict must be 'update' or 'nothing', got {on_conflict!r}")
+    if df.empty:
+        return LoadResult(0, 0, 0, 0)
+
+    with span(f"upsert.{table}", rows=len(df)) as s:
+        res = _bulk_upsert(conn, table, df, key_cols, update_cols, on_conflict, extra_set, where, update_where, chunk_rows)
+        s.attrs.update(inserted=res.inserted, updated=res.updated, skipped=res.skipped)
+    return res
+
+
+def conflict_clause(cols, key_cols, update_cols=None, on_conflict="update", extra_set=None, update_where=None):
+    # The ON CONFLICT action of the merge. Nothing to assign (update_cols=[] and no extra_set)
+    # means DO NOTHING, since "DO UPDATE SET" needs at least one assignment.
+    if on_conflict != "update":
+        return "DO NOTHING"
+    if update_cols is None:
+        update_cols = [c for c in cols if c not in key_cols]
+    assignments = [f"{c} = EXCLUDED.{c}" for c in update_cols]
+    if extra_set:
+        assignments.append(extra_set)
+    if not assignments:
+        return "DO NOTHING"
+    sql = f"DO UPDATE SET {', '.join(assignments)}"
+    if update_where:
+        sql += f" WHERE {update_where}"
+    return sql
+
+
+def _bulk_upsert(conn, table, df, key_cols, update_cols, on_conflict, extra_set, where, update_where, chunk_rows):
+    cols = list(df.columns)
+    col_list = ", ".join(cols)
+    key_list = ", ".join(key_cols)
+    tmp = f"_bulk_{table}"
+
+    conn.exec_driver_sql(f"CREATE TEMP TABLE IF NOT EXISTS {tmp} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+    conn.exec_driver_sql(f"TRUNCATE {tmp}")
+
+    cur = conn.connection.cursor()
+    try:
+        copy_sql = f"COPY {tmp} ({col_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        for buf in _copy_chunks(df, chunk_rows):
+            cur.copy_expert(copy_sql, buf)
+    finally:
+        cur.close()
+
+    conflict_sql = conflict_clause(cols, key_cols, update_cols, on_conflict, extra_set, update_where)
+
+    # DISTINCT ON: ON CONFLICT DO UPDATE refuses to touch the same row twice in one statement.
+    # xmax = 0 on a returned row means it was freshly inserted rather than updated. Partitioned
+    # tables can't return system columns, so there the conflicting keys are counted up front.
+    partitioned = conn.exec_driver_sql(
+        f"SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('{table}')"
+    ).scalar()
+    existing = 0
+    if partitioned and conflict_sql != "DO NOTHING":
+        existing = conn.exec_driver_sql(
+            f"""
+            SELECT COUNT(*)
+            FROM (SELECT DISTINCT {key_list} FROM {tmp} {"WHERE " + where if where else ""}) s
+            JOIN {table} USING ({key_list})
+            """
+        ).scalar()
+    inserted_sql = "TRUE" if partitioned else "(xmax = 0)"
+
+    merge_sql = f"""
+    WITH merged AS (
+        INSERT INTO {table} ({col_list})
+        SELECT DISTINCT ON ({key_list}) {col_list}
+        FROM {tmp}
+        {"WHERE " + where if where else ""}
+        ON CONFLICT ({key_list}) {conflict_sql}
+        RETURNING {inserted_sql} AS inserted
+    )
+    SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FROM merged
+    """
+    inserted, written = conn.exec_driver_sql(merge_sql).fetchone()
+    inserted -= existing
+
+    staged = len(df)
+    return LoadResult(staged, inserted, written - inserted, staged - written)
@@ -1,5 +1,43 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from .config import DATABASE_URL
 
+# application_name of the transactions that write player_game_stats (ingest) and
+# predictions_daily (scoring). The build_features and export watermarks only wait for open
+# transactions carrying these, not for every session on the server (idle-in-transaction
+# clients, score_historical's streaming read, ...).
+INGEST_APP = "nba_ingest"
+SCORE_APP = "nba_score"
+
+# Start of the oldest other open transaction tagged :app, minus 1µs (NULL if none), and how
+# many tagged sessions belong to roles whose activity this one can't see
+OPEN_WRITERS_SQL = """
+    SELECT
+        MIN(xact_start)::timestamp - INTERVAL '1 microsecond',
+        COUNT(*) FILTER (WHERE query = '<insufficient privilege>')
+    FROM pg_stat_activity
+    WHERE application_name = :app
+      AND pid <> pg_backend_pid()
+"""
+
+
 def get_engine():
     return create_engine(DATABASE_URL, pool_pre_ping=True)
+
+
+def tag_transaction(conn, app):
+    # SET LOCAL application_name: shows in pg_stat_activity until the transaction ends, then
+    # the pooled connection goes back to its own name
+    conn.execute(text("SELECT set_config('application_name', :app, true)"), {"app": app})
+
+
+def open_writer_cap(conn, app):
+    # pg_stat_activity shows application_name for every session but xact_start only for the
+    # role's own (or with pg_read_all_stats); a hidden writer would let the watermark pass
+    # rows it hasn't committed yet, so refuse instead of guessing.
+    cap, hidden = conn.execute(text(OPEN_WRITERS_SQL), {"app": app}).one()
+    if hidden:
+        raise RuntimeError(
+            f"{hidden} open {app} session(s) of another role are hidden in pg_stat_activity; "
+            "grant pg_read_all_stats to this role"
+        )
+    return cap
@@ -0,0 +1,166 @@
+import json
+import os
+
+import numpy as np
+from scipy.special import ndtr
+
+# Points distribution helpers shared by the scorers. Everything is broadcast over
+# (n_players, n_thresholds) and uses scipy's ndtr ufunc for the normal CDF. The same helpers
+# serve every stat in STATS (counts are integers too), only the lines differ.
+
+THRESHOLDS = [15, 20, 25, 30]
+CONF_THRESHOLDS = [20, 25, 30]
+MAX_POINTS = 80
+MIN_SIGMA = 1e-6
+
+# Confidence normalizer: the mean predicted sigma, saved next to the model by train_model and
+# src.backtest. AVG_SIGMA is the fallback for models without a calibration file.
+AVG_SIGMA = 6.7
+
+# Stats the model predicts, in output order. column is the player_game_stats column (the
+# training target is next_<column>), thresholds / conf_thresholds the lines written to
+# predictions_daily, avg_sigma the fallback normalizer and sigma_min / sigma_max the
+# scoring-time clamp (a points floor of 1 would swamp a role player's threes).
+# Points keep their original column names (mu_pts, p20, conf20); the other stats are prefixed
+# (mu_reb, sigma_reb, reb_p6, reb_conf6).
+STATS = {
+    "pts": {"column": "points", "thresholds": THRESHOLDS, "conf_thresholds": CONF_THRESHOLDS,
+            "avg_sigma": AVG_SIGMA, "sigma_min": 1.0, "sigma_max": 25.0},
+    "reb": {"column": "rebounds", "thresholds": [4, 6, 8, 10], "conf_thresholds": [6, 8],
+            "avg_sigma": 2.6, "sigma_min": 0.5, "sigma_max": 10.0},
+    "ast": {"column": "assists", "thresholds": [2, 4, 6, 8], "conf_thresholds": [4, 6],
+            "avg_sigma": 2.0, "sigma_min": 0.5, "sigma_max": 8.0},
+    "fg3m": {"column": "threes", "thresholds": [1, 2, 3, 4], "conf_thresholds": [2, 3],
+             "avg_sigma": 1.3, "sigma_min": 0.3, "sigma_max": 5.0},
+}
+
+_avg_sigma_cache = {}
+
+
+def _as_column(x):
+    return np.asarray(x, dtype=float).reshape(-1, 1)
+
+
+def load_avg_sigma(path, stat="pts"):
+    # Re-read only when the file changes, so long-running scorers pick up a new backtest.
+    # Points use "avg_sigma", other stats "avg_sigma_by_stat" (or their STATS fallback).
+    fallback = STATS[stat]["avg_sigma"] if stat in STATS else AVG_SIGMA
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return fallback
+    hit = _avg_sigma_cache.get(path)
+    if hit is None or hit[0] != mtime:
+        with open(path, "r") as f:
+            data = json.load(f)
+        by_stat = dict(data.get("avg_sigma_by_stat", {}))
+        by_stat["pts"] = data["avg_sigma"]
+        hit = (mtime, {k: float(v) for k, v in by_stat.items()})
+        _avg_sigma_cache[path] = hit
+    return hit[1].get(stat, fallback)
+
+
+def save_avg_sigma(path, avg_sigma, **info):
+    # Other stats' normalizers already in the file are kept unless info replaces them
+    try:
+        with open(path, "r") as f:
+            by_stat = json.load(f).get("avg_sigma_by_stat")
+    except (OSError, ValueError):
+        by_stat = None
+    data = {"avg_sigma": round(float(avg_sigma), 4), **info}
+    if "avg_sigma_by_stat" in data:
+        data["avg_sigma_by_stat"] = {k: round(float(v), 4) for k, v in data["avg_sigma_by_stat"].items()}
+    elif by_stat:
+        data["avg_sigma_by_stat"] = by_stat
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def clamp_sigma(stat, sigma):
+    # Scoring-time clamp of a stat's predicted sigma to [sigma_min, sigma_max]
+    return np.clip(sigma, STATS[stat]["sigma_min"], STATS[stat]["sigma_max"])
+
+
+def threshold_label(k):
+    # 20 -> "20", 22.5 -> "22_5"
+    k = float(k)
+    return str(int(k)) if k.is_integer() else str(k).replace(".", "_")
+
+
+def probs_ge(mu, sigma, thresholds=THRESHOLDS):
+    # P(points >= k) for every player and threshold, shape (n_players, n_thresholds).
+    # Points are integers, so a line like 22.5 means 23+, and we apply the usual
+    # continuity correction at k - 0.5.
+    mu = _as_column(mu)
+    sigma = np.maximum(_as_column(sigma), MIN_SIGMA)
+    k = np.ceil(np.asarray(thresholds, dtype=float)).reshape(1, -1)
+    return ndtr((mu - (k - 0.5)) / sigma)
+
+
+def points_pmf(mu, sigma, max_points=MAX_POINTS):
+    # Discretized normal over 0..max_points, shape (n_players, max_points + 1).
+    # Mass below 0 is folded into 0 and mass above max_points into max_points, so rows sum to 1.
+    mu = _as_column(mu)
+    sigma = np.maximum(_as_column(sigma), MIN_SIGMA)
+    edges = np.arange(max_points + 2, dtype=float).reshape(1, -1) - 0.5
+    cdf = ndtr((edges - mu) / sigma)
+    cdf[:, 0] = 0.0
+    cdf[:, -1] = 1.0
+    return np.diff(cdf, axis=1)
+
+
+def probs_ge_from_pmf(pmf, thresholds=THRESHOLDS):
+    # Same as probs_ge, read off an existing PMF (tail sums)
+    tail = np.cumsum(pmf[:, ::-1], axis=1)[:, ::-1]
+    k = np.clip(np.ceil(np.asarray(thresholds, dtype=float)).astype(int), 0, pmf.shape[1])
+    tail = np.concatenate([tail, np.zeros((pmf.shape[0], 1))], axis=1)
+    return tail[:, k]
+
+
+def points_distribution(mu, sigma, thresholds=THRESHOLDS, max_points=MAX_POINTS):
+    # (probs, pmf): threshold probabilities for any grid of lines plus the full PMF
+    return probs_ge(mu, sigma, thresholds), points_pmf(mu, sigma, max_points)
+
+
+def threshold_columns(mu, sigma, thresholds=THRESHOLDS, conf_thresholds=CONF_THRESHOLDS, avg_sigma=AVG_SIGMA):
+    # pK and confK columns for predictions_daily from one probs_ge call:
+    #   pK    = P(points >= K)
+    #   confK = 100 * pK * (avg_sigma / sigma), i.e. pK scaled down for volatile players
+    grid = sorted(set(thresholds) | set(conf_thresholds))
+    probs = probs_ge(mu, sigma, grid)
+    sigma = np.asarray(sigma, dtype=float).reshape(-1)
+
+    cols = {}
+    for j, k in enumerate(grid):
+        if k in thresholds:
+            cols[f"p{threshold_label(k)}"] = probs[:, j]
+    for j, k in enumerate(grid):
+        if k in conf_thresholds:
+            cols[f"conf{threshold_label(k)}"] = 100.0 * probs[:, j] * (avg_sigma / sigma)
+    return cols
+
+
+def stat_columns(stat, mu, sigma, avg_sigma=None):
+    # predictions_daily columns for one stat: mu, sigma and its pK / confK lines, named as in
+    # STATS (sigma is expected to be clamped already)
+    cfg = STATS[stat]
+    avg_sigma = cfg["avg_sigma"] if avg_sigma is None else avg_sigma
+    cols = {f"mu_{stat}": mu, f"sigma_{stat}": sigma}
+    lines = threshold_columns(mu, sigma, cfg["thresholds"], cfg["conf_thresholds"], avg_sigma)
+    prefix = "" if stat == "pts" else f"{stat}_"
+    cols.update({prefix + c: v for c, v in lines.items()})
+    return cols
+
+
+def prediction_columns(stats=tuple(STATS)):
+    # Names of every stat_columns() column, in write order
+    cols = []
+    for stat in stats:
+        cfg = STATS[stat]
+        prefix = "" if stat == "pts" else f"{stat}_"
+        cols += [f"mu_{stat}", f"sigma_{stat}"]
+        cols += [f"{prefix}p{threshold_label(k)}" for k in cfg["thresholds"]]
+        cols += [f"{prefix}conf{threshold_label(k)}" for k in cfg["conf_thresholds"]]
+    return cols
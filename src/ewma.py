@@ -0,0 +1,219 @@
+import argparse
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+from sqlalchemy import text
+
+from src.bulk_load import bulk_upsert
+
+# Exponentially weighted recency features: EW mean and EW standard deviation of points and
+# minutes over each player's previous games, for every half-life in HALF_LIVES (in games).
+#
+# Each (stat, half-life) is kept as four decayed sums over the games so far, with decay
+# d = 0.5 ** (1 / half_life) applied once per game:
+#   s0 = sum d^k * [x present]   s1 = sum d^k * x   s2 = sum d^k * x^2   q = sum d^(2k) * [x present]
+# mean = s1 / s0 and var = (s2 / s0 - mean^2) * s0^2 / (s0^2 - q) (unbiased for the weights,
+# like pandas ewm(adjust=True) with bias=False; a missing stat decays the others but adds
+# nothing). Each sum is the first-order recurrence y[t] = x[t] + d * y[t-1], which
+# scipy.signal.lfilter runs in one O(n) pass over all players' logs concatenated; the carry-over
+# across a player boundary is removed (and a stored starting state added) in one vectorized
+# correction. The sums after a player's last game are stored in player_ewm_state, so the next
+# incremental build only processes the new games. More half-lives only add columns to the
+# same pass.
+
+HALF_LIVES = (3, 7, 15)
+STATS = (("pts", "points"), ("min", "minutes"))
+N_SUMS = 4
+
+EwState = namedtuple("EwState", ["last_game_id", "last_game_date", "n_games", "sums"])
+
+
+def feature_columns(half_lives=HALF_LIVES):
+    return [f"ew_{s}_{kind}_{h}" for h in half_lives for s, _ in STATS for kind in ("mean", "std")]
+
+
+def load_logs(conn, player_ids=None, after=None):
+    # Game logs sorted by player, date. after: {player_id: date}, only games after that date.
+    params = {}
+    where = ["g.game_date IS NOT NULL"]
+    if player_ids is not None:
+        ids = [int(p) for p in player_ids]
+        cutoffs = [(after or {}).get(p) for p in ids]
+        where.append("(c.after_date IS NULL OR g.game_date::date > c.after_date)")
+        join = "JOIN unnest(CAST(:ids AS INTEGER[]), CAST(:afters AS DATE[])) AS c(player_id, after_date) ON c.player_id = pgs.player_id"
+        params = {"ids": ids, "afters": cutoffs}
+    else:
+        join = ""
+    return pd.read_sql(
+        text(f"""
+            SELECT pgs.player_id, pgs.game_id, g.game_date::date AS game_date, pgs.points, pgs.minutes
+            FROM player_game_stats pgs
+            JOIN games g ON g.game_id = pgs.game_id
+            {join}
+            WHERE {" AND ".join(where)}
+            ORDER BY pgs.player_id, g.game_date, pgs.game_id
+        """),
+        conn,
+        params=params,
+    )
+
+
+def ew_pass(logs, states=None, half_lives=HALF_LIVES):
+    # logs sorted by (player_id, game_date). Returns (pre-game feature frame aligned with logs,
+    # {player_id: EwState} after each player's last game). states resumes players from stored sums.
+    n = len(logs)
+    cols = feature_columns(half_lives)
+    if n == 0:
+        return pd.DataFrame(columns=["game_id", "player_id"] + cols), {}
+
+    pid = logs["player_id"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, pid[1:] != pid[:-1]])
+    lengths = np.diff(np.r_[starts, n])
+    group = np.repeat(np.arange(len(starts)), lengths)
+    pos = np.arange(n) - starts[group]
+    ends = starts + lengths - 1
+
+    n_stats, n_hl = len(STATS), len(half_lives)
+    x = np.column_stack([logs[c].to_numpy(dtype=float) for _, c in STATS])  # (n, n_stats)
+    present = ~np.isnan(x)
+    inputs = (present.astype(float), np.where(present, x, 0.0), np.where(present, x * x, 0.0), present.astype(float))
+
+    init = np.zeros((len(starts), n_stats, n_hl, N_SUMS))
+    n_prev = np.zeros(len(starts), dtype=np.int64)
+    if states:
+        for g, p in enumerate(pid[starts]):
+            st = states.get(int(p))
+            if st is not None:
+                init[g] = np.asarray(st.sums, dtype=float).reshape(n_stats, n_hl, N_SUMS)
+                n_prev[g] = st.n_games
+
+    post = np.empty((n, n_stats, n_hl, N_SUMS))
+    for j, h in enumerate(half_lives):
+        d = 0.5 ** (1.0 / h)
+        for k, inp in enumerate(inputs):
+            dk = d * d if k == 3 else d
+            y = lfilter([1.0], [1.0, -dk], inp, axis=0)
+            # y ran across player boundaries: swap the previous player's tail for this player's start state
+            prev = np.zeros((len(starts), n_stats))
+            prev[1:] = y[starts[1:] - 1]
+            y += (dk ** (pos + 1.0))[:, None] * (init[:, :, j, k] - prev)[group]
+            post[:, :, j, k] = y
+
+    # features for a game use the sums after the previous one
+    pre = np.empty_like(post)
+    pre[1:] = post[:-1]
+    pre[starts] = init
+
+    s0, s1, s2, q = (pre[..., k] for k in range(N_SUMS))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(s0 > 0, s1 / s0, np.nan)
+        denom = s0 * s0 - q
+        var = np.where(denom > 1e-12, (s2 / s0 - mean * mean) * s0 * s0 / denom, np.nan)
+    std = np.sqrt(np.maximum(var, 0.0))
+
+    out = pd.DataFrame({"game_id": logs["game_id"].to_numpy(), "player_id": pid})
+    for j, h in enumerate(half_lives):
+        for i, (s, _) in enumerate(STATS):
+            out[f"ew_{s}_mean_{h}"] = mean[:, i, j]
+            out[f"ew_{s}_std_{h}"] = std[:, i, j]
+
+    game_ids = logs["game_id"].to_numpy()
+    game_dates = logs["game_date"].to_numpy()
+    new_states = {
+        int(pid[e]): EwState(game_ids[e], game_dates[e], int(n_prev[g] + lengths[g]), post[e].ravel())
+        for g, e in enumerate(ends)
+    }
+    return out[["game_id", "player_id"] + cols], new_states
+
+
+def load_states(conn, player_ids, half_lives=HALF_LIVES):
+    # Stored states for player_ids; states saved with other half-lives are ignored (recomputed)
+    if not player_ids:
+        return {}
+    rows = conn.execute(
+        text("SELECT * FROM player_ewm_state WHERE player_id = ANY(:ids)"),
+        {"ids": [int(p) for p in player_ids]},
+    ).mappings().all()
+    return {
+        r["player_id"]: EwState(r["last_game_id"], r["last_game_date"], r["n_games"], r["sums"])
+        for r in rows
+        if list(r["half_lives"]) == [float(h) for h in half_lives]
+    }
+
+
+def save_states(conn, states, half_lives=HALF_LIVES, replace=False):
+    # replace=True (full builds) drops every stored state first
+    if replace:
+        conn.execute(text("TRUNCATE player_ewm_state"))
+    if not states:
+        return
+
+    def pg_array(values):
+        return "{" + ",".join(repr(float(v)) for v in values) + "}"
+
+    df = pd.DataFrame(
+        [
+            {
+                "player_id": p,
+                "last_game_id": st.last_game_id,
+                "last_game_date": st.last_game_date,
+                "n_games": st.n_games,
+                "half_lives": pg_array(half_lives),
+                "sums": pg_array(st.sums),
+            }
+            for p, st in states.items()
+        ]
+    )
+    bulk_upsert(conn, "player_ewm_state", df, ["player_id"], extra_set="updated_ts = NOW()")
+
+
+def ew_features(conn, rows, incremental):
+    # EW features for the (game_id, player_id) rows of a feature build, plus the states to save.
+    # Incremental builds resume each player from their stored state and only read newer games;
+    # a player whose rows don't all come after the stored state (a backfilled gap, changed
+    # half-lives) is recomputed from their full log.
+    if not incremental:
+        feats, states = ew_pass(load_logs(conn))
+        return rows.merge(feats, on=["game_id", "player_id"], how="left"), states
+
+    players = rows["player_id"].astype(int).unique().tolist()
+    states = load_states(conn, players)
+    after = {p: st.last_game_date for p, st in states.items()}
+    feats, new_states = ew_pass(load_logs(conn, players, after), states)
+    out = rows.merge(feats, on=["game_id", "player_id"], how="left", indicator=True)
+
+    redo = out.loc[out["_merge"] == "left_only", "player_id"].astype(int).unique().tolist()
+    out = out.drop(columns="_merge")
+    if redo:
+        feats, states = ew_pass(load_logs(conn, redo))
+        new_states.update(states)
+        again = out["player_id"].isin(redo)
+        out = pd.concat([
+            out[~again],
+            out.loc[again, list(rows.columns)].merge(feats, on=["game_id", "player_id"], how="left"),
+        ], ignore_index=True)
+    return out, new_states
+
+
+def rebuild_states(engine):
+    with engine.begin() as conn:
+        _, states = ew_pass(load_logs(conn))
+        save_states(conn, states, replace=True)
+    print(f"Rebuilt EW state for {len(states)} players")
+    return len(states)
+
+
+def main():
+    from src.db import get_engine
+
+    parser = argparse.ArgumentParser(description="Maintain the per-player EWMA state")
+    parser.add_argument("--rebuild", action="store_true", help="recompute player_ewm_state from player_game_stats")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_states(get_engine())
+
+if __name__ == "__main__":
+    main()
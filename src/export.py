@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import date
+
+from sqlalchemy import text
+
+from src.distribution import STATS, prediction_columns
+from src.instrument import count, pipeline_run, span
+
+# Dashboard feed: predictions_daily joined with players, streamed out of Postgres with
+# COPY TO and converted to Parquet by Arrow (no pandas). Layout under EXPORT_DIR:
+#   daily/nba_points_<date>.csv|.parquet   one pair per as_of_date (daily/*.parquet is the
+#                                          columnar history, readable as one Arrow dataset)
+#   nba_points_today.csv|.parquet          copy of the latest date, a fixed path for Tableau
+#   nba_points_history.csv                 append-only, every date in export order
+#   manifest.json                          exported dates and the created_ts watermark
+# Only dates with predictions written after the watermark are exported again. created_ts is
+# the writing transaction's start, so the watermark is held below the oldest scoring
+# transaction still open when the export starts; a scoring run that commits late is picked up
+# next time. A rescored date rewrites its daily files; the CSV history keeps the rows it was
+# first exported with (--full rebuilds everything, history included). When the columns change
+# (e.g. a stat is added) the old history file is set aside and a new one started.
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join("outputs", "export"))
+FILE_PREFIX = "nba_points"
+
+EXPORT_COLUMNS = [
+    ("as_of_date", "pd.as_of_date"),
+    ("game_id", "pd.game_id"),
+    ("player_id", "pd.player_id"),
+    ("player_name", "pl.player_name"),
+    ("mu_pts", "pd.mu_pts"),
+    ("sigma_pts", "pd.sigma_pts"),
+    ("p15", "pd.p15"),
+    ("p20", "pd.p20"),
+    ("p25", "pd.p25"),
+    ("p30", "pd.p30"),
+    ("conf20", "pd.conf20"),
+    ("conf25", "pd.conf25"),
+    ("conf30", "pd.conf30"),
+    *[(c, f"pd.{c}") for c in prediction_columns([s for s in STATS if s != "pts"])],
+    ("model_version", "pd.model_version"),
+]
+
+
+def _arrow_types():
+    import pyarrow as pa
+
+    # game_id keeps its leading zeros; REAL columns stay float32 like in Postgres
+    types = {c: pa.float32() for c, _ in EXPORT_COLUMNS}
+    types.update(as_of_date=pa.date32(), game_id=pa.string(), player_id=pa.int64(),
+                 player_name=pa.string(), model_version=pa.string())
+    return types
+
+
+def export_query(day):
+    select = ",\n  ".join(f"{expr} AS {name}" for name, expr in EXPORT_COLUMNS)
+    return f"""
+        SELECT
+          {select}
+        FROM predictions_daily pd
+        LEFT JOIN players pl ON pl.player_id = pd.player_id
+        WHERE pd.as_of_date = '{day.isoformat()}'
+        ORDER BY pd.conf20 DESC NULLS LAST, pd.player_id, pd.game_id
+    """
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, "manifest.json"), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"watermark_ts": None, "dates": {}}
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, "manifest.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+# Latest created_ts a new watermark can safely take: below now for transactions that start
+# after this query; export_predictions also keeps it below the oldest open scoring transaction
+# (src.db.open_writer_cap), whose rows aren't visible yet but will carry created_ts >= its start
+WATERMARK_CAP_SQL = "SELECT clock_timestamp()::timestamp - INTERVAL '1 microsecond'"
+
+
+def pending_dates(conn, watermark_ts, days=None):
+    # (as_of_date, max created_ts) for `days`, or else for every date with predictions written
+    # after the watermark (idx_predictions_daily_created)
+    if days:
+        where, params = "WHERE as_of_date = ANY(:days)", {"days": sorted(days)}
+    elif watermark_ts:
+        where, params = "WHERE created_ts > :wm", {"wm": watermark_ts}
+    else:
+        where, params = "", {}
+    return conn.execute(
+        text(f"SELECT as_of_date, MAX(created_ts) FROM predictions_daily {where} GROUP BY as_of_date ORDER BY as_of_date"),
+        params,
+    ).fetchall()
+
+
+def export_date(conn, day, out_dir):
+    # COPY straight into the daily CSV, then Arrow reads it once for the Parquet copy.
+    # Returns (row count, csv path, parquet path).
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+
+    daily_dir = os.path.join(out_dir, "daily")
+    os.makedirs(daily_dir, exist_ok=True)
+    base = os.path.join(daily_dir, f"{FILE_PREFIX}_{day.isoformat()}")
+
+    with span("export.copy") as s:
+        with tempfile.NamedTemporaryFile(suffix=".csv", dir=daily_dir, delete=False) as tmp:
+            cur = conn.connection.cursor()
+            try:
+                cur.copy_expert(
+                    f"COPY ({export_query(day)}) TO STDOUT WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')", tmp
+                )
+            finally:
+                cur.close()
+        os.replace(tmp.name, f"{base}.csv")
+
+    with span("export.parquet") as p:
+        table = pacsv.read_csv(f"{base}.csv", convert_options=pacsv.ConvertOptions(column_types=_arrow_types()))
+        pq.write_table(table, f"{base}.parquet.tmp", compression="zstd")
+        os.replace(f"{base}.parquet.tmp", f"{base}.parquet")
+        s.rows = p.rows = table.num_rows
+    return table.num_rows, f"{base}.csv", f"{base}.parquet"
+
+
+def append_history(csv_path, history_path):
+    # Appends a daily CSV to the history file, header only when the file is new
+    with open(csv_path, "rb") as src:
+        header = src.readline()
+        new = not os.path.exists(history_path) or os.path.getsize(history_path) == 0
+        if not new:
+            with open(history_path, "rb") as f:
+                if f.readline() != header:
+                    stem, ext = os.path.splitext(history_path)
+                    old = f"{stem}_until_{time.strftime('%Y%m%d_%H%M%S')}{ext}"
+                    os.replace(history_path, old)
+                    print(f"export columns changed, previous history moved to {old}")
+                    new = True
+        with open(history_path, "ab") as dst:
+            if new:
+                dst.write(header)
+            shutil.copyfileobj(src, dst)
+
+
+def export_predictions(engine, out_dir=EXPORT_DIR, days=None, full=False):
+    # Exports new / changed dates (or exactly `days`), returns the number of rows written
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {"watermark_ts": None, "dates": {}} if full else load_manifest(out_dir)
+    history_path = os.path.join(out_dir, f"{FILE_PREFIX}_history.csv")
+    if full and os.path.exists(history_path):
+        os.remove(history_path)
+
+    from src.db import SCORE_APP, open_writer_cap
+
+    with engine.connect() as conn:
+        open_cap = open_writer_cap(conn, SCORE_APP)
+        cap = conn.execute(text(WATERMARK_CAP_SQL)).scalar()
+        if open_cap is not None:
+            print(f"A scoring run started at {open_cap} is still open, the watermark stays below it.")
+            cap = min(cap, open_cap)
+        pending = pending_dates(conn, manifest["watermark_ts"], days)
+        if not pending:
+            print("No new predictions to export.")
+            return 0
+
+        total = 0
+        for day, max_created in pending:
+            n, csv_path, _ = export_date(conn, day, out_dir)
+            key = day.isoformat()
+            if key not in manifest["dates"]:
+                append_history(csv_path, history_path)
+                count("export.history_dates")
+            manifest["dates"][key] = {"rows": n, "created_ts": str(max_created)}
+            total += n
+            print(f"exported {n} rows for {key}")
+
+    latest = max(manifest["dates"])
+    for ext in ("csv", "parquet"):
+        src_path = os.path.join(out_dir, "daily", f"{FILE_PREFIX}_{latest}.{ext}")
+        shutil.copyfile(src_path, os.path.join(out_dir, f"{FILE_PREFIX}_today.{ext}.tmp"))
+        os.replace(os.path.join(out_dir, f"{FILE_PREFIX}_today.{ext}.tmp"),
+                   os.path.join(out_dir, f"{FILE_PREFIX}_today.{ext}"))
+
+    if not days:
+        watermark = str(min(max(m for _, m in pending), cap))
+        manifest["watermark_ts"] = max(filter(None, [manifest["watermark_ts"], watermark]))
+    save_manifest(out_dir, manifest)
+    print(f"Exported {total} rows over {len(pending)} date(s) to {out_dir} (latest {latest})")
+    return total
+
+
+def main():
+    from src.db import get_engine
+
+    parser = argparse.ArgumentParser(description="Export predictions_daily + players as CSV and Parquet")
+    parser.add_argument("--out-dir", default=EXPORT_DIR)
+    parser.add_argument("--date", action="append", type=date.fromisoformat,
+                        help="export this as_of_date regardless of the watermark (repeatable)")
+    parser.add_argument("--full", action="store_true", help="re-export every date and rebuild the history file")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    with pipeline_run("export", engine):
+        export_predictions(engine, out_dir=args.out_dir, days=args.date, full=args.full)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import random
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+import requests
+
+from src.fetch import TokenBucket, fetch_many
+
+# Stand-in for nba_api endpoints with a configurable latency and a server-side rate
+# limit, so the fetch engine can be exercised and timed without touching stats.nba.com.
+
+
+class FakeServer:
+    def __init__(self, latency=0.25, jitter=0.05, max_per_second=4.0, players_per_team=13, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.max_per_second = max_per_second
+        self.players_per_team = players_per_team
+        self.calls = 0
+        self.throttled = 0
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def _admit(self):
+        # Sliding one-second window, like the real API: over the limit -> the request hangs
+        # and times out instead of returning an error code.
+        now = time.monotonic()
+        with self._lock:
+            self.calls += 1
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.max_per_second:
+                self.throttled += 1
+                return False
+            self._recent.append(now)
+            delay = self.latency + self._rng.uniform(0.0, self.jitter)
+        time.sleep(delay)
+        return True
+
+    def boxscore(self, game_id):
+        if not self._admit():
+            time.sleep(self.latency)
+            raise requests.exceptions.ReadTimeout(f"fake timeout for game {game_id}")
+
+        rng = random.Random(game_id)
+        rows = []
+        for team_id in (1610612700 + rng.randint(0, 14), 1610612715 + rng.randint(0, 14)):
+            for i in range(self.players_per_team):
+                mins = max(0.0, rng.gauss(24.0, 9.0))
+                rows.append(
+                    {
+                        "gameId": game_id,
+                        "personId": team_id * 100 + i,
+                        "teamId": team_id,
+                        "minutes": f"{int(mins)}:{int((mins % 1) * 60):02d}",
+                        "points": max(0, int(rng.gauss(mins * 0.45, 5.0))),
+                        "reboundsTotal": max(0, int(rng.gauss(mins * 0.18, 2.5))),
+                        "assists": max(0, int(rng.gauss(mins * 0.1, 2.0))),
+                        "threePointersMade": max(0, int(rng.gauss(mins * 0.05, 1.2))),
+                    }
+                )
+        return pd.DataFrame(rows)
+
+
+SERVER = FakeServer()
+
+
+class BoxScoreTraditionalV3:
+    # Mirrors the parts of nba_api.stats.endpoints.boxscoretraditionalv3 we use
+
+    def __init__(self, game_id, server=None, **kwargs):
+        self._players = (server or SERVER).boxscore(game_id)
+
+    def get_data_frames(self):
+        return [self._players]
+
+
+def fake_game_ids(n):
+    return [f"00225{i:05d}" for i in range(n)]
+
+
+def bench_sequential(game_ids, sleep_seconds=1.2):
+    # What ingest_boxscores used to do: one call, then a fixed sleep
+    for gid in game_ids:
+        try:
+            BoxScoreTraditionalV3(gid).get_data_frames()
+        except requests.exceptions.ReadTimeout:
+            pass
+        time.sleep(sleep_seconds)
+
+
+def bench_concurrent(game_ids, rate, burst, workers):
+    limiter = TokenBucket(rate=rate, capacity=burst)
+    return fetch_many(
+        game_ids,
+        lambda gid: BoxScoreTraditionalV3(gid).get_data_frames()[0],
+        limiter=limiter,
+        max_workers=workers,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure boxscore fetch throughput against a fake nba_api")
+    parser.add_argument("--games", type=int, default=15)
+    parser.add_argument("--latency", type=float, default=0.25)
+    parser.add_argument("--server-limit", type=float, default=4.0, help="Requests per second the fake server accepts")
+    parser.add_argument("--rate", type=float, default=3.0)
+    parser.add_argument("--burst", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+
+    SERVER.latency = args.latency
+    SERVER.max_per_second = args.server_limit
+    game_ids = fake_game_ids(args.games)
+
+    if not args.skip_sequential:
+        t0 = time.perf_counter()
+        bench_sequential(game_ids)
+        dt = time.perf_counter() - t0
+        print(f"sequential: {len(game_ids)} games in {dt:.2f}s ({len(game_ids) / dt:.2f} games/s)")
+
+    SERVER.calls = SERVER.throttled = 0
+    t0 = time.perf_counter()
+    results, errors = bench_concurrent(game_ids, args.rate, args.burst, args.workers)
+    dt = time.perf_counter() - t0
+    print(
+        f"concurrent: {len(results)} games in {dt:.2f}s ({len(results) / dt:.2f} games/s), "
+        f"{len(errors)} failed, {SERVER.throttled} throttled of {SERVER.calls} calls"
+    )
+
+
+if __name__ == "__main__":
+    main()
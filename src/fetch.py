@@ -0,0 +1,107 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from src.instrument import count, span
+
+# stats.nba.com starts timing out clients that go much above a couple of requests per second
+RATE_PER_SECOND = float(os.getenv("NBA_API_RATE", "2.0"))
+BURST = int(os.getenv("NBA_API_BURST", "2"))
+MAX_WORKERS = int(os.getenv("NBA_API_WORKERS", "4"))
+MAX_RETRIES = int(os.getenv("NBA_API_RETRIES", "4"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 30.0
+
+THROTTLE_STATUS_CODES = {429, 503}
+
+
+class TokenBucket:
+    # Thread-safe token bucket: `rate` tokens per second, at most `capacity` stored.
+
+    def __init__(self, rate=RATE_PER_SECOND, capacity=BURST):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, tokens=1.0):
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            # sleep outside the lock so other threads can refill/check
+            time.sleep(wait)
+
+
+def is_throttle_error(exc):
+    if isinstance(exc, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    if isinstance(exc, requests.exceptions.HTTPError):
+        resp = exc.response
+        return resp is not None and resp.status_code in THROTTLE_STATUS_CODES
+    return False
+
+
+def call_with_retry(fn, limiter=None, max_retries=MAX_RETRIES,
+                    backoff_base=BACKOFF_BASE_SECONDS, backoff_cap=BACKOFF_CAP_SECONDS):
+    # Every attempt (including retries) takes a token. Throttling errors are retried with
+    # "full jitter" exponential backoff, anything else is raised straight away.
+    attempt = 0
+    while True:
+        if limiter is not None:
+            with span("api.rate_limit_wait"):
+                limiter.acquire()
+        count("api.requests")
+        try:
+            with span("api.request"):
+                return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_throttle_error(e):
+                count("api.errors")
+                raise
+            delay = random.uniform(0.0, min(backoff_cap, backoff_base * (2 ** attempt)))
+            attempt += 1
+            count("api.retries")
+            print(f"throttled ({type(e).__name__}), retry {attempt}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def fetch_many(keys, fetch_fn, limiter=None, max_workers=MAX_WORKERS, max_retries=MAX_RETRIES):
+    # Runs fetch_fn(key) for every key on a thread pool, sharing one rate limiter.
+    # Returns (results, errors), both dicts keyed by key. No DB work happens here so
+    # callers can write the results from a single thread afterwards.
+    if limiter is None:
+        limiter = TokenBucket()
+
+    results = {}
+    errors = {}
+    if not keys:
+        return results, errors
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(call_with_retry, lambda k=k: fetch_fn(k), limiter, max_retries): k
+            for k in keys
+        }
+        for fut in as_completed(futures):
+            k = futures[fut]
+            try:
+                results[k] = fut.result()
+            except Exception as e:
+                errors[k] = e
+
+    return results, errors
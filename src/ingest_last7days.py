@@ -1,11 +1,13 @@
-import time
 from datetime import datetime, timedelta
 import pandas as pd
 from sqlalchemy import text
 from nba_api.stats.endpoints import scoreboardv2, boxscoretraditionalv3
-from src.db import get_engine
-
-SLEEP_SECONDS = 1.2
+from src.db import INGEST_APP, get_engine, tag_transaction
+from src.api_cache import get_cache, is_final_status
+from src.bulk_load import bulk_upsert
+from src.rolling_state import update_rolling_state
+from src.fetch import TokenBucket, call_with_retry, fetch_many, MAX_WORKERS
+from src.instrument import count, pipeline_run, span
 
 
 def get_last_7_dates():
@@ -40,10 +42,35 @@ def min_to_float(v):
         return None
 
 
-def ingest_games(engine, game_date):
-    sb = scoreboardv2.ScoreboardV2(game_date=game_date)
+def scoreboard_is_final(game_date, games):
+    # A slate can't change once every game is final. Older dates are treated as final
+    # too so postponed games don't keep a past scoreboard out of the cache forever.
+    if not games.empty and games["GAME_STATUS_TEXT"].map(is_final_status).all():
+        return True
+    day = datetime.strptime(game_date, "%Y-%m-%d").date()
+    return day < datetime.utcnow().date() - timedelta(days=2)
+
+
+def fetch_scoreboard(game_date, limiter=None, cache=None):
+    cache = cache or get_cache()
+    params = {"game_date": game_date}
+    if cache is not None:
+        frames = cache.get("ScoreboardV2", params)
+        if frames is not None:
+            return frames[0]
+
+    sb = call_with_retry(lambda: scoreboardv2.ScoreboardV2(game_date=game_date), limiter)
     games = sb.game_header.get_data_frame()
 
+    if cache is not None:
+        cache.put("ScoreboardV2", params, [games], final=scoreboard_is_final(game_date, games))
+    return games
+
+
+def ingest_games(engine, game_date, limiter=None, cache=None, season=None):
+    with span("ingest.scoreboard", date=game_date):
+        games = fetch_scoreboard(game_date, limiter, cache)
+
     if games.empty:
         print(f"No games found for {game_date}")
         return []
@@ -67,41 +94,98 @@ def ingest_games(engine, game_date):
     )
 
     with engine.begin() as conn:
-        for _, row in games_df.iterrows():
-            conn.execute(
-                text(
-                    """
-                    INSERT INTO games (game_id, game_date, home_team_id, away_team_id, status)
-                    VALUES (:game_id, :game_date, :home_team_id, :away_team_id, :status)
-                    ON CONFLICT (game_id) DO NOTHING
-                    """
-                ),
-                row.to_dict(),
-            )
-
-    print(f"Upserted {len(games_df)} games for {game_date}")
+        # status is refreshed so a game first seen as scheduled is later recorded as Final
+        update_cols = ["status"]
+        if season is not None:
+            games_df = games_df.assign(season=season)
+            update_cols.append("season")
+        res = bulk_upsert(conn, "games", games_df, ["game_id"], update_cols=update_cols)
+
+    print(f"Upserted {len(games_df)} games for {game_date} ({res.inserted} new, {res.updated} updated)")
     return games_df["game_id"].tolist()
 
 
-def ingest_boxscores(engine, game_ids):
-    total_inserted = 0
+def fetch_boxscore(game_id, endpoint=boxscoretraditionalv3.BoxScoreTraditionalV3):
+    return endpoint(game_id=game_id).get_data_frames()[0]
 
-    for game_id in game_ids:
-        print(f"Ingesting boxscore for game {game_id}")
 
-        try:
-            bs = boxscoretraditionalv3.BoxScoreTraditionalV3(game_id=game_id)
-            players_df = bs.get_data_frames()[0]
-        except Exception as e:
-            print(f"ERROR fetching boxscore for {game_id}: {e}")
+def final_game_ids(engine, game_ids):
+    if not game_ids:
+        return set()
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT game_id, status FROM games WHERE game_id = ANY(:ids)"),
+            {"ids": list(game_ids)},
+        ).fetchall()
+    return {gid for gid, status in rows if is_final_status(status)}
+
+
+def unstored_rows(conn, df):
+    # Rows of df the player_game_stats merge below will insert: known players (the same
+    # filter as its where=) and (game_id, player_id) pairs not stored yet
+    known = conn.execute(
+        text("SELECT player_id FROM players WHERE player_id = ANY(:ids)"),
+        {"ids": [int(p) for p in df["player_id"].unique()]},
+    ).scalars().all()
+    stored = pd.read_sql(
+        text("SELECT game_id, player_id FROM player_game_stats WHERE game_id = ANY(:ids)"),
+        conn,
+        params={"ids": df["game_id"].astype(str).unique().tolist()},
+    )
+    out = df[df["player_id"].isin(known)]
+    out = out.merge(stored.assign(_stored=True), on=["game_id", "player_id"], how="left")
+    return out[out["_stored"].isna()].drop(columns="_stored")
+
+
+def ingest_boxscores(engine, game_ids, limiter=None, max_workers=MAX_WORKERS,
+                     endpoint=boxscoretraditionalv3.BoxScoreTraditionalV3, cache=None):
+    cache = cache or get_cache()
+
+    # Finished games come from the local cache when we have them, only the rest go to the API
+    frames = {}
+    if cache is not None:
+        with span("ingest.cache_lookup", rows=len(game_ids)):
+            for game_id in game_ids:
+                cached = cache.get("BoxScoreTraditionalV3", {"game_id": game_id})
+                if cached is not None:
+                    frames[game_id] = cached[0]
+        count("ingest.cache_hits", len(frames))
+    to_fetch = [gid for gid in game_ids if gid not in frames]
+
+    # Network first: fetch the remaining boxscores concurrently under the shared rate
+    # limit, then write everything in one bulk load below.
+    print(f"Fetching {len(to_fetch)} boxscores with {max_workers} workers ({len(frames)} cached)")
+    with span("ingest.fetch", rows=len(to_fetch)):
+        fetched, errors = fetch_many(
+            to_fetch,
+            lambda gid: fetch_boxscore(gid, endpoint),
+            limiter=limiter,
+            max_workers=max_workers,
+        )
+    count("ingest.fetch_errors", len(errors))
+    for game_id, e in errors.items():
+        print(f"ERROR fetching boxscore for {game_id}: {e}")
+
+    if cache is not None and fetched:
+        final_ids = final_game_ids(engine, fetched.keys())
+        for game_id, players_df in fetched.items():
+            cache.put("BoxScoreTraditionalV3", {"game_id": game_id}, [players_df], final=game_id in final_ids)
+    frames.update(fetched)
+
+    batches = []
+    loaded = []
+    empty = []
+    for game_id in game_ids:
+        if game_id not in frames:
             continue
+        players_df = frames[game_id]
 
         if players_df.empty:
-            print(f"WARNING: empty player_stats for game {game_id}")
+            empty.append(game_id)
             continue
 
         df = players_df[
-            ["gameId", "personId", "teamId", "minutes", "points"]
+            ["gameId", "personId", "teamId", "minutes", "points", "reboundsTotal", "assists", "threePointersMade"]
         ].rename(
             columns={
                 "gameId": "game_id",
@@ -109,42 +193,68 @@ def ingest_boxscores(engine, game_ids):
                 "teamId": "team_id",
                 "minutes": "minutes",
                 "points": "points",
+                "reboundsTotal": "rebounds",
+                "assists": "assists",
+                "threePointersMade": "threes",
             }
         )
 
         df["minutes"] = df["minutes"].apply(min_to_float)
+        batches.append(df)
+        loaded.append(game_id)
+
+    if empty:
+        count("ingest.empty_boxscores", len(empty))
+        print(f"WARNING: empty player_stats for {len(empty)} games: {', '.join(empty)}")
+
+    if not batches:
+        print("Total player rows inserted: 0")
+        return loaded
+
+    # One COPY + merge for the whole night instead of a round trip per player row.
+    # Players missing from the players table would violate the foreign key, so they
+    # are filtered out in the merge and counted as skipped. Existing rows are left alone,
+    # except that rows stored before rebounds / assists / threes were kept get them filled in.
+    df = pd.concat(batches, ignore_index=True)
+    with span("ingest.insert", rows=len(df)), engine.begin() as conn:
+        tag_transaction(conn, INGEST_APP)  # build_features holds its watermark below it while open
+        new_rows = unstored_rows(conn, df)
+        res = bulk_upsert(
+            conn,
+            "player_game_stats",
+            df,
+            ["game_id", "player_id"],
+            update_cols=["rebounds", "assists", "threes"],
+            update_where="player_game_stats.rebounds IS NULL AND EXCLUDED.rebounds IS NOT NULL",
+            where="player_id IN (SELECT player_id FROM players)",
+        )
+        # same transaction, so the rolling state never disagrees with player_game_stats. Only
+        # the rows the merge inserted are pushed: the nightly re-ingest of the last 7 days
+        # would otherwise look like a backfill for every player and replay them all.
+        with span("ingest.rolling_state", rows=len(new_rows)):
+            n_players = update_rolling_state(conn, new_rows)
+
+    print(
+        f"Total player rows inserted: {res.inserted} "
+        f"({res.updated} filled in with rebounds/assists/threes, "
+        f"{res.skipped} skipped as duplicates or unknown players, {len(batches)} games), "
+        f"rolling state updated for {n_players} players"
+    )
+    # game ids whose boxscores are now in player_game_stats
+    return loaded
+
+
+def ingest_last7days(engine, limiter=None):
+    if limiter is None:
+        limiter = TokenBucket()
 
-        inserted = 0
-        with engine.begin() as conn:
-            for _, row in df.iterrows():
-                try:
-                    conn.execute(
-                        text(
-                            """
-                            INSERT INTO player_game_stats
-                            (game_id, player_id, team_id, minutes, points)
-                            VALUES
-                            (:game_id, :player_id, :team_id, :minutes, :points)
-                            ON CONFLICT (game_id, player_id) DO NOTHING
-                            """
-                        ),
-                        row.to_dict(),
-                    )
-                    inserted += 1
-                except Exception as e:
-                    print(
-                        f"ERROR inserting row for game {game_id}, player {row['player_id']}: {e}"
-                    )
-
-        total_inserted += inserted
-        print(f"Inserted {inserted} player rows for game {game_id}")
-        time.sleep(SLEEP_SECONDS)
-
-    print(f"Total player rows inserted: {total_inserted}")
+    game_ids = []
+    for game_date in get_last_7_dates():
+        game_ids.extend(ingest_games(engine, game_date, limiter))
+    return ingest_boxscores(engine, game_ids, limiter)
 
 
 if __name__ == "__main__":
     engine = get_engine()
-    date = get_last_7_dates()
-    game_ids = ingest_games(engine, date)
-    ingest_boxscores(engine, game_ids)
+    with pipeline_run("ingest_last7days", engine):
+        ingest_last7days(engine)
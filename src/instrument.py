@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import text
+
+# Span timers and counters for the pipeline stages.
+#
+#   with span("features.sql") as s:          # wall time, nested per thread
+#       df = pd.read_sql(...)
+#       s.rows = len(df)                     # optional, gives rows/s
+#   count("api.retries")
+#
+# Spans and counters are only collected while a run is open (pipeline_run(...)); outside a
+# run they cost a couple of perf_counter calls. At the end of a run the per-name aggregates
+# go into pipeline_runs (one row per run) and, if a trace path is set, every span is written
+# as a Chrome trace (open in chrome://tracing or https://ui.perfetto.dev).
+
+TRACE_PATH = os.getenv("PIPELINE_TRACE")
+REGRESSION_RUNS = 7
+REGRESSION_FACTOR = 1.5
+
+_active = None
+_active_lock = threading.Lock()
+_local = threading.local()
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "rows", "attrs", "thread", "depth")
+
+    def __init__(self, name, rows=None, attrs=None):
+        self.name = name
+        self.rows = rows
+        self.attrs = attrs or {}
+        self.thread = threading.current_thread().name
+        self.start = time.perf_counter()
+        self.end = None
+        self.depth = 0
+
+    @property
+    def seconds(self):
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Recorder:
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.started = datetime.now()
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add(self, s):
+        with self._lock:
+            self.spans.append(s)
+
+    def incr(self, name, n):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        # name -> calls, total / max seconds, rows and rows per second (by total span time)
+        out = {}
+        for s in self.spans:
+            agg = out.setdefault(s.name, {"calls": 0, "seconds": 0.0, "max_s": 0.0, "rows": None})
+            agg["calls"] += 1
+            agg["seconds"] += s.seconds
+            agg["max_s"] = max(agg["max_s"], s.seconds)
+            if s.rows is not None:
+                agg["rows"] = (agg["rows"] or 0) + int(s.rows)
+        for agg in out.values():
+            agg["seconds"] = round(agg["seconds"], 4)
+            agg["max_s"] = round(agg["max_s"], 4)
+            if agg["rows"] is not None and agg["seconds"] > 0:
+                agg["rows_per_s"] = round(agg["rows"] / agg["seconds"], 1)
+        return out
+
+    def trace_events(self):
+        tids = {}
+        events = []
+        for s in self.spans:
+            tid = tids.setdefault(s.thread, len(tids))
+            args = dict(s.attrs)
+            if s.rows is not None:
+                args["rows"] = int(s.rows)
+            events.append(
+                {
+                    "name": s.name,
+                    "cat": s.name.split(".")[0],
+                    "ph": "X",
+                    "ts": round((s.start - self.t0) * 1e6, 1),
+                    "dur": round(s.seconds * 1e6, 1),
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+        for name, tid in tids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}})
+        return {"traceEvents": events, "otherData": {"pipeline": self.pipeline, "counters": self.counters}}
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@contextmanager
+def span(name, rows=None, **attrs):
+    s = Span(name, rows, attrs)
+    stack = _stack()
+    s.depth = len(stack)
+    stack.append(s)
+    try:
+        yield s
+    finally:
+        s.end = time.perf_counter()
+        stack.pop()
+        rec = _active
+        if rec is not None:
+            rec.add(s)
+
+
+def count(name, n=1):
+    rec = _active
+    if rec is not None:
+        rec.incr(name, n)
+
+
+def current_run():
+    return _active
+
+
+def write_run(engine, rec, status, duration):
+    with engine.begin() as conn:
+        run_id = conn.execute(
+            text(
+                """
+                INSERT INTO pipeline_runs (pipeline, started_ts, finished_ts, status, duration_s, spans, counters, host)
+                VALUES (:pipeline, :started, NOW(), :status, :duration, CAST(:spans AS JSONB), CAST(:counters AS JSONB), :host)
+                RETURNING run_id
+                """
+            ),
+            {
+                "pipeline": rec.pipeline,
+                "started": rec.started,
+                "status": status,
+                "duration": round(duration, 3),
+                "spans": json.dumps(rec.summary()),
+                "counters": json.dumps(rec.counters),
+                "host": socket.gethostname(),
+            },
+        ).scalar()
+    return run_id
+
+
+def write_trace(rec, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(rec.trace_events(), f)
+
+
+def print_summary(rec, duration):
+    rows = sorted(rec.summary().items(), key=lambda kv: -kv[1]["seconds"])
+    print(f"\n=== {rec.pipeline}: {duration:.1f}s ===")
+    for name, agg in rows:
+        rate = f"{agg['rows_per_s']:>12,.0f} rows/s" if "rows_per_s" in agg else ""
+        print(f"{name:<32} {agg['calls']:>6}x {agg['seconds']:>9.3f}s  max {agg['max_s']:>8.3f}s  {rate}")
+    for name, n in sorted(rec.counters.items()):
+        print(f"{name:<32} {n:>8}")
+
+
+@contextmanager
+def pipeline_run(pipeline, engine=None, trace_path=TRACE_PATH, quiet=False):
+    # Opens a run for the duration of the block. Nested calls (a stage run from run_daily)
+    # just become a span of the outer run.
+    global _active
+    with _active_lock:
+        nested = _active is not None
+        if not nested:
+            _active = Recorder(pipeline)
+        rec = _active
+
+    if nested:
+        with span(pipeline):
+            yield rec
+        return
+
+    status = "ok"
+    try:
+        with span(pipeline):
+            yield rec
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        with _active_lock:
+            _active = None
+        duration = time.perf_counter() - rec.t0
+        if not quiet:
+            print_summary(rec, duration)
+        if trace_path:
+            write_trace(rec, trace_path)
+            print(f"trace written to {trace_path}")
+        if engine is not None:
+            # never let bookkeeping fail the pipeline itself
+            try:
+                write_run(engine, rec, status, duration)
+            except Exception as e:
+                print(f"WARNING: could not record run in pipeline_runs: {e}")
+
+
+def compare_runs(engine, pipeline, runs=REGRESSION_RUNS, factor=REGRESSION_FACTOR):
+    # Latest run of `pipeline` against the median of the `runs` successful runs before it;
+    # spans slower than factor x median are flagged.
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                """
+                SELECT run_id, started_ts, status, duration_s, spans
+                FROM pipeline_runs
+                WHERE pipeline = :pipeline
+                ORDER BY started_ts DESC
+                LIMIT :n
+                """
+            ),
+            {"pipeline": pipeline, "n": runs + 1},
+        ).mappings().all()
+    if not rows:
+        print(f"No runs recorded for {pipeline}")
+        return []
+
+    latest, history = rows[0], [r for r in rows[1:] if r["status"] == "ok"]
+    print(f"{pipeline} run {latest['run_id']} at {latest['started_ts']} ({latest['status']}, "
+          f"{latest['duration_s']:.1f}s) vs median of {len(history)} earlier runs")
+
+    flagged = []
+    for name, agg in sorted(latest["spans"].items(), key=lambda kv: -kv[1]["seconds"]):
+        past = sorted(r["spans"][name]["seconds"] for r in history if name in r["spans"])
+        if not past:
+            print(f"{name:<32} {agg['seconds']:>9.3f}s  (new)")
+            continue
+        median = past[len(past) // 2]
+        ratio = agg["seconds"] / median if median > 0 else float("inf")
+        slow = ratio >= factor and agg["seconds"] - median > 0.5
+        if slow:
+            flagged.append(name)
+        print(f"{name:<32} {agg['seconds']:>9.3f}s  median {median:>9.3f}s  x{ratio:>5.2f}{'  <-- SLOWER' if slow else ''}")
+    return flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the latest pipeline run against recent history")
+    parser.add_argument("--pipeline", default="run_daily")
+    parser.add_argument("--runs", type=int, default=REGRESSION_RUNS, help="earlier runs to take the median over")
+    parser.add_argument("--factor", type=float, default=REGRESSION_FACTOR, help="flag spans this many times slower")
+    args = parser.parse_args()
+
+    from src.db import get_engine
+
+    flagged = compare_runs(get_engine(), args.pipeline, args.runs, args.factor)
+    if flagged:
+        raise SystemExit(f"{len(flagged)} span(s) regressed: {', '.join(flagged)}")
+
+if __name__ == "__main__":
+    main()
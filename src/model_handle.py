@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from src.instrument import span
+from src.numpy_model import NumpyHeteroModel, load_stats, npz_path_for, stats_path_for
+
+# "keras" always loads TensorFlow, "numpy" needs the exported .npz, "auto" uses the .npz
+# when it exists and is at least as new as the .keras file.
+BACKEND = os.getenv("SCORING_BACKEND", "auto")
+BACKENDS = ("auto", "keras", "numpy")
+
+
+class ModelHandle:
+    # Scaler, feature list, output stats and model for one model version, loaded once and shared.
+    # Loading is lazy; start_loading() kicks it off on a background thread so it can
+    # overlap with other work (e.g. ingest network I/O) and the first predict() waits for it.
+
+    def __init__(self, model_path, scaler_path, feat_path, backend=None, npz_path=None, version=None,
+                 calibration_path=None):
+        backend = backend or BACKEND
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}")
+
+        self.version = version or os.path.splitext(os.path.basename(model_path))[0]
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self.feat_path = feat_path
+        self.npz_path = npz_path or npz_path_for(model_path)
+        self.stats_path = stats_path_for(model_path)
+        self.calibration_path = calibration_path or os.path.splitext(model_path)[0] + "_calibration.json"
+        self.backend = backend
+
+        self.features = None
+        self.stats = None
+        self.scaler = None
+        self.model = None
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._error = None
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def _resolve_backend(self):
+        if self.backend != "auto":
+            return self.backend
+        if os.path.exists(self.npz_path) and (
+            not os.path.exists(self.model_path)
+            or os.path.getmtime(self.npz_path) >= os.path.getmtime(self.model_path)
+        ):
+            return "numpy"
+        return "keras"
+
+    def _load(self):
+        self.backend = self._resolve_backend()
+        if self.backend == "numpy":
+            model = NumpyHeteroModel.load(self.npz_path)
+            self.features, self.stats, self.model = model.features, model.stats, model
+            return
+
+        # heavy imports live here so importing this module stays cheap
+        import joblib
+        import tensorflow as tf
+
+        with open(self.feat_path, "r") as f:
+            features = json.load(f)
+        scaler = joblib.load(self.scaler_path)
+        model = tf.keras.models.load_model(self.model_path, compile=False)
+
+        self.features, self.stats, self.scaler, self.model = features, load_stats(self.stats_path), scaler, model
+
+    def load(self):
+        with self._lock:
+            if not self.loaded:
+                with span("model.load") as s:
+                    self._load()
+                    s.attrs["backend"] = self.backend
+        return self
+
+    def _background_load(self):
+        try:
+            self.load()
+        except Exception as e:
+            self._error = e
+
+    def start_loading(self):
+        if self._thread is None and not self.loaded:
+            self._thread = threading.Thread(target=self._background_load, name="model-load", daemon=True)
+            self._thread.start()
+        return self
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise err
+        return self.load()
+
+    def predict(self, df):
+        # Returns (mu, sigma) as (n_rows, len(self.stats)) float arrays, one column per stat,
+        # before any scoring-time clamp
+        self.wait()
+
+        X = df[self.features].astype(float).values
+        with span("model.scaler_transform", rows=len(X)):
+            if self.backend == "numpy":
+                Xs = self.model.transform(X)
+            else:
+                Xs = self.scaler.transform(X).astype(np.float32)
+
+        with span("model.forward", rows=len(X), backend=self.backend):
+            if self.backend == "numpy":
+                mu, log_var = self.model.forward(Xs)
+            else:
+                mu, log_var = self.model(Xs, training=False)
+                mu, log_var = mu.numpy(), log_var.numpy()
+
+        return mu.astype(float), np.sqrt(np.exp(log_var)).astype(float)
@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+# Pure-NumPy forward pass for the heteroscedastic NLL network, so scoring doesn't need
+# TensorFlow. export_npz() flattens a trained Keras model plus its StandardScaler into one
+# .npz file; NumpyHeteroModel reproduces the Keras outputs from it. Outputs are
+# (n_rows, n_stats), one column per stat head; files without a "stats" entry are points only.
+
+# log_var range of the stat heads: sigma from about 0.14 (a role player's threes) to 25
+LOG_VAR_MIN = -4.0
+LOG_VAR_MAX = 6.44
+
+NPZ_FORMAT_VERSION = 1
+
+
+def _dense_layers(model):
+    # Returns (hidden, mu_layer, log_var_layer, clip). Current models feed a Dense named
+    # "log_var_raw" through ReLU(max_value) "log_var_clip" and a Rescaling offset "log_var";
+    # models from before the offset have ReLU(max_value=LOG_VAR_MAX) "log_var" (a [0, max]
+    # clip); older artifacts (including the shipped v1_hetero_nll.keras) have an unclipped
+    # Dense head named "log_var". clip is (offset, low, high): log_var = clip(raw + offset).
+    import tensorflow as tf
+
+    dense = [l for l in model.layers if isinstance(l, tf.keras.layers.Dense)]
+    names = {l.name for l in dense}
+
+    mu_layer = model.get_layer("mu")
+    if "log_var_raw" in names:
+        log_var_layer = model.get_layer("log_var_raw")
+        layers = {l.name: l for l in model.layers}
+        if "log_var_clip" in layers:
+            offset = float(layers["log_var"].offset)
+            clip = (offset, offset, offset + float(layers["log_var_clip"].max_value))
+        else:
+            clip = (0.0, 0.0, float(layers["log_var"].max_value))
+    elif "log_var" in names:
+        log_var_layer, clip = model.get_layer("log_var"), (0.0, -np.inf, np.inf)
+    else:
+        # unnamed raw head feeding a clipping layer: the last Dense that isn't "mu"
+        log_var_layer, clip = [l for l in dense if l is not mu_layer][-1], (0.0, 0.0, LOG_VAR_MAX)
+
+    hidden = [l for l in dense if l is not mu_layer and l is not log_var_layer]
+    return hidden, mu_layer, log_var_layer, clip
+
+
+def export_npz(model, scaler, features, path, stats=("pts",)):
+    hidden, mu_layer, log_var_layer, (offset, low, high) = _dense_layers(model)
+
+    arrays = {
+        "format_version": np.array(NPZ_FORMAT_VERSION),
+        "features": np.array(features),
+        "stats": np.array(list(stats)),
+        "scaler_mean": np.asarray(scaler.mean_, dtype=np.float64),
+        "scaler_scale": np.asarray(scaler.scale_, dtype=np.float64),
+        "n_hidden": np.array(len(hidden)),
+        "log_var_clip": np.array([low, high], dtype=np.float32),
+    }
+    for i, layer in enumerate(hidden):
+        W, b = layer.get_weights()
+        arrays[f"hidden_{i}_W"] = W.astype(np.float32)
+        arrays[f"hidden_{i}_b"] = b.astype(np.float32)
+    for name, layer, shift in (("mu", mu_layer, 0.0), ("log_var", log_var_layer, offset)):
+        W, b = layer.get_weights()
+        arrays[f"{name}_W"] = W.astype(np.float32)
+        # the Rescaling offset is folded into the bias, so forward() stays one clip
+        arrays[f"{name}_b"] = (b + shift).astype(np.float32)
+
+    tmp = f"{path}.tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    return path
+
+
+class NumpyHeteroModel:
+    def __init__(self, arrays):
+        self.features = [str(f) for f in arrays["features"]]
+        self.stats = [str(s) for s in arrays["stats"]] if "stats" in arrays else ["pts"]
+        self.scaler_mean = arrays["scaler_mean"]
+        self.scaler_scale = arrays["scaler_scale"]
+        self.hidden = [
+            (arrays[f"hidden_{i}_W"], arrays[f"hidden_{i}_b"])
+            for i in range(int(arrays["n_hidden"]))
+        ]
+        self.mu_W, self.mu_b = arrays["mu_W"], arrays["mu_b"]
+        self.log_var_W, self.log_var_b = arrays["log_var_W"], arrays["log_var_b"]
+        self.log_var_min, self.log_var_max = (float(v) for v in arrays["log_var_clip"])
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as z:
+            return cls({k: z[k] for k in z.files})
+
+    def transform(self, X):
+        # StandardScaler.transform, in float64 like sklearn, handed to the net as float32
+        X = np.asarray(X, dtype=np.float64)
+        return ((X - self.scaler_mean) / self.scaler_scale).astype(np.float32)
+
+    def forward(self, Xs):
+        # (mu, log_var) for already-scaled inputs, matching model(Xs, training=False)
+        h = np.asarray(Xs, dtype=np.float32)
+        for W, b in self.hidden:
+            h = np.maximum(h @ W + b, 0.0)
+        mu = h @ self.mu_W + self.mu_b
+        log_var = np.clip(h @ self.log_var_W + self.log_var_b, self.log_var_min, self.log_var_max)
+        return mu, log_var
+
+    def predict(self, X):
+        # (mu, sigma) as (n_rows, n_stats) float64 arrays from unscaled feature values
+        mu, log_var = self.forward(self.transform(X))
+        return mu.astype(float), np.sqrt(np.exp(log_var)).astype(float)
+
+
+def npz_path_for(model_path):
+    return os.path.splitext(model_path)[0] + ".npz"
+
+
+def stats_path_for(model_path):
+    return os.path.splitext(model_path)[0] + "_stats.json"
+
+
+def load_stats(path):
+    # Output stats of a Keras model; models saved before the stat heads predict points only
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return ["pts"]
+
+
+def main():
+    # Export: python -m src.numpy_model artifacts/v1_hetero_nll.keras
+    parser = argparse.ArgumentParser(description="Export a Keras hetero NLL model to a flat .npz for NumPy scoring")
+    parser.add_argument("model_path")
+    parser.add_argument("--scaler", help="defaults to <model>_scaler.joblib")
+    parser.add_argument("--features", help="defaults to <model>_features.json")
+    parser.add_argument("--out", help="defaults to <model>.npz")
+    parser.add_argument("--check-rows", type=int, default=2048, help="random rows used to compare against Keras")
+    args = parser.parse_args()
+
+    import joblib
+    import tensorflow as tf
+
+    stem = os.path.splitext(args.model_path)[0]
+    scaler = joblib.load(args.scaler or f"{stem}_scaler.joblib")
+    with open(args.features or f"{stem}_features.json", "r") as f:
+        features = json.load(f)
+    model = tf.keras.models.load_model(args.model_path, compile=False)
+
+    out = export_npz(model, scaler, features, args.out or npz_path_for(args.model_path),
+                     stats=load_stats(stats_path_for(args.model_path)))
+
+    # sanity check: same outputs as Keras on inputs spread around the scaler's range
+    rng = np.random.default_rng(0)
+    X = scaler.mean_ + rng.standard_normal((args.check_rows, len(features))) * scaler.scale_
+    np_model = NumpyHeteroModel.load(out)
+    mu_np, log_var_np = np_model.forward(np_model.transform(X))
+    mu_tf, log_var_tf = model(scaler.transform(X).astype(np.float32), training=False)
+    err_mu = float(np.max(np.abs(mu_np - mu_tf.numpy())))
+    err_lv = float(np.max(np.abs(log_var_np - log_var_tf.numpy())))
+
+    print(f"wrote {out} ({os.path.getsize(out)} bytes)")
+    print(f"max abs diff vs keras: mu={err_mu:.2e} log_var={err_lv:.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import argparse
+import re
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtri
+from scipy.stats import qmc
+from sqlalchemy import text
+
+# Joint probabilities for multi-leg player points parlays.
+#
+# Each player's points are Normal(mu_pts, sigma_pts) as scored into predictions_daily; players
+# in the same game are tied together with a Gaussian copula whose correlations come from
+# player_game_stats: per pair, the correlation of the two players' standardized points over
+# games they both played, shrunk toward the pooled teammate (or opponent) correlation when
+# the pair has little shared history. Players in different games are independent.
+#
+# Samples are scrambled Sobol points (or antithetic pseudo-random pairs), and every distinct
+# leg is evaluated once into a bit-packed hit vector, so a parlay is an AND + popcount over a
+# few kilobytes. Lines use the same continuity correction as probs_ge (25 means 25+ points).
+
+N_SAMPLES = 2 ** 15
+HISTORY_DAYS = 730
+SHRINK_GAMES = 20
+MIN_MINUTES = 5
+
+# game_id is only needed when the player has more than one game on the slate
+Leg = namedtuple("Leg", ["player_id", "line", "over", "game_id"], defaults=(None,))
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+_LEG_RE = re.compile(r"^\s*(?:(\w+):)?(\d+)\s*(>=|<)\s*([0-9.]+)\s*$")
+
+
+def _popcount(words):
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return int(np.bitwise_count(words).sum())
+    return int(_POPCOUNT[words.view(np.uint8)].sum())
+
+
+def parse_leg(s):
+    # "203999>=25" -> 25+ points, "203999<10" -> at most 9 points,
+    # "0022400123:203999>=25" -> 25+ points in that game
+    m = _LEG_RE.match(s)
+    if not m:
+        raise ValueError(f'bad leg {s!r}, expected e.g. "203999>=25", "203999<10" or "0022400123:203999>=25"')
+    return Leg(int(m.group(2)), float(m.group(4)), m.group(3) == ">=", m.group(1))
+
+
+def load_pair_correlations(engine, player_ids, since=None):
+    # One row per player pair that shared a game: n shared games, correlation of standardized
+    # points and whether they were teammates
+    since = since or (date.today() - timedelta(days=HISTORY_DAYS))
+    return pd.read_sql(
+        text(
+            """
+            WITH z AS (
+              SELECT pgs.game_id, pgs.player_id, pgs.team_id,
+                     (pgs.points - AVG(pgs.points) OVER w) / NULLIF(STDDEV_SAMP(pgs.points) OVER w, 0) AS z
+              FROM player_game_stats pgs
+              JOIN games g ON g.game_id = pgs.game_id
+              WHERE pgs.player_id = ANY(:ids)
+                AND g.game_date >= :since
+                AND pgs.minutes >= :min_minutes
+              WINDOW w AS (PARTITION BY pgs.player_id)
+            )
+            SELECT a.player_id AS p1, b.player_id AS p2,
+                   BOOL_AND(a.team_id = b.team_id) AS teammates,
+                   COUNT(*) AS n,
+                   CORR(a.z, b.z) AS rho
+            FROM z a
+            JOIN z b ON b.game_id = a.game_id AND b.player_id > a.player_id
+            WHERE a.z IS NOT NULL AND b.z IS NOT NULL
+            GROUP BY a.player_id, b.player_id, a.team_id = b.team_id
+            """
+        ),
+        engine,
+        params={"ids": [int(p) for p in player_ids], "since": since, "min_minutes": MIN_MINUTES},
+    )
+
+
+def pooled_correlations(pairs):
+    # Shared-game-weighted average correlation for teammates and for opponents
+    pooled = {}
+    for flag in (True, False):
+        sub = pairs[(pairs["teammates"] == flag) & pairs["rho"].notna()]
+        pooled[flag] = float(np.average(sub["rho"], weights=sub["n"])) if len(sub) else 0.0
+    return pooled
+
+
+def nearest_correlation(C, eps=1e-6):
+    # Clip negative eigenvalues and rescale to a unit diagonal, so the matrix is a valid
+    # correlation matrix for the Cholesky factor
+    w, V = np.linalg.eigh((C + C.T) / 2)
+    C = (V * np.maximum(w, eps)) @ V.T
+    d = np.sqrt(np.diag(C))
+    return C / np.outer(d, d)
+
+
+def correlation_matrix(slate, pairs, shrink_games=SHRINK_GAMES):
+    # slate: one row per player and game with game_id, team_id. Same game -> shrunk pair correlation,
+    # different games -> 0.
+    ids = slate["player_id"].to_numpy()
+    n = len(ids)
+    rows = {}
+    for i, p in enumerate(ids):
+        rows.setdefault(int(p), []).append(i)
+    game = slate["game_id"].to_numpy()
+    team = slate["team_id"].to_numpy()
+
+    pooled = pooled_correlations(pairs)
+    same_game = game[:, None] == game[None, :]
+    same_team = team[:, None] == team[None, :]
+    C = np.where(same_game, np.where(same_team, pooled[True], pooled[False]), 0.0)
+
+    # a player can be on the slate more than once (one row per game)
+    for r in pairs.itertuples(index=False):
+        if pd.isna(r.rho):
+            continue
+        for i in rows.get(int(r.p1), ()):
+            for j in rows.get(int(r.p2), ()):
+                if not same_game[i, j] or bool(r.teammates) != bool(same_team[i, j]):
+                    continue
+                w = r.n / (r.n + shrink_games)
+                C[i, j] = C[j, i] = w * r.rho + (1 - w) * pooled[bool(same_team[i, j])]
+
+    np.fill_diagonal(C, 1.0)
+    return nearest_correlation(C) if n else C
+
+
+def standard_normals(n_samples, dim, method="sobol", seed=0):
+    # (n_samples, dim) N(0, 1) draws. Sobol needs a power of two for its balance properties;
+    # antithetic pairs each draw with its negation, so an odd n_samples is rounded up to even.
+    if method == "sobol":
+        u = qmc.Sobol(d=dim, scramble=True, seed=seed).random(n_samples)
+        return ndtri(np.clip(u, 1e-12, 1 - 1e-12))
+    if method == "antithetic":
+        half = np.random.default_rng(seed).standard_normal(((n_samples + 1) // 2, dim))
+        return np.concatenate([half, -half])
+    if method == "mc":
+        return np.random.default_rng(seed).standard_normal((n_samples, dim))
+    raise ValueError(f"unknown sampling method {method!r}")
+
+
+class SlateSimulator:
+    # Correlated point samples for the players on a slate, reused across all parlays. Games
+    # are independent blocks of the correlation matrix, so each game is sampled on its own
+    # (low-dimensional Sobol, small Cholesky) and only once a leg refers to it.
+
+    def __init__(self, slate, corr, n_samples=N_SAMPLES, method="sobol", seed=0):
+        self.slate = slate.reset_index(drop=True)
+        self.pos = {}  # player_id -> {game_id: row}
+        for i, (g, p) in enumerate(zip(self.slate["game_id"], self.slate["player_id"])):
+            self.pos.setdefault(int(p), {})[g] = i
+        self.corr = corr
+        # probabilities divide by the number of draws, which standard_normals rounds up to even
+        # for antithetic sampling
+        self.n_samples = n_samples + n_samples % 2 if method == "antithetic" else n_samples
+        self.method = method
+        self.seed = seed
+
+        self._games = {g: np.flatnonzero(self.slate["game_id"].to_numpy() == g)
+                       for g in self.slate["game_id"].unique()}
+        self._game_index = {g: i for i, g in enumerate(self._games)}
+        self._points = {}
+        self._legs = {}
+        self._bits = []
+
+    def _game_points(self, game_id):
+        # (n_samples, n_players_in_game) float32, column-major so a player's samples are contiguous
+        if game_id not in self._points:
+            block = self._games[game_id]
+            mu = self.slate["mu_pts"].to_numpy(dtype=float)[block]
+            sigma = self.slate["sigma_pts"].to_numpy(dtype=float)[block]
+            L = np.linalg.cholesky(self.corr[np.ix_(block, block)])
+            Z = standard_normals(self.n_samples, len(block), self.method, self.seed + self._game_index[game_id])
+            if self.method == "sobol":
+                # Sobol streams scrambled with different seeds are still correlated point by
+                # point (the first dimension badly so), which would tie independent games
+                # together: each game's points go in their own random order instead (QMC
+                # within a game, independent across games)
+                Z = Z[np.random.default_rng([self.seed, self._game_index[game_id]]).permutation(len(Z))]
+            self._points[game_id] = np.asfortranarray((mu + sigma * (Z @ L.T)).astype(np.float32))
+        return self._points[game_id]
+
+    def _row(self, leg):
+        games = self.pos.get(leg.player_id)
+        if not games:
+            raise KeyError(f"player {leg.player_id} is not on this slate")
+        if leg.game_id is not None:
+            if leg.game_id not in games:
+                raise KeyError(f"player {leg.player_id} has no game {leg.game_id} on this slate")
+            return games[leg.game_id]
+        if len(games) > 1:
+            raise ValueError(f"player {leg.player_id} has {len(games)} games on this slate "
+                             f"({', '.join(map(str, games))}), give the leg a game_id")
+        return next(iter(games.values()))
+
+    def _leg_bits(self, leg):
+        i = self._row(leg)
+        key = (i, float(np.ceil(leg.line)), leg.over)
+        if key not in self._legs:
+            game_id = self.slate.at[i, "game_id"]
+            col = self._game_points(game_id)[:, int(np.searchsorted(self._games[game_id], i))]
+            cut = np.ceil(leg.line) - 0.5
+            hit = col >= cut if leg.over else col < cut
+            self._legs[key] = len(self._bits)
+            # pad to whole 64-bit words so ANDs run on uint64
+            bits = np.packbits(hit)
+            bits = np.concatenate([bits, np.zeros(-len(bits) % 8, dtype=np.uint8)])
+            self._bits.append(bits.view(np.uint64))
+        return self._legs[key]
+
+    def marginal(self, leg):
+        return _popcount(self._bits[self._leg_bits(leg)]) / self.n_samples
+
+    def joint_prob(self, legs):
+        idx = [self._leg_bits(leg) for leg in legs]
+        both = self._bits[idx[0]]
+        for i in idx[1:]:
+            both = both & self._bits[i]
+        return _popcount(both) / self.n_samples
+
+    def evaluate(self, parlays):
+        # parlays: list of leg lists -> joint probability, independence baseline and their ratio
+        rows = []
+        for legs in parlays:
+            p = self.joint_prob(legs)
+            p_indep = float(np.prod([self.marginal(leg) for leg in legs]))
+            rows.append(
+                {
+                    "legs": ", ".join(f"{f'{leg.game_id}:' if leg.game_id else ''}{leg.player_id}"
+                                      f"{'>=' if leg.over else '<'}{leg.line:g}" for leg in legs),
+                    "n_legs": len(legs),
+                    "p_joint": p,
+                    "p_indep": p_indep,
+                    "corr_lift": p / p_indep if p_indep > 0 else np.nan,
+                    "std_err": np.sqrt(p * (1 - p) / self.n_samples),
+                }
+            )
+        return pd.DataFrame(rows)
+
+
+def load_slate(engine, as_of_date, model_version=None):
+    # Scored players for one date with the team they play for
+    return pd.read_sql(
+        text(
+            f"""
+            SELECT p.game_id, p.player_id,
+                   CASE WHEN f.home_flag = 1 THEN g.home_team_id ELSE g.away_team_id END AS team_id,
+                   p.mu_pts, p.sigma_pts
+            FROM predictions_daily p
+            JOIN player_features_daily f USING (as_of_date, game_id, player_id)
+            JOIN games g ON g.game_id = p.game_id
+            WHERE p.as_of_date = :d
+              {"AND p.model_version = :mv" if model_version else ""}
+            ORDER BY p.game_id, team_id, p.player_id
+            """
+        ),
+        engine,
+        params={"d": as_of_date, "mv": model_version},
+    )
+
+
+def build_simulator(engine, as_of_date, n_samples=N_SAMPLES, method="sobol", seed=0, since=None):
+    slate = load_slate(engine, as_of_date)
+    if slate.empty:
+        raise ValueError(f"no predictions for {as_of_date}")
+    pairs = load_pair_correlations(engine, slate["player_id"].tolist(), since)
+    corr = correlation_matrix(slate, pairs)
+    return SlateSimulator(slate, corr, n_samples, method, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Joint probability of correlated player points parlays")
+    parser.add_argument("parlays", nargs="+",
+                        help='one parlay per argument, legs comma separated: "203999>=25,1628983>=20" '
+                             '(prefix a leg with its game id, "0022400123:203999>=25", if the player has several games)')
+    parser.add_argument("--date", default=date.today().isoformat(), help="slate date (as_of_date), YYYY-MM-DD")
+    parser.add_argument("--samples", type=int, default=N_SAMPLES)
+    parser.add_argument("--method", choices=("sobol", "antithetic", "mc"), default="sobol")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from src.db import get_engine
+
+    parlays = [[parse_leg(s) for s in p.split(",") if s.strip()] for p in args.parlays]
+
+    t0 = time.perf_counter()
+    sim = build_simulator(get_engine(), date.fromisoformat(args.date), args.samples, args.method, args.seed)
+    t1 = time.perf_counter()
+    board = sim.evaluate(parlays)
+    t2 = time.perf_counter()
+
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(board)
+    print(f"{len(sim.slate)} players, {args.samples} samples: setup {t1 - t0:.2f}s, "
+          f"{len(parlays)} parlays in {(t2 - t1) * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
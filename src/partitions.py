@@ -0,0 +1,268 @@
+import argparse
+import os
+import re
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from src.instrument import pipeline_run, span
+
+# player_features_daily, predictions_daily and predictions_shadow are range-partitioned by
+# as_of_date with one partition per day (<table>_pYYYYMMDD), so a WHERE as_of_date = ... read
+# only touches that day's partition however much history piles up, and expiring a day is a
+# DROP TABLE instead of a DELETE. Writers call ensure_partitions() for the dates they are about to write.
+#
+#   python -m src.partitions --migrate        # one-off, for tables created before partitioning
+#   python -m src.partitions --retention      # drop partitions older than RETENTION_DAYS
+
+PARTITIONED_TABLES = ("player_features_daily", "predictions_daily", "predictions_shadow")
+RETENTION_DAYS = {
+    "player_features_daily": int(os.getenv("FEATURES_RETENTION_DAYS", "30")),
+    "predictions_daily": int(os.getenv("PREDICTIONS_RETENTION_DAYS", "365")),
+    "predictions_shadow": int(os.getenv("SHADOW_RETENTION_DAYS", "90")),
+}
+# Incremental feature builds only rewrite the rows that changed, so an old partition can still
+# hold the newest feature row of a (game_id, player_id). Those rows are carried into the
+# table's base partition (<table>_base, as_of_date BASE_DATE) before the old one is dropped.
+# The base partition is never expired, so each row is copied once rather than every night.
+CARRY_FORWARD = {"player_features_daily": ["game_id", "player_id"]}
+BASE_DATE = date(1970, 1, 1)
+SCHEMA_SQL = os.path.join("sql", "schema.sql")
+
+_PARTITION_RE = re.compile(r"_p(\d{8})$")
+
+
+def partition_name(table, day):
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def is_partitioned(conn, table):
+    kind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table}).scalar()
+    return kind == "p"
+
+
+def list_partitions(conn, table):
+    # {day: partition name} for the daily partitions of table
+    rows = conn.execute(
+        text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:t)
+        """),
+        {"t": table},
+    ).scalars()
+    out = {}
+    for name in rows:
+        m = _PARTITION_RE.search(name)
+        if m:
+            out[date(int(m.group(1)[:4]), int(m.group(1)[4:6]), int(m.group(1)[6:]))] = name
+    return out
+
+
+def ensure_partitions(conn, table, dates):
+    # Creates the daily partitions for `dates` that don't exist yet. No-op on a table that
+    # hasn't been migrated, so writers work before and after --migrate.
+    if not is_partitioned(conn, table):
+        return 0
+    days = {_as_date(d) for d in dates}
+    missing = sorted(days - set(list_partitions(conn, table)))
+    for day in missing:
+        conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(table, day)} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+        )
+    return len(missing)
+
+
+def ensure_base_partition(conn, table):
+    # Everything up to BASE_DATE; not named like a daily partition, so retention never sees it
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {table}_base PARTITION OF {table} "
+        f"FOR VALUES FROM (MINVALUE) TO ('{(BASE_DATE + timedelta(days=1)).isoformat()}')"
+    )
+
+
+def _columns(conn, table):
+    return list(conn.execute(
+        text("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = :t
+            ORDER BY ordinal_position
+        """),
+        {"t": table},
+    ).scalars())
+
+
+def drop_expired(engine, table, keep_days=None, today=None, dry_run=False):
+    # Drops the partitions of table older than keep_days. Returns the dropped partition names.
+    keep_days = RETENTION_DAYS[table] if keep_days is None else keep_days
+    cutoff = (today or date.today()) - timedelta(days=keep_days)
+
+    with engine.begin() as conn:
+        if not is_partitioned(conn, table):
+            print(f"{table} is not partitioned yet (run python -m src.partitions --migrate), skipping retention")
+            return []
+        expired = {d: name for d, name in list_partitions(conn, table).items() if d < cutoff}
+        if not expired or dry_run:
+            for name in sorted(expired.values()):
+                print(f"would drop {name}")
+            return sorted(expired.values())
+
+        with span(f"retention.{table}", partitions=len(expired)) as s:
+            keys = CARRY_FORWARD.get(table)
+            if keys:
+                ensure_base_partition(conn, table)
+                cols = [c for c in _columns(conn, table) if c != "as_of_date"]
+                col_list = ", ".join(cols)
+                join = " AND ".join(f"n.{k} = old.{k}" for k in keys)
+                # a row carried earlier for the same key is older than anything expiring now
+                update = ", ".join(f"{c} = EXCLUDED.{c}" for c in cols if c not in keys)
+                carried = conn.execute(
+                    text(f"""
+                        INSERT INTO {table} (as_of_date, {col_list})
+                        SELECT CAST(:base AS DATE), {col_list}
+                        FROM (
+                            SELECT DISTINCT ON ({", ".join(keys)}) *
+                            FROM {table}
+                            WHERE as_of_date > :base AND as_of_date < :cutoff
+                            ORDER BY {", ".join(keys)}, as_of_date DESC
+                        ) old
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM {table} n WHERE n.as_of_date >= :cutoff AND {join}
+                        )
+                        ON CONFLICT (as_of_date, {", ".join(keys)}) DO UPDATE SET {update}
+                    """),
+                    {"base": BASE_DATE, "cutoff": cutoff},
+                ).rowcount
+                s.attrs["carried_forward"] = carried
+                s.rows = carried
+
+            for name in sorted(expired.values()):
+                conn.exec_driver_sql(f"DROP TABLE {name}")
+
+    msg = f"{table}: dropped {len(expired)} partitions before {cutoff}"
+    if keys:
+        msg += f", carried {carried} latest rows forward"
+    print(msg)
+    return sorted(expired.values())
+
+
+def run_retention(engine, today=None, dry_run=False):
+    return {t: drop_expired(engine, t, today=today, dry_run=dry_run) for t in PARTITIONED_TABLES}
+
+
+def _dependent_views(conn, table):
+    # Views (and materialized views) built on table, directly or through other views,
+    # as (name, kind, definition) with dependencies before dependents.
+    return conn.execute(
+        text("""
+            WITH RECURSIVE deps(oid, depth) AS (
+                SELECT r.ev_class, 1
+                FROM pg_depend d
+                JOIN pg_rewrite r ON r.oid = d.objid
+                WHERE d.refobjid = to_regclass(:t) AND r.ev_class <> d.refobjid
+                UNION
+                SELECT r.ev_class, deps.depth + 1
+                FROM deps
+                JOIN pg_depend d ON d.refobjid = deps.oid
+                JOIN pg_rewrite r ON r.oid = d.objid
+                WHERE r.ev_class <> deps.oid
+            )
+            SELECT format('%I.%I', n.nspname, c.relname), c.relkind, pg_get_viewdef(c.oid)
+            FROM deps
+            JOIN pg_class c ON c.oid = deps.oid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            GROUP BY c.oid, n.nspname, c.relname, c.relkind
+            ORDER BY MAX(deps.depth)
+        """),
+        {"t": table},
+    ).fetchall()
+
+
+def migrate(engine, schema_path=SCHEMA_SQL):
+    # Converts tables created before partitioning: rename the old table, create the
+    # partitioned one from schema.sql, copy the rows over and drop the old table. Views on
+    # the table are dropped and recreated from their saved definitions (grants on them are not).
+    with open(schema_path, "r") as f:
+        ddl = f.read()
+
+    with engine.begin() as conn:
+        todo = [t for t in PARTITIONED_TABLES
+                if conn.execute(text("SELECT to_regclass(:t)"), {"t": t}).scalar() is not None
+                and not is_partitioned(conn, t)]
+        if not todo:
+            print("player_features_daily and predictions_daily are already partitioned")
+            return []
+
+        views = []
+        for table in todo:
+            views += [v for v in _dependent_views(conn, table) if v not in views]
+        for name, kind, _ in reversed(views):
+            conn.exec_driver_sql(f"DROP {'MATERIALIZED VIEW' if kind == 'm' else 'VIEW'} IF EXISTS {name}")
+
+        for table in todo:
+            old = f"{table}_unpartitioned"
+            pkey = conn.execute(
+                text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:t) AND contype = 'p'"),
+                {"t": table},
+            ).scalar()
+            conn.exec_driver_sql(f"ALTER TABLE {table} RENAME TO {old}")
+            if pkey:
+                conn.exec_driver_sql(f"ALTER TABLE {old} RENAME CONSTRAINT {pkey} TO {old}_pkey")
+
+        conn.exec_driver_sql(ddl)
+
+        for table in todo:
+            old = f"{table}_unpartitioned"
+            with span(f"migrate.{table}") as s:
+                days = conn.execute(text(f"SELECT DISTINCT as_of_date FROM {old}")).scalars().all()
+                ensure_partitions(conn, table, days)
+                cols = ", ".join(c for c in _columns(conn, old) if c in set(_columns(conn, table)))
+                s.rows = conn.execute(text(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {old}")).rowcount
+            conn.exec_driver_sql(f"DROP TABLE {old}")
+            print(f"{table}: {s.rows} rows moved into {len(days)} daily partitions")
+
+        # indexes from schema.sql that already existed on the old tables under the same names
+        conn.exec_driver_sql(ddl)
+
+        for name, kind, definition in views:
+            body = definition.strip().rstrip(";")
+            conn.exec_driver_sql(f"CREATE {'MATERIALIZED VIEW' if kind == 'm' else 'VIEW'} {name} AS {body}")
+        if views:
+            print(f"recreated views: {', '.join(name for name, _, _ in views)}")
+    return todo
+
+
+def main():
+    from src.db import get_engine
+
+    parser = argparse.ArgumentParser(description="Daily partitions of player_features_daily / predictions_daily")
+    parser.add_argument("--migrate", action="store_true", help="partition tables created before partitioning")
+    parser.add_argument("--retention", action="store_true", help="drop partitions past their retention")
+    parser.add_argument("--dry-run", action="store_true", help="with --retention, only list what would be dropped")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    if args.migrate:
+        with pipeline_run("partitions_migrate", engine):
+            migrate(engine)
+    if args.retention:
+        with pipeline_run("partitions_retention", engine):
+            run_retention(engine, dry_run=args.dry_run)
+    if not (args.migrate or args.retention):
+        with engine.connect() as conn:
+            for table in PARTITIONED_TABLES:
+                if not is_partitioned(conn, table):
+                    print(f"{table}: not partitioned")
+                    continue
+                parts = sorted(list_partitions(conn, table))
+                span_txt = f"{parts[0]} .. {parts[-1]}" if parts else "none"
+                print(f"{table}: {len(parts)} daily partitions ({span_txt}), keeping {RETENTION_DAYS[table]} days")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from src.instrument import count
+from src.numpy_model import load_stats
+
+# Cache of (mu, sigma) per feature row, so rescoring only runs the model on rows that are new
+# or whose features changed since the last run. Rows are keyed by a 64-bit hash of the ordered
+# feature vector; the key space belongs to one set of model artifacts:
+#   <cache_dir>/<model_version>_<fingerprint>/<n>.parquet   key, mu_0.., sigma_0.. segments
+# (one mu / sigma column per stat head; segments written before the stat heads have a single
+# mu, sigma pair and are read as head 0).
+# The fingerprint covers the artifact files (size + mtime), so retraining or re-exporting the
+# model starts a fresh directory and removes the stale ones for that model version.
+#
+# Lookups go through an in-memory LRU first, then the on-disk segments. Only the segment keys
+# are held in memory (sorted, with their row numbers, one index per segment); values are read
+# from a segment when one of its keys is asked for. New predictions are buffered and written as
+# one segment per flush(). Past MAX_SEGMENTS, the run of adjacent segments with the fewest
+# bytes is merged, so small segments get merged and a big one isn't rewritten on every flush.
+# The oldest segments are deleted once the directory grows past MAX_BYTES or they're older
+# than MAX_AGE_DAYS (rows in them are just scored again).
+
+CACHE_DIR = os.getenv("PREDICTION_CACHE_DIR", os.path.join("data", "cache", "predictions"))
+ENABLED = os.getenv("PREDICTION_CACHE", "1") != "0"
+LRU_ROWS = int(os.getenv("PREDICTION_CACHE_LRU_ROWS", "500000"))
+MAX_SEGMENTS = 16
+MAX_BYTES = int(float(os.getenv("PREDICTION_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+MAX_AGE_DAYS = float(os.getenv("PREDICTION_CACHE_MAX_AGE_DAYS", "60"))
+
+_caches_lock = threading.Lock()
+
+
+def artifact_fingerprint(paths):
+    h = hashlib.sha1()
+    for p in paths:
+        if os.path.exists(p):
+            st = os.stat(p)
+            h.update(f"{os.path.basename(p)}:{st.st_size}:{st.st_mtime_ns};".encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+def row_keys(df, features):
+    # Vectorized 64-bit hash per row of the ordered feature vector (NaN hashes consistently)
+    X = df[features].astype("float64")
+    X.columns = range(len(features))
+    return pd.util.hash_pandas_object(X, index=False).to_numpy(dtype=np.uint64)
+
+
+class PredictionCache:
+    def __init__(self, handle, model_version=None, cache_dir=CACHE_DIR, lru_rows=LRU_ROWS,
+                 max_bytes=MAX_BYTES, max_age_days=MAX_AGE_DAYS):
+        model_version = model_version or handle.version
+        self.handle = handle
+        self.version = model_version
+        self.calibration_path = handle.calibration_path
+        self.lru_rows = lru_rows
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.fingerprint = artifact_fingerprint(
+            [handle.model_path, handle.scaler_path, handle.feat_path, handle.npz_path, handle.stats_path]
+        )
+        self.dir = os.path.join(cache_dir, f"{model_version}_{self.fingerprint}")
+        self.hits = 0
+        self.misses = 0
+
+        self._features = None
+        self._stats = None
+        self._lru = OrderedDict()
+        self._segments = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+        # artifacts changed -> older key spaces of this model version are dead (matching the
+        # fingerprint exactly, so v1_x doesn't sweep up the caches of a v1_x_wide)
+        for stale in glob.glob(os.path.join(cache_dir, f"{model_version}_{'[0-9a-f]' * 12}")):
+            if os.path.abspath(stale) != os.path.abspath(self.dir):
+                shutil.rmtree(stale, ignore_errors=True)
+
+    @property
+    def features(self):
+        # Read from the features file when possible, so a run where every row hits never
+        # has to load the model (or import TensorFlow) at all
+        if self._features is None:
+            if self.handle.loaded:
+                self._features = self.handle.features
+            elif os.path.exists(self.handle.feat_path):
+                with open(self.handle.feat_path, "r") as f:
+                    self._features = json.load(f)
+            else:
+                self._features = self.handle.wait().features
+        return self._features
+
+    @property
+    def stats(self):
+        # Same as the model's own: no stats file means a points-only model
+        if self._stats is None:
+            self._stats = self.handle.stats if self.handle.loaded else load_stats(self.handle.stats_path)
+        return self._stats
+
+    def _columns(self):
+        k = len(self.stats)
+        return [f"mu_{j}" for j in range(k)], [f"sigma_{j}" for j in range(k)]
+
+    def _index_segment(self, path, keys):
+        # sorted keys of one segment plus each key's row in it; a key repeated within the
+        # segment resolves to its last row
+        keys = np.asarray(keys, dtype=np.uint64)
+        rows = np.arange(len(keys))[::-1]
+        keys, first = np.unique(keys[::-1], return_index=True)
+        self._segments[path] = (keys, rows[first])
+
+    def _load_index(self):
+        # Keys of every segment, oldest first (segment names are their write time in ns)
+        self._segments = OrderedDict()
+        for path in sorted(glob.glob(os.path.join(self.dir, "*.parquet")), key=_segment_ns):
+            try:
+                keys = pd.read_parquet(path, columns=["key"])["key"].to_numpy(dtype=np.uint64)
+            except (FileNotFoundError, OSError):
+                continue
+            self._index_segment(path, keys)
+        self._maintain()
+
+    def _read_segment(self, path):
+        mu_cols, sigma_cols = self._columns()
+        df = pd.read_parquet(path).rename(columns={"mu": "mu_0", "sigma": "sigma_0"})
+        return df[["key"] + mu_cols + sigma_cols]
+
+    def _write_segment(self, df, path=None):
+        os.makedirs(self.dir, exist_ok=True)
+        path = path or os.path.join(self.dir, f"{time.time_ns()}.parquet")
+        tmp = f"{path}.tmp"
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        return path
+
+    def _maintain(self):
+        # Merge segments past MAX_SEGMENTS, then drop the oldest ones past max_bytes / max_age
+        paths = list(self._segments)
+        if len(paths) > MAX_SEGMENTS:
+            sizes = [_size(p) for p in paths]
+            k = len(paths) - MAX_SEGMENTS // 2 + 1
+            start = min(range(len(paths) - k + 1), key=lambda i: sum(sizes[i:i + k]))
+            run = paths[start:start + k]
+            merged = pd.concat([self._read_segment(p) for p in run], ignore_index=True)
+            merged = merged.drop_duplicates("key", keep="last")
+            # the merged segment takes the place (and write time) of the oldest one in the run
+            self._write_segment(merged, run[0])
+            for p in run[1:]:
+                os.remove(p)
+            segments, self._segments = self._segments, OrderedDict()
+            for p in paths:
+                if p == run[0]:
+                    self._index_segment(p, merged["key"].to_numpy(dtype=np.uint64))
+                elif p not in run:
+                    self._segments[p] = segments[p]
+
+        total = sum(_size(p) for p in self._segments)
+        oldest_ns = time.time_ns() - int(self.max_age_days * 86400 * 1e9)
+        for p in list(self._segments):
+            if total <= self.max_bytes and _segment_ns(p) >= oldest_ns:
+                break
+            total -= _size(p)
+            del self._segments[p]
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, key, value):
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.lru_rows:
+            self._lru.popitem(last=False)
+
+    def predict(self, df):
+        # Same contract as ModelHandle.predict: (mu, sigma) of shape (n_rows, n_stats) aligned
+        # with df's rows
+        keys = row_keys(df, self.features)
+        mu_cols, sigma_cols = self._columns()
+        n = len(keys)
+        mu = np.empty((n, len(mu_cols)), dtype=float)
+        sigma = np.empty((n, len(sigma_cols)), dtype=float)
+        found = np.zeros(n, dtype=bool)
+
+        with self._lock:
+            if self._segments is None:
+                self._load_index()
+
+            for i, k in enumerate(keys.tolist()):
+                hit = self._lru.get(k)
+                if hit is not None:
+                    self._lru.move_to_end(k)
+                    mu[i], sigma[i] = hit[:len(mu_cols)], hit[len(mu_cols):]
+                    found[i] = True
+
+            # newest segment first, so a key written again later wins
+            for path, (seg_keys, seg_rows) in reversed(list(self._segments.items())):
+                rest = np.flatnonzero(~found)
+                if not len(rest):
+                    break
+                if not len(seg_keys):
+                    continue
+                pos = np.minimum(np.searchsorted(seg_keys, keys[rest]), len(seg_keys) - 1)
+                hit = seg_keys[pos] == keys[rest]
+                if not hit.any():
+                    continue
+                try:
+                    seg = self._read_segment(path)
+                except (FileNotFoundError, OSError):
+                    # removed under us (evicted by another process); those rows are just misses
+                    del self._segments[path]
+                    continue
+                idx, rows = rest[hit], seg_rows[pos[hit]]
+                mu[idx] = seg[mu_cols].to_numpy()[rows]
+                sigma[idx] = seg[sigma_cols].to_numpy()[rows]
+                found[idx] = True
+                for i in idx.tolist():
+                    self._remember(int(keys[i]), np.concatenate([mu[i], sigma[i]]))
+
+        miss = np.flatnonzero(~found)
+        if len(miss):
+            m_mu, m_sigma = self.handle.predict(df.iloc[miss])
+            mu[miss], sigma[miss] = m_mu, m_sigma
+            with self._lock:
+                for j, i in enumerate(miss.tolist()):
+                    self._remember(int(keys[i]), np.concatenate([m_mu[j], m_sigma[j]]))
+                seg = pd.DataFrame(np.hstack([m_mu, m_sigma]), columns=mu_cols + sigma_cols)
+                seg.insert(0, "key", keys[miss])
+                self._pending.append(seg)
+
+        self.hits += n - len(miss)
+        self.misses += len(miss)
+        count("prediction_cache.hits", n - len(miss))
+        count("prediction_cache.misses", len(miss))
+        return mu, sigma
+
+    def flush(self):
+        # Persist predictions made since the last flush as one segment
+        with self._lock:
+            if not self._pending:
+                return 0
+            new = pd.concat(self._pending, ignore_index=True).drop_duplicates("key", keep="last")
+            self._pending = []
+            if self._segments is None:
+                self._load_index()
+            path = self._write_segment(new)
+            self._index_segment(path, new["key"].to_numpy(dtype=np.uint64))
+            self._maintain()
+        return len(new)
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"prediction cache: {self.hits}/{total} rows reused ({rate:.0%}), {self.misses} scored"
+
+
+def _segment_ns(path):
+    name = os.path.basename(path)[:-len(".parquet")]
+    return int(name) if name.isdigit() else int(os.path.getmtime(path) * 1e9)
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def get_prediction_cache(handle, model_version=None):
+    # One cache per model handle, so in-process callers share the LRU tier. Kept on the handle
+    # itself: a hot-swapped handle takes its cache with it when it's dropped
+    model_version = model_version or handle.version
+    with _caches_lock:
+        caches = getattr(handle, "_prediction_caches", None)
+        if caches is None:
+            caches = handle._prediction_caches = {}
+        if model_version not in caches:
+            caches[model_version] = PredictionCache(handle, model_version)
+        return caches[model_version]
@@ -0,0 +1,267 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from src.model_handle import ModelHandle
+
+# Model registry. Every trained model is a version whose artifacts sit side by side in
+# REGISTRY_DIR (<version>.keras, .npz, _scaler.joblib, _features.json, _stats.json,
+# _calibration.json, _metrics.json). MANIFEST_PATH records, per version, the training metrics,
+# the registration time and a content hash of the artifacts, plus which version is the
+# champion (scored into predictions_daily) and which are challengers (shadow-scored into
+# predictions_shadow in the same pass, see score_today.score_models).
+#
+# The scorers read the manifest at the start of every run and the prediction service re-reads
+# it when it changes, so promoting a version takes effect without a redeploy:
+#   python -m src.registry                          # list versions
+#   python -m src.registry promote v2_hetero_nll    # new champion
+#   python -m src.registry shadow v3_hetero_nll     # (--off) shadow-score a challenger
+#   python -m src.registry register v2_hetero_nll   # adopt artifacts trained elsewhere
+#   python -m src.registry verify                   # artifacts still match their hashes
+#
+# Without a manifest (artifacts from before the registry), every version found in
+# REGISTRY_DIR is registered on the fly and the newest one is the champion.
+
+REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "artifacts")
+MANIFEST_PATH = os.path.join(REGISTRY_DIR, "manifest.json")
+VERSION_SUFFIX = "hetero_nll"
+
+# files covered by the content hash; the calibration file is left out since
+# backtest --write-normalizer rewrites it for a registered version
+HASHED = ("model", "npz", "scaler", "features", "stats")
+
+_VERSION_RE = re.compile(r"^v(\d+)_")
+_handles = {}
+_handles_lock = threading.Lock()
+
+
+def artifact_paths(version, model_dir=REGISTRY_DIR):
+    base = os.path.join(model_dir, version)
+    return {
+        "model": f"{base}.keras",
+        "npz": f"{base}.npz",
+        "scaler": f"{base}_scaler.joblib",
+        "features": f"{base}_features.json",
+        "stats": f"{base}_stats.json",
+        "calibration": f"{base}_calibration.json",
+        "metrics": f"{base}_metrics.json",
+    }
+
+
+def content_hash(version, model_dir=REGISTRY_DIR):
+    h = hashlib.sha256()
+    paths = artifact_paths(version, model_dir)
+    for kind in HASHED:
+        if os.path.exists(paths[kind]):
+            h.update(f"{kind}:".encode("utf-8"))
+            with open(paths[kind], "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+    return h.hexdigest()[:16]
+
+
+def _found_versions(model_dir):
+    # Versions with artifacts on disk, oldest first
+    found = []
+    for feat in glob.glob(os.path.join(model_dir, "*_features.json")):
+        version = os.path.basename(feat)[:-len("_features.json")]
+        paths = artifact_paths(version, model_dir)
+        if os.path.exists(paths["model"]) or os.path.exists(paths["npz"]):
+            found.append((os.path.getmtime(feat), version))
+    return [v for _, v in sorted(found)]
+
+
+def _entry(version, model_dir, metrics=None):
+    paths = artifact_paths(version, model_dir)
+    if metrics is None and os.path.exists(paths["metrics"]):
+        with open(paths["metrics"], "r") as f:
+            metrics = json.load(f)
+    return {
+        "hash": content_hash(version, model_dir),
+        "registered": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "metrics": metrics or {},
+    }
+
+
+def load_manifest(path=MANIFEST_PATH, exclude=()):
+    # exclude: versions left out when adopting artifacts from before the registry
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    model_dir = os.path.dirname(path)
+    versions = [v for v in _found_versions(model_dir) if v not in exclude]
+    return {
+        "champion": versions[-1] if versions else None,
+        "challengers": [],
+        "versions": {v: _entry(v, model_dir) for v in versions},
+    }
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def manifest_mtime(path=MANIFEST_PATH):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+def next_version(path=MANIFEST_PATH, suffix=VERSION_SUFFIX):
+    model_dir = os.path.dirname(path)
+    known = set(load_manifest(path)["versions"]) | set(_found_versions(model_dir))
+    n = max([int(m.group(1)) for m in map(_VERSION_RE.match, known) if m] or [0])
+    return f"v{n + 1}_{suffix}"
+
+
+def _require(manifest, version):
+    if version not in manifest["versions"]:
+        raise ValueError(f"{version} is not registered (known: {', '.join(manifest['versions']) or 'none'})")
+
+
+def register(version, metrics=None, champion=False, challenger=False, path=MANIFEST_PATH):
+    # Records version's artifacts (re-registering refreshes the hash and metrics). The first
+    # registered version becomes the champion.
+    model_dir = os.path.dirname(path)
+    paths = artifact_paths(version, model_dir)
+    if not os.path.exists(paths["features"]):
+        raise FileNotFoundError(f"no artifacts for {version} in {model_dir}")
+    if metrics is not None:
+        with open(paths["metrics"], "w") as f:
+            json.dump(metrics, f, indent=2)
+
+    # a new version doesn't take over as champion just because it's the newest file
+    manifest = load_manifest(path, exclude=(version,))
+    manifest["versions"][version] = _entry(version, model_dir, metrics)
+    if champion or manifest["champion"] is None:
+        _set_champion(manifest, version)
+    elif challenger and version != manifest["champion"] and version not in manifest["challengers"]:
+        manifest["challengers"].append(version)
+    save_manifest(manifest, path)
+    return manifest
+
+
+def _set_champion(manifest, version):
+    manifest["champion"] = version
+    manifest["challengers"] = [v for v in manifest["challengers"] if v != version]
+    manifest["promoted"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def promote(version, path=MANIFEST_PATH):
+    manifest = load_manifest(path)
+    _require(manifest, version)
+    previous = manifest["champion"]
+    _set_champion(manifest, version)
+    save_manifest(manifest, path)
+    print(f"champion: {previous} -> {version}")
+    return manifest
+
+
+def set_shadow(version, on=True, path=MANIFEST_PATH):
+    manifest = load_manifest(path)
+    _require(manifest, version)
+    challengers = [v for v in manifest["challengers"] if v != version]
+    if on and version != manifest["champion"]:
+        challengers.append(version)
+    manifest["challengers"] = challengers
+    save_manifest(manifest, path)
+    return manifest
+
+
+def verify(path=MANIFEST_PATH):
+    # {version: True/False}, False when the artifacts changed since they were registered
+    manifest = load_manifest(path)
+    model_dir = os.path.dirname(path)
+    return {v: content_hash(v, model_dir) == e["hash"] for v, e in manifest["versions"].items()}
+
+
+def champion(path=MANIFEST_PATH):
+    version = load_manifest(path)["champion"]
+    if version is None:
+        raise FileNotFoundError(f"no registered models in {os.path.dirname(path)} (run python -m src.train_model)")
+    return version
+
+
+def scoring_handles(backend=None, shadow=True, path=MANIFEST_PATH):
+    # Handles for the champion, then (with shadow) the challengers, from one manifest read
+    manifest = load_manifest(path)
+    if manifest["champion"] is None:
+        raise FileNotFoundError(f"no registered models in {os.path.dirname(path)} (run python -m src.train_model)")
+    versions = [manifest["champion"]] + (list(manifest["challengers"]) if shadow else [])
+    return [model_handle(v, backend, path, manifest) for v in versions]
+
+
+def model_handle(version, backend=None, path=MANIFEST_PATH, manifest=None):
+    # Handles are created without loading anything (the model loads on first predict) and
+    # shared per (version, artifact hash, backend), so a long-running process keeps each
+    # version resident once and picks up re-registered artifacts. Handles for versions or
+    # hashes the manifest no longer lists are dropped here, so the old model can be freed
+    # once its last user lets go of it.
+    manifest = manifest or load_manifest(path)
+    _require(manifest, version)
+    key = (version, manifest["versions"][version]["hash"], backend)
+    live = {(v, e["hash"]) for v, e in manifest["versions"].items()}
+    with _handles_lock:
+        for stale in [k for k in _handles if k[:2] not in live]:
+            del _handles[stale]
+        if key not in _handles:
+            paths = artifact_paths(version, os.path.dirname(path))
+            _handles[key] = ModelHandle(
+                paths["model"], paths["scaler"], paths["features"], backend=backend, npz_path=paths["npz"],
+                version=version, calibration_path=paths["calibration"],
+            )
+        return _handles[key]
+
+
+def print_manifest(manifest):
+    print(f"{'version':<24} {'role':<10} {'hash':<17} {'registered':<20} metrics")
+    for v, e in manifest["versions"].items():
+        role = "champion" if v == manifest["champion"] else ("shadow" if v in manifest["challengers"] else "")
+        metrics = " ".join(f"{k}={val:.4f}" if isinstance(val, float) else f"{k}={val}"
+                           for k, val in e["metrics"].items() if not isinstance(val, (dict, list)))
+        print(f"{v:<24} {role:<10} {e['hash']:<17} {e['registered']:<20} {metrics}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registered model versions, champion and challengers")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("list", help="registered versions (the default)")
+    p = sub.add_parser("register", help="register artifacts already in the registry directory")
+    p.add_argument("version")
+    p.add_argument("--champion", action="store_true", help="also make it the champion")
+    p.add_argument("--challenger", action="store_true", help="shadow-score it next to the champion")
+    p = sub.add_parser("promote", help="make a registered version the champion")
+    p.add_argument("version")
+    p = sub.add_parser("shadow", help="shadow-score a registered version next to the champion")
+    p.add_argument("version")
+    p.add_argument("--off", action="store_true", help="stop shadow-scoring it")
+    sub.add_parser("verify", help="check every version's artifacts against its registered hash")
+    args = parser.parse_args()
+
+    if args.command == "register":
+        register(args.version, champion=args.champion, challenger=args.challenger)
+    elif args.command == "promote":
+        promote(args.version)
+    elif args.command == "shadow":
+        set_shadow(args.version, on=not args.off)
+    elif args.command == "verify":
+        changed = [v for v, ok in verify().items() if not ok]
+        for v in changed:
+            print(f"{v}: artifacts changed since registration (re-register it: python -m src.registry register {v})")
+        if changed:
+            raise SystemExit(1)
+        print("all artifacts match their registered hashes")
+        return
+    print_manifest(load_manifest())
+
+if __name__ == "__main__":
+    main()
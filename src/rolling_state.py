@@ -0,0 +1,336 @@
+import argparse
+import math
+from datetime import date
+
+import pandas as pd
+from sqlalchemy import text
+
+from src.bulk_load import bulk_upsert
+
+# Per-player rolling state, kept in player_rolling_state and updated as boxscores are
+# ingested: a ring buffer of the last WINDOW games plus running sums / sums of squares for
+# points and minutes. Pushing a game is O(1), and the rolling features for a player's next
+# game are read straight off the state without scanning player_game_stats.
+#
+# Semantics follow the window SQL in build_features: a NULL stat takes a slot in the window
+# but is ignored by the averages, exactly like AVG/STDDEV_SAMP over ROWS BETWEEN.
+
+WINDOW = 10
+SHORT_WINDOW = 5
+STATS = ("pts", "min")
+
+
+class PlayerRollingState:
+    def __init__(self, player_id, team_id=None, last_game_id=None, last_game_date=None,
+                 n_games=0, ring_pos=0, rings=None):
+        self.player_id = int(player_id)
+        self.team_id = team_id
+        self.last_game_id = last_game_id
+        self.last_game_date = last_game_date
+        self.n_games = n_games
+        self.ring_pos = ring_pos
+        self.rings = rings or {s: [math.nan] * WINDOW for s in STATS}
+        self._recompute()
+
+    def _recompute(self):
+        # Exact sums from the ring; used on load and once per wrap to stop float drift
+        self.sum10, self.sumsq10, self.cnt10, self.sum5, self.cnt5 = {}, {}, {}, {}, {}
+        recent5 = [(self.ring_pos - 1 - i) % WINDOW for i in range(min(self.n_games, SHORT_WINDOW))]
+        for s in STATS:
+            ring = self.rings[s]
+            vals = [v for v in ring if not math.isnan(v)]
+            self.sum10[s] = sum(vals)
+            self.sumsq10[s] = sum(v * v for v in vals)
+            self.cnt10[s] = len(vals)
+            vals5 = [ring[i] for i in recent5 if not math.isnan(ring[i])]
+            self.sum5[s] = sum(vals5)
+            self.cnt5[s] = len(vals5)
+
+    def push(self, game_id, game_date, team_id, pts, mins):
+        values = {"pts": pts, "min": mins}
+        pos = self.ring_pos
+        for s in STATS:
+            ring = self.rings[s]
+            x = math.nan if values[s] is None or pd.isna(values[s]) else float(values[s])
+
+            # value dropping out of the 10-game window (the slot we overwrite)
+            if self.n_games >= WINDOW and not math.isnan(ring[pos]):
+                self.sum10[s] -= ring[pos]
+                self.sumsq10[s] -= ring[pos] ** 2
+                self.cnt10[s] -= 1
+            # value dropping out of the 5-game window
+            old5 = ring[(pos - SHORT_WINDOW) % WINDOW]
+            if self.n_games >= SHORT_WINDOW and not math.isnan(old5):
+                self.sum5[s] -= old5
+                self.cnt5[s] -= 1
+
+            ring[pos] = x
+            if not math.isnan(x):
+                self.sum10[s] += x
+                self.sumsq10[s] += x * x
+                self.cnt10[s] += 1
+                self.sum5[s] += x
+                self.cnt5[s] += 1
+
+        self.ring_pos = (pos + 1) % WINDOW
+        self.n_games += 1
+        self.team_id = team_id
+        self.last_game_id = game_id
+        self.last_game_date = game_date
+        if self.ring_pos == 0:
+            self._recompute()
+
+    def last(self, s):
+        if self.n_games == 0:
+            return None
+        v = self.rings[s][(self.ring_pos - 1) % WINDOW]
+        return None if math.isnan(v) else v
+
+    def mean(self, s, short=False):
+        total, cnt = (self.sum5[s], self.cnt5[s]) if short else (self.sum10[s], self.cnt10[s])
+        return total / cnt if cnt else None
+
+    def std(self, s):
+        cnt = self.cnt10[s]
+        if cnt < 2:
+            return None
+        var = (self.sumsq10[s] - self.sum10[s] ** 2 / cnt) / (cnt - 1)
+        return math.sqrt(max(var, 0.0))
+
+    def features(self, game_date):
+        # Feature values for this player's next game on game_date
+        rest_days = (game_date - self.last_game_date).days if self.last_game_date else None
+        return {
+            "player_id": self.player_id,
+            "rest_days": rest_days,
+            "rolling_pts_5": self.mean("pts", short=True),
+            "rolling_pts_10": self.mean("pts"),
+            "pts_std_10": self.std("pts"),
+            "rolling_min_5": self.mean("min", short=True),
+            "rolling_min_10": self.mean("min"),
+            "min_std_10": self.std("min"),
+            "last_game_pts": self.last("pts"),
+            "last_game_min": self.last("min"),
+        }
+
+    def to_row(self):
+        def pg_array(ring):
+            return "{" + ",".join("NULL" if math.isnan(v) else repr(v) for v in ring) + "}"
+
+        return {
+            "player_id": self.player_id,
+            "team_id": self.team_id,
+            "last_game_id": self.last_game_id,
+            "last_game_date": self.last_game_date,
+            "n_games": self.n_games,
+            "ring_pos": self.ring_pos,
+            "pts_ring": pg_array(self.rings["pts"]),
+            "min_ring": pg_array(self.rings["min"]),
+        }
+
+    @classmethod
+    def from_row(cls, row):
+        rings = {
+            "pts": [math.nan if v is None else float(v) for v in row["pts_ring"]],
+            "min": [math.nan if v is None else float(v) for v in row["min_ring"]],
+        }
+        return cls(
+            row["player_id"], row["team_id"], row["last_game_id"], row["last_game_date"],
+            row["n_games"], row["ring_pos"], rings,
+        )
+
+
+def load_states(conn, player_ids, for_update=False):
+    # for_update locks the players' rows until the caller commits. FOR UPDATE only locks rows
+    # that exist, so empty states are inserted first for new players: two ingests pushing the
+    # same new player's games then queue on that row instead of both saving over each other.
+    # Ids are locked in sorted order, so overlapping ingests can't deadlock.
+    if not player_ids:
+        return {}
+    ids = sorted({int(p) for p in player_ids})
+    if for_update:
+        conn.execute(
+            text(
+                """
+                INSERT INTO player_rolling_state (player_id, n_games, ring_pos, pts_ring, min_ring)
+                SELECT id, 0, 0, ARRAY_FILL(NULL::REAL, ARRAY[:window]), ARRAY_FILL(NULL::REAL, ARRAY[:window])
+                FROM UNNEST(CAST(:ids AS INTEGER[])) AS id
+                ORDER BY id
+                ON CONFLICT (player_id) DO NOTHING
+                """
+            ),
+            {"ids": ids, "window": WINDOW},
+        )
+    rows = conn.execute(
+        text(
+            "SELECT * FROM player_rolling_state WHERE player_id = ANY(:ids) ORDER BY player_id"
+            + (" FOR UPDATE" if for_update else "")
+        ),
+        {"ids": ids},
+    ).mappings().all()
+    return {r["player_id"]: PlayerRollingState.from_row(r) for r in rows}
+
+
+def save_states(conn, states):
+    if not states:
+        return
+    df = pd.DataFrame([s.to_row() for s in states])
+    bulk_upsert(conn, "player_rolling_state", df, ["player_id"], extra_set="updated_ts = NOW()")
+
+
+def _replay(conn, player_ids):
+    # Rebuild states from each player's last WINDOW games in player_game_stats
+    if not player_ids:
+        return {}
+    logs = pd.read_sql(
+        text(
+            """
+            SELECT player_id, team_id, game_id, game_date, points, minutes
+            FROM (
+                SELECT pgs.player_id, pgs.team_id, pgs.game_id, g.game_date::date AS game_date,
+                       pgs.points, pgs.minutes,
+                       ROW_NUMBER() OVER (PARTITION BY pgs.player_id ORDER BY g.game_date DESC) AS rn
+                FROM player_game_stats pgs
+                JOIN games g ON g.game_id = pgs.game_id
+                WHERE pgs.player_id = ANY(:ids) AND g.game_date IS NOT NULL
+            ) t
+            WHERE rn <= :window
+            ORDER BY player_id, game_date
+            """
+        ),
+        conn,
+        params={"ids": [int(p) for p in player_ids], "window": WINDOW},
+    )
+    counts = pd.read_sql(
+        text(
+            """
+            SELECT pgs.player_id, COUNT(*) AS n_games
+            FROM player_game_stats pgs JOIN games g ON g.game_id = pgs.game_id
+            WHERE pgs.player_id = ANY(:ids) AND g.game_date IS NOT NULL
+            GROUP BY pgs.player_id
+            """
+        ),
+        conn,
+        params={"ids": [int(p) for p in player_ids]},
+    ).set_index("player_id")["n_games"]
+
+    states = {}
+    for pid, g in logs.groupby("player_id", sort=False):
+        st = PlayerRollingState(pid)
+        for r in g.itertuples(index=False):
+            st.push(r.game_id, r.game_date, r.team_id, r.points, r.minutes)
+        # only the last WINDOW games are replayed; n_games keeps the true history length
+        # (ring_pos is just a slot pointer, so it stays consistent with the ring)
+        st.n_games = int(counts[pid])
+        states[pid] = st
+    return states
+
+
+def update_rolling_state(conn, stats_df):
+    # Applies newly ingested player_game_stats rows (game_id, player_id, team_id, minutes,
+    # points) to the state table, inside the caller's transaction. Rows are pushed in game
+    # order; a game older than a player's latest one (e.g. a backfilled gap) makes us replay
+    # that player's last WINDOW games from player_game_stats instead. Callers pass only rows
+    # that were actually inserted (see ingest_last7days.unstored_rows): a row that was
+    # already stored is already in the state, and re-sending it would force a replay.
+    if stats_df.empty:
+        return 0
+
+    game_dates = pd.read_sql(
+        text("SELECT game_id, game_date::date AS game_date FROM games WHERE game_id = ANY(:ids)"),
+        conn,
+        params={"ids": stats_df["game_id"].astype(str).unique().tolist()},
+    )
+    df = stats_df.merge(game_dates, on="game_id", how="inner").sort_values(["game_date", "game_id"])
+
+    # lock the rows (new players included) so concurrent ingest workers can't lose each
+    # other's updates
+    states = load_states(conn, df["player_id"].unique().tolist(), for_update=True)
+    replay = set()
+    for r in df.itertuples(index=False):
+        pid = int(r.player_id)
+        if pid in replay:
+            continue
+        st = states.get(pid)
+        if st is None:
+            st = states[pid] = PlayerRollingState(pid)
+        if st.last_game_date is not None and (r.game_date, r.game_id) <= (st.last_game_date, st.last_game_id):
+            if r.game_id != st.last_game_id:
+                replay.add(pid)
+            continue
+        st.push(r.game_id, r.game_date, r.team_id, r.points, r.minutes)
+
+    states.update(_replay(conn, replay))
+    save_states(conn, list(states.values()))
+    return len(states)
+
+
+def rebuild_rolling_state(engine):
+    with engine.begin() as conn:
+        ids = [r[0] for r in conn.execute(text("SELECT DISTINCT player_id FROM player_game_stats"))]
+        conn.execute(text("TRUNCATE player_rolling_state"))
+        states = _replay(conn, ids)
+        save_states(conn, list(states.values()))
+    print(f"Rebuilt rolling state for {len(states)} players")
+    return len(states)
+
+
+def features_for_date(engine, game_date):
+    # Feature rows (player_features_daily columns) for every game on game_date, for the
+    # players whose latest game was for one of the two teams.
+    with engine.connect() as conn:
+        games = pd.read_sql(
+            text(
+                """
+                SELECT game_id, home_team_id, away_team_id
+                FROM games WHERE game_date::date = :d
+                """
+            ),
+            conn,
+            params={"d": game_date},
+        )
+        if games.empty:
+            return pd.DataFrame()
+        team_ids = pd.unique(games[["home_team_id", "away_team_id"]].values.ravel()).tolist()
+        rows = conn.execute(
+            text("SELECT * FROM player_rolling_state WHERE team_id = ANY(:teams)"),
+            {"teams": [int(t) for t in team_ids]},
+        ).mappings().all()
+
+    out = []
+    for r in rows:
+        st = PlayerRollingState.from_row(r)
+        for g in games.itertuples(index=False):
+            if st.team_id not in (g.home_team_id, g.away_team_id):
+                continue
+            home = st.team_id == g.home_team_id
+            feat = st.features(game_date)
+            feat.update(
+                {
+                    "game_id": g.game_id,
+                    "opponent_team_id": g.away_team_id if home else g.home_team_id,
+                    "home_flag": int(home),
+                }
+            )
+            out.append(feat)
+    return pd.DataFrame(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain / read the per-player rolling state")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the state table from player_game_stats")
+    parser.add_argument("--date", help="print feature rows for games on this date (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    from src.db import get_engine
+
+    engine = get_engine()
+    if args.rebuild:
+        rebuild_rolling_state(engine)
+    if args.date:
+        df = features_for_date(engine, date.fromisoformat(args.date))
+        with pd.option_context("display.max_columns", None, "display.width", 200):
+            print(df if not df.empty else f"No games on {args.date}")
+
+if __name__ == "__main__":
+    main()
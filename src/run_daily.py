@@ -1,13 +1,155 @@
-import subprocess
+import argparse
+import json
+import os
+import time
+from datetime import date
+
+from src.db import get_engine
+from src.instrument import TRACE_PATH, pipeline_run, span
+from src.ingest_last7days import ingest_last7days
+from src.build_features import build_features
+from src.export import export_predictions
+from src.partitions import run_retention
+from src.score_today import load_model_handles, score_today
+
+# Runs the daily stages in one process so they share one SQLAlchemy engine and the model
+# handles (the registry's champion and challengers, as of the start of the run). The models
+# start loading on background threads right away, overlapping with ingest network I/O.
+# Progress is kept in STATE_PATH so a failed run can be resumed.
+
+STATE_PATH = os.path.join("logs", "run_daily_state.json")
+
+
+class PipelineContext:
+    def __init__(self, engine, handles):
+        self.engine = engine
+        self.handles = handles
+
+
+def stage_ingest(ctx):
+    return ingest_last7days(ctx.engine)
+
+
+def stage_features(ctx):
+    return build_features(ctx.engine, incremental=True)
+
+
+def stage_score(ctx):
+    return score_today(ctx.engine, ctx.handles)
+
+
+def stage_export(ctx):
+    return export_predictions(ctx.engine)
+
+
+def stage_retention(ctx):
+    return run_retention(ctx.engine)
+
+
+STAGES = [
+    ("ingest", stage_ingest),
+    ("features", stage_features),
+    ("score", stage_score),
+    ("export", stage_export),
+    ("retention", stage_retention),
+]
+STAGE_NAMES = [name for name, _ in STAGES]
+
+
+def load_state(path=STATE_PATH):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_state(state, path=STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def pending_stages(state, resume, from_stage):
+    if from_stage is not None:
+        return STAGE_NAMES[STAGE_NAMES.index(from_stage):]
+    if resume and state is not None:
+        return [name for name in STAGE_NAMES if name not in state["completed"]]
+    return list(STAGE_NAMES)
+
+
+def run_pipeline(resume=False, from_stage=None, engine=None, trace_path=TRACE_PATH):
+    run_date = date.today().isoformat()
+
+    previous = load_state()
+    if previous is not None and previous.get("run_date") != run_date:
+        previous = None
+    todo = pending_stages(previous, resume, from_stage)
+
+    state = {
+        "run_date": run_date,
+        "completed": [name for name in STAGE_NAMES if name not in todo],
+        "timings": dict(previous["timings"]) if previous and todo != STAGE_NAMES else {},
+        "failed": None,
+    }
+
+    if not todo:
+        print(f"All stages already completed for {run_date}, nothing to do.")
+        return state
+
+    ctx = PipelineContext(engine or get_engine(), load_model_handles())
+    with pipeline_run("run_daily", ctx.engine, trace_path):
+        _run_stages(ctx, todo, state)
+    return state
+
+
+def _run_stages(ctx, todo, state):
+    if "score" in todo:
+        for handle in ctx.handles:
+            handle.start_loading()
+
+    t_run = time.perf_counter()
+    for name, fn in STAGES:
+        if name not in todo:
+            print(f"\n=== {name} (already done, skipping) ===")
+            continue
+
+        print(f"\n=== {name} ===")
+        t0 = time.perf_counter()
+        try:
+            with span(f"stage.{name}"):
+                fn(ctx)
+        except Exception:
+            state["timings"][name] = round(time.perf_counter() - t0, 3)
+            state["failed"] = name
+            save_state(state)
+            print(f"stage {name} failed after {state['timings'][name]:.1f}s, "
+                  f"rerun with --resume to continue from it")
+            raise
+
+        state["timings"][name] = round(time.perf_counter() - t0, 3)
+        state["completed"].append(name)
+        save_state(state)
+        print(f"stage {name} done in {state['timings'][name]:.1f}s")
+
+    total = time.perf_counter() - t_run
+    print("\n=== timings ===")
+    for name in STAGE_NAMES:
+        if name in state["timings"]:
+            print(f"{name:>10}: {state['timings'][name]:.1f}s")
+    print(f"{'total':>10}: {total:.1f}s")
 
-def run(cmd: str):
-    print(f"\n=== {cmd} ===")
-    subprocess.check_call(cmd, shell=True)
 
 def main():
-    run("python -m src.ingest_last7days")
-    run("python -m src.build_features")
-    run("python -m src.score_today")
+    parser = argparse.ArgumentParser(description="Run the daily ingest -> features -> score -> export -> retention pipeline")
+    parser.add_argument("--resume", action="store_true", help="Skip stages already completed today")
+    parser.add_argument("--from-stage", choices=STAGE_NAMES, help="Start at this stage, regardless of saved state")
+    parser.add_argument("--trace", default=TRACE_PATH, help="also write a Chrome trace of every span to this JSON file")
+    args = parser.parse_args()
+
+    run_pipeline(resume=args.resume, from_stage=args.from_stage, trace_path=args.trace)
 
 if __name__ == "__main__":
     main()
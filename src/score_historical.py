@@ -1,115 +1,130 @@
-import os
+import argparse
 import json
-import math
-import numpy as np
+import os
 import pandas as pd
 from sqlalchemy import text
 
-import joblib
-import tensorflow as tf
-
 from src.db import get_engine
-
-MODEL_DIR = "artifacts"
-MODEL_VERSION = "v1_hetero_nll"
-MODEL_PATH = os.path.join(MODEL_DIR, f"{MODEL_VERSION}.keras")
-SCALER_PATH = os.path.join(MODEL_DIR, f"{MODEL_VERSION}_scaler.joblib")
-FEAT_PATH = os.path.join(MODEL_DIR, f"{MODEL_VERSION}_features.json")
-
-THRESHOLDS = [15, 20, 25, 30]
-
-def norm_cdf(z: np.ndarray) -> np.ndarray:
-    # Standard normal CDF using erf
-    return 0.5 * (1.0 + np.vectorize(math.erf)(z / math.sqrt(2.0)))
-
-def probs_ge_k(mu, sigma, k: int):
-    # continuity correction: k - 0.5
-    kk = k - 0.5
-    sigma = np.maximum(sigma, 1e-6)
-    z = (kk - mu) / sigma
-    return 1.0 - norm_cdf(z)
-
-def main():
-    engine = get_engine()
-
-    with open(FEAT_PATH, "r") as f:
-        FEATURES = json.load(f)
-
-    df = pd.read_sql(
-        """
+from src.instrument import pipeline_run
+from src.model_handle import BACKENDS
+from src.partitions import BASE_DATE
+from src.prediction_cache import ENABLED as CACHE_ENABLED
+from src.score_today import (
+    FEATURE_COLUMNS_SQL, cached_model, flush_models, load_model_handles, score_models, write_predictions,
+)
+
+# Rows are streamed from a server-side cursor in key order, scored and written back one
+# chunk at a time, so memory stays bounded by chunk_size rather than the table size.
+# After every written chunk the last key is saved to CHECKPOINT_PATH for --resume.
+
+CHUNK_SIZE = 50_000
+CHECKPOINT_PATH = os.path.join("logs", "score_historical_checkpoint.json")
+
+
+def load_checkpoint(path, filters):
+    try:
+        with open(path, "r") as f:
+            ck = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if ck.get("filters") != filters:
+        print(f"Ignoring checkpoint {path}: it was written for different filters {ck.get('filters')}")
+        return None
+    return ck
+
+
+def save_checkpoint(path, filters, last_key, scored):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"filters": filters, "last_key": last_key, "scored": scored}, f, indent=2)
+    os.replace(tmp, path)
+
+
+def score_historical(engine, handles=None, chunk_size=CHUNK_SIZE, start_date=None, end_date=None,
+                     resume=False, checkpoint_path=CHECKPOINT_PATH, use_cache=CACHE_ENABLED):
+    # handles: [champion, challenger, ...] (default: the registry's, challengers included);
+    # every chunk is read once and scored by all of them
+    handles = handles or load_model_handles()
+    models = [cached_model(h, use_cache) for h in handles]
+
+    filters = {"start_date": start_date, "end_date": end_date}
+    # rows carried into the base partition by retention have no day to write predictions under
+    where = ["as_of_date > :base_date"]
+    params = {"base_date": BASE_DATE}
+    if start_date:
+        where.append("as_of_date >= :start_date")
+        params["start_date"] = start_date
+    if end_date:
+        where.append("as_of_date <= :end_date")
+        params["end_date"] = end_date
+
+    scored = 0
+    ck = load_checkpoint(checkpoint_path, filters) if resume else None
+    if ck is not None:
+        ck_date, ck_game, ck_player = ck["last_key"]
+        where.append("(as_of_date, game_id, player_id) > (:ck_date, :ck_game, :ck_player)")
+        params.update({"ck_date": ck_date, "ck_game": ck_game, "ck_player": ck_player})
+        scored = ck["scored"]
+        print(f"Resuming after {ck['last_key']} ({scored} rows already scored)")
+
+    q = f"""
         SELECT
-          as_of_date, game_id, player_id,
-          opponent_team_id, home_flag, rest_days,
-          rolling_pts_5, rolling_pts_10, pts_std_10,
-          rolling_min_5, rolling_min_10, min_std_10,
-          last_game_pts, last_game_min
+          {FEATURE_COLUMNS_SQL}
         FROM v_player_features_latest
-        """,
-        engine,
-    )
-
-    # Load artifacts
-    scaler = joblib.load(SCALER_PATH)
-    model = tf.keras.models.load_model(MODEL_PATH, compile=False)
-
-    X = df[FEATURES].astype(float).values
-    Xs = scaler.transform(X).astype(np.float32)
-
-    mu, log_var = model(Xs, training=False)
-    mu = mu.numpy().reshape(-1).astype(float)
-    sigma = np.sqrt(np.exp(log_var.numpy().reshape(-1))).astype(float)
-
-    # scoring-time clamp to keep probabilities sane
-    sigma = np.clip(sigma, 1.0, 25.0)
-
-    out = df[["as_of_date", "game_id", "player_id"]].copy()
-    out["mu_pts"] = mu
-    out["sigma_pts"] = sigma
-
-    out["p15"] = probs_ge_k(mu, sigma, 15)
-    out["p20"] = probs_ge_k(mu, sigma, 20)
-    out["p25"] = probs_ge_k(mu, sigma, 25)
-    out["p30"] = probs_ge_k(mu, sigma, 30)
-    
-    AVG_SIGMA = 6.7 #from the evaluation
-
-    out["conf20"] = 100.0 * out["p20"] * (AVG_SIGMA / out["sigma_pts"])
-    out["conf25"] = 100.0 * out["p25"] * (AVG_SIGMA / out["sigma_pts"])
-    out["conf30"] = 100.0 * out["p30"] * (AVG_SIGMA / out["sigma_pts"])
-
-    out["model_version"] = MODEL_VERSION
-
-    upsert_sql = """
-    INSERT INTO predictions_daily (
-        as_of_date, game_id, player_id,
-        mu_pts, sigma_pts, p15, p20, p25, p30,
-        conf20, conf25, conf30,
-        model_version
-    )
-    VALUES (
-        :as_of_date, :game_id, :player_id,
-        :mu_pts, :sigma_pts, :p15, :p20, :p25, :p30,
-        :conf20, :conf25, :conf30,
-        :model_version
-    )
-    ON CONFLICT (as_of_date, game_id, player_id) DO UPDATE SET
-        mu_pts = EXCLUDED.mu_pts,
-        sigma_pts = EXCLUDED.sigma_pts,
-        p15 = EXCLUDED.p15,
-        p20 = EXCLUDED.p20,
-        p25 = EXCLUDED.p25,
-        p30 = EXCLUDED.p30,
-        conf20 = EXCLUDED.conf20,
-        conf25 = EXCLUDED.conf25,
-        conf30 = EXCLUDED.conf30,
-        model_version = EXCLUDED.model_version,
-        created_ts = NOW();
+        WHERE {" AND ".join(where)}
+        ORDER BY as_of_date, game_id, player_id
     """
 
-    with engine.begin() as conn:
-        conn.execute(text(upsert_sql), out.to_dict(orient="records"))
+    # stream_results -> psycopg2 named (server-side) cursor; writes go through their own
+    # connections from the pool, one transaction per chunk.
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=chunk_size) as conn:
+        for df in pd.read_sql(text(q), conn, params=params, chunksize=chunk_size):
+            if df.empty:
+                continue
+            out, shadow = score_models(df, models)
+            write_predictions(engine, out, shadow)
+            flush_models(models, handles)
+
+            scored += len(out)
+            last = df.iloc[-1]
+            last_key = [str(last["as_of_date"]), str(last["game_id"]), int(last["player_id"])]
+            save_checkpoint(checkpoint_path, filters, last_key, scored)
+            print(f"Upserted {len(out)} rows into predictions_daily (through {last_key[0]}, {scored} total)")
+
+    # finished: the next run starts from scratch
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    for model, handle in zip(models, handles):
+        if model is not handle:
+            print(f"{model.version}: {model.summary()}")
+    print(f"Scored {scored} rows")
+    return scored
 
-    print(f"Upserted {len(out)} rows into predictions_daily")
+
+def main():
+    parser = argparse.ArgumentParser(description="Rescore v_player_features_latest into predictions_daily")
+    parser.add_argument("--backend", choices=BACKENDS, help="Model backend (default: SCORING_BACKEND or auto)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--start-date", help="first as_of_date to score (YYYY-MM-DD)")
+    parser.add_argument("--end-date", help="last as_of_date to score (YYYY-MM-DD)")
+    parser.add_argument("--resume", action="store_true", help="continue after the last checkpointed chunk")
+    parser.add_argument("--no-cache", action="store_true", help="score every row, bypassing the prediction cache")
+    parser.add_argument("--no-shadow", action="store_true", help="score the champion only, not the challengers")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    with pipeline_run("score_historical", engine):
+        score_historical(
+            engine,
+            load_model_handles(args.backend, shadow=not args.no_shadow),
+            chunk_size=args.chunk_size,
+            start_date=args.start_date,
+            end_date=args.end_date,
+            resume=args.resume,
+            use_cache=CACHE_ENABLED and not args.no_cache,
+        )
 
 if __name__ == "__main__":
     main()
@@ -1,120 +1,155 @@
-import os
-import json
-import math
-import numpy as np
+import argparse
 import pandas as pd
-from sqlalchemy import text
 
-import joblib
-import tensorflow as tf
+from src.db import SCORE_APP, get_engine, tag_transaction
+from src.bulk_load import bulk_upsert
+from src.distribution import STATS, clamp_sigma, load_avg_sigma, stat_columns
+from src.instrument import pipeline_run, span
+from src.model_handle import BACKENDS
+from src.partitions import ensure_partitions
+from src.prediction_cache import ENABLED as CACHE_ENABLED, get_prediction_cache
+from src.registry import model_handle, scoring_handles
 
-from src.db import get_engine
+# Models come from the registry (src/registry.py): the champion is written to predictions_daily
+# and every challenger to predictions_shadow, all from the same feature read and in the same
+# write transaction. Challengers go through their own prediction caches, so shadow-testing a
+# model only adds its forward pass over the rows that changed.
 
-MODEL_DIR = "artifacts"
-MODEL_VERSION = "v1_hetero_nll"
-MODEL_PATH = os.path.join(MODEL_DIR, f"{MODEL_VERSION}.keras")
-SCALER_PATH = os.path.join(MODEL_DIR, f"{MODEL_VERSION}_scaler.joblib")
-FEAT_PATH = os.path.join(MODEL_DIR, f"{MODEL_VERSION}_features.json")
+# scoring-time clamp to keep probabilities sane (points; every stat has its own in STATS)
+SIGMA_MIN, SIGMA_MAX = STATS["pts"]["sigma_min"], STATS["pts"]["sigma_max"]
 
-THRESHOLDS = [15, 20, 25, 30]
-
-def norm_cdf(z: np.ndarray) -> np.ndarray:
-    # Standard normal CDF using erf
-    return 0.5 * (1.0 + np.vectorize(math.erf)(z / math.sqrt(2.0)))
-
-def probs_ge_k(mu, sigma, k: int):
-    # continuity correction: k - 0.5
-    kk = k - 0.5
-    sigma = np.maximum(sigma, 1e-6)
-    z = (kk - mu) / sigma
-    return 1.0 - norm_cdf(z)
-
-def main():
-    engine = get_engine()
-
-    with open(FEAT_PATH, "r") as f:
-        FEATURES = json.load(f)
-
-    df = pd.read_sql(
-        """
-        SELECT
+FEATURE_COLUMNS_SQL = """
           as_of_date, game_id, player_id,
           opponent_team_id, home_flag, rest_days,
           rolling_pts_5, rolling_pts_10, pts_std_10,
           rolling_min_5, rolling_min_10, min_std_10,
-          last_game_pts, last_game_min
-        FROM player_features_daily
-        WHERE as_of_date = CURRENT_DATE
-        """,
-        engine,
-    )
+          last_game_pts, last_game_min,
+          rolling_reb_10, reb_std_10, rolling_ast_10, ast_std_10, rolling_fg3m_10, fg3m_std_10,
+          opp_pts_allowed_10, opp_pts_allowed_tier_10, opp_pace_10, team_pace_10,
+          ew_pts_mean_3, ew_pts_std_3, ew_min_mean_3, ew_min_std_3,
+          ew_pts_mean_7, ew_pts_std_7, ew_min_mean_7, ew_min_std_7,
+          ew_pts_mean_15, ew_pts_std_15, ew_min_mean_15, ew_min_std_15
+"""
 
-    if df.empty:
-        print("No feature rows for today, nothing to score.")
-        return
 
-    # Load artifacts
-    scaler = joblib.load(SCALER_PATH)
-    model = tf.keras.models.load_model(MODEL_PATH, compile=False)
+def load_model_handle(backend=None, version=None):
+    # The registry's current champion, or a given registered version; nothing loads until
+    # the first predict()
+    if version is not None:
+        return model_handle(version, backend)
+    return scoring_handles(backend, shadow=False)[0]
+
 
-    X = df[FEATURES].astype(float).values
-    Xs = scaler.transform(X).astype(np.float32)
+def load_model_handles(backend=None, shadow=True):
+    # [champion, challenger, ...]
+    return scoring_handles(backend, shadow)
 
-    mu, log_var = model(Xs, training=False)
-    mu = mu.numpy().reshape(-1).astype(float)
-    sigma = np.sqrt(np.exp(log_var.numpy().reshape(-1))).astype(float)
 
-    # scoring-time clamp to keep probabilities sane
-    sigma = np.clip(sigma, 1.0, 25.0)
+def cached_model(handle, use_cache=CACHE_ENABLED):
+    # Same predict() interface; unchanged feature rows are served from the prediction cache
+    return get_prediction_cache(handle) if use_cache else handle
+
+
+def score_frame(df, handle):
+    # One forward pass for every stat the model predicts, written side by side into the same
+    # predictions_daily rows
+    mu, sigma = handle.predict(df)
 
     out = df[["as_of_date", "game_id", "player_id"]].copy()
-    out["mu_pts"] = mu
-    out["sigma_pts"] = sigma
-
-    out["p15"] = probs_ge_k(mu, sigma, 15)
-    out["p20"] = probs_ge_k(mu, sigma, 20)
-    out["p25"] = probs_ge_k(mu, sigma, 25)
-    out["p30"] = probs_ge_k(mu, sigma, 30)
-    
-    AVG_SIGMA = 6.7 #from the evaluation
-
-    out["conf20"] = 100.0 * out["p20"] * (AVG_SIGMA / out["sigma_pts"])
-    out["conf25"] = 100.0 * out["p25"] * (AVG_SIGMA / out["sigma_pts"])
-    out["conf30"] = 100.0 * out["p30"] * (AVG_SIGMA / out["sigma_pts"])
-
-    out["model_version"] = MODEL_VERSION
-
-    upsert_sql = """
-    INSERT INTO predictions_daily (
-        as_of_date, game_id, player_id,
-        mu_pts, sigma_pts, p15, p20, p25, p30,
-        conf20, conf25, conf30,
-        model_version
-    )
-    VALUES (
-        :as_of_date, :game_id, :player_id,
-        :mu_pts, :sigma_pts, :p15, :p20, :p25, :p30,
-        :conf20, :conf25, :conf30,
-        :model_version
-    )
-    ON CONFLICT (as_of_date, game_id, player_id) DO UPDATE SET
-        mu_pts = EXCLUDED.mu_pts,
-        sigma_pts = EXCLUDED.sigma_pts,
-        p15 = EXCLUDED.p15,
-        p20 = EXCLUDED.p20,
-        p25 = EXCLUDED.p25,
-        p30 = EXCLUDED.p30,
-        conf20 = EXCLUDED.conf20,
-        conf25 = EXCLUDED.conf25,
-        conf30 = EXCLUDED.conf30,
-        model_version = EXCLUDED.model_version,
-        created_ts = NOW();
-    """
+    for j, stat in enumerate(handle.stats):
+        s = clamp_sigma(stat, sigma[:, j])
+        # mu / sigma, pK and confK for the stat's lines in one broadcasted pass
+        avg_sigma = load_avg_sigma(handle.calibration_path, stat)
+        for col, values in stat_columns(stat, mu[:, j], s, avg_sigma).items():
+            out[col] = values
+
+    out["model_version"] = handle.version
+    return out
 
+
+def score_models(df, models):
+    # Scores the same feature frame with every model. Returns (champion rows, challenger rows
+    # or None); models[0] is the champion.
+    outs = []
+    for model in models:
+        with span("score.predict", rows=len(df), model_version=model.version):
+            outs.append(score_frame(df, model))
+    return outs[0], (pd.concat(outs[1:], ignore_index=True) if len(outs) > 1 else None)
+
+
+def write_predictions(engine, out, shadow=None):
     with engine.begin() as conn:
-        conn.execute(text(upsert_sql), out.to_dict(orient="records"))
+        tag_transaction(conn, SCORE_APP)  # the export watermark stays below it while open
+        ensure_partitions(conn, "predictions_daily", out["as_of_date"].unique())
+        bulk_upsert(
+            conn,
+            "predictions_daily",
+            out,
+            ["as_of_date", "game_id", "player_id"],
+            extra_set="created_ts = NOW()",
+        )
+        if shadow is not None and len(shadow):
+            ensure_partitions(conn, "predictions_shadow", shadow["as_of_date"].unique())
+            bulk_upsert(
+                conn,
+                "predictions_shadow",
+                shadow,
+                ["as_of_date", "game_id", "player_id", "model_version"],
+                extra_set="created_ts = NOW()",
+            )
+
+
+def flush_models(models, handles):
+    for model, handle in zip(models, handles):
+        if model is not handle:
+            model.flush()
+
+
+def score_today(engine, handles=None, use_cache=CACHE_ENABLED):
+    # handles: [champion, challenger, ...] (default: the registry's, challengers included)
+    handles = handles or load_model_handles()
+    models = [cached_model(h, use_cache) for h in handles]
+
+    with span("score.read") as s:
+        df = pd.read_sql(
+            f"""
+            SELECT
+              {FEATURE_COLUMNS_SQL}
+            FROM player_features_daily
+            WHERE as_of_date = CURRENT_DATE
+            """,
+            engine,
+        )
+        s.rows = len(df)
+
+    if df.empty:
+        print("No feature rows for today, nothing to score.")
+        return 0
 
-    print(f"Upserted {len(out)} rows into predictions_daily")
+    out, shadow = score_models(df, models)
+    write_predictions(engine, out, shadow)
+
+    flush_models(models, handles)
+    for model, handle in zip(models, handles):
+        if model is not handle:
+            print(f"{model.version}: {model.summary()}")
+    print(f"Upserted {len(out)} rows into predictions_daily ({handles[0].version})")
+    if shadow is not None:
+        print(f"Upserted {len(shadow)} rows into predictions_shadow ({', '.join(h.version for h in handles[1:])})")
+    return len(out)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=BACKENDS, help="Model backend (default: SCORING_BACKEND or auto)")
+    parser.add_argument("--no-cache", action="store_true", help="score every row, bypassing the prediction cache")
+    parser.add_argument("--no-shadow", action="store_true", help="score the champion only, not the challengers")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    with pipeline_run("score_today", engine):
+        score_today(engine, load_model_handles(args.backend, shadow=not args.no_shadow),
+                    use_cache=CACHE_ENABLED and not args.no_cache)
 
 if __name__ == "__main__":
     main()
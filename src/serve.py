@@ -0,0 +1,369 @@
+import argparse
+import json
+import math
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.db import get_engine
+from src.distribution import THRESHOLDS, clamp_sigma, load_avg_sigma, points_pmf, probs_ge, stat_columns, threshold_label
+from src.model_handle import BACKENDS
+from src.registry import manifest_mtime
+from src.score_today import FEATURE_COLUMNS_SQL, load_model_handle
+
+# Long-running prediction service. The model and scaler stay resident; request threads put
+# their rows on a queue and one batcher thread merges whatever arrives within MAX_WAIT_MS
+# (or until MAX_BATCH rows) into a single forward pass, then hands each caller its slice.
+#
+#   POST /predict  {"rows": [{feature: value, ...}, ...]}               feature rows as-is
+#                  {"keys": [{"player_id": 203999, "game_id": "..."}]}  latest feature row per key
+#                  optional "thresholds": [22.5, ...] extra points lines, "pmf": true for the
+#                  0..80 points PMF; every stat the model predicts is returned (mu_reb, reb_p6, ...)
+#   GET  /health   model version, backend, predicted stats, batch stats
+#
+# Serves HTTP on --host/--port, or on a Unix socket with --socket.
+#
+# The registry's champion is served. The manifest is checked at most every RELOAD_CHECK_S;
+# when the champion changes (python -m src.registry promote ...), the new model is loaded
+# next to the old one, which keeps answering until the swap, so promotion needs no restart.
+
+HOST = os.getenv("SERVE_HOST", "127.0.0.1")
+PORT = int(os.getenv("SERVE_PORT", "8765"))
+MAX_BATCH = int(os.getenv("SERVE_MAX_BATCH", "1024"))
+MAX_WAIT_MS = float(os.getenv("SERVE_MAX_WAIT_MS", "5"))
+REQUEST_TIMEOUT = 30.0
+RELOAD_CHECK_S = float(os.getenv("SERVE_RELOAD_CHECK_S", "5"))
+
+
+class MicroBatcher:
+    def __init__(self, handle, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.handle = handle
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats = {"requests": 0, "rows": 0, "batches": 0, "max_batch_rows": 0}
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, df, handle=None):
+        # Future resolving to (mu, sigma, handle): arrays of shape (len(df), n_stats) and the
+        # handle that produced them. Rows run on the handle they were validated against (the
+        # current one by default), even if the champion is swapped while they wait.
+        fut = Future()
+        self._queue.put((df, handle or self.handle, fut))
+        return fut
+
+    def predict(self, df, handle=None, timeout=REQUEST_TIMEOUT):
+        return self.submit(df, handle).result(timeout=timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        rows = len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # one forward pass per handle (two only right around a swap)
+            by_handle = {}
+            for df, handle, fut in batch:
+                by_handle.setdefault(id(handle), (handle, []))[1].append((df, fut))
+            for handle, items in by_handle.values():
+                try:
+                    self._forward(handle, items)
+                except Exception as e:
+                    if len(items) == 1:
+                        items[0][1].set_exception(e)
+                        continue
+                    # one bad request must not fail everyone it was batched with: retry each alone
+                    for item in items:
+                        try:
+                            self._forward(handle, [item])
+                        except Exception as e:
+                            item[1].set_exception(e)
+
+    def _forward(self, handle, batch):
+        mu, sigma = handle.predict(pd.concat([df for df, _ in batch], ignore_index=True))
+        start = 0
+        for df, fut in batch:
+            end = start + len(df)
+            fut.set_result((mu[start:end], sigma[start:end], handle))
+            start = end
+
+        self.stats["requests"] += len(batch)
+        self.stats["rows"] += start
+        self.stats["batches"] += 1
+        self.stats["max_batch_rows"] = max(self.stats["max_batch_rows"], start)
+
+
+def lookup_features(engine, keys):
+    # Latest feature row for each (player_id, game_id)
+    pids = [int(k["player_id"]) for k in keys]
+    gids = [str(k["game_id"]) for k in keys]
+    return pd.read_sql(
+        text(
+            f"""
+            SELECT DISTINCT ON (game_id, player_id)
+              {FEATURE_COLUMNS_SQL}
+            FROM player_features_daily
+            WHERE (player_id, game_id) IN (
+              SELECT * FROM unnest(CAST(:pids AS integer[]), CAST(:gids AS text[]))
+            )
+            ORDER BY game_id, player_id, as_of_date DESC
+            """
+        ),
+        engine,
+        params={"pids": pids, "gids": gids},
+    )
+
+
+def _clean(v):
+    if isinstance(v, (np.integer,)):
+        return int(v)
+    if isinstance(v, (float, np.floating)):
+        return None if math.isnan(v) else float(v)
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    return v
+
+
+def build_response(df, mu, sigma, handle, extra_thresholds=None, with_pmf=False):
+    cols = {}
+    for j, stat in enumerate(handle.stats):
+        s = clamp_sigma(stat, sigma[:, j])
+        cols.update(stat_columns(stat, mu[:, j], s, load_avg_sigma(handle.calibration_path, stat)))
+
+    mu, sigma = cols["mu_pts"], cols["sigma_pts"]
+    if extra_thresholds:
+        extra = probs_ge(mu, sigma, extra_thresholds)
+        for j, k in enumerate(extra_thresholds):
+            cols[f"p{threshold_label(k)}"] = extra[:, j]
+    pmf = points_pmf(mu, sigma) if with_pmf else None
+
+    ids = [c for c in ("as_of_date", "game_id", "player_id") if c in df.columns]
+    out = []
+    for i in range(len(df)):
+        row = {c: _clean(df[c].iloc[i]) for c in ids}
+        row.update({c: _clean(v[i]) for c, v in cols.items()})
+        if pmf is not None:
+            row["pmf"] = [round(float(p), 6) for p in pmf[i]]
+        out.append(row)
+    return out
+
+
+class PredictionService:
+    def __init__(self, handle, engine=None, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS,
+                 reload_check_s=RELOAD_CHECK_S, backend=None):
+        self.handle = handle
+        self.backend = backend
+        self.engine = engine
+        self.batcher = MicroBatcher(handle, max_batch, max_wait_ms)
+        self.started = time.time()
+        self.swaps = 0
+
+        self.reload_check_s = reload_check_s
+        self._manifest_mtime = manifest_mtime()
+        self._next_check = time.monotonic() + reload_check_s
+        self._reload_lock = threading.Lock()
+
+    def maybe_reload(self):
+        # Swaps in the registry's champion if the manifest changed. One request thread does
+        # the check (and the load); the others carry on with the current handle.
+        if self.reload_check_s <= 0 or time.monotonic() < self._next_check:
+            return False
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_check = time.monotonic() + self.reload_check_s
+            mtime = manifest_mtime()
+            if mtime == self._manifest_mtime:
+                return False
+            self._manifest_mtime = mtime
+            new = load_model_handle(self.backend)
+            if new is self.handle:
+                return False
+            t0 = time.perf_counter()
+            new.load()
+            old, self.handle = self.handle, new
+            self.batcher.handle = new
+            self.swaps += 1
+            print(f"Swapped {old.version} -> {new.version} ({new.backend}) in {time.perf_counter() - t0:.1f}s")
+            return True
+        except Exception as e:
+            # a half-written or bad manifest must not take the service down; keep serving
+            print(f"Model reload failed, still serving {self.handle.version}: {e}")
+            return False
+        finally:
+            self._reload_lock.release()
+
+    def predict(self, payload):
+        self.maybe_reload()
+        if "rows" in payload:
+            df = pd.DataFrame(payload["rows"])
+        elif "keys" in payload:
+            if self.engine is None:
+                raise ValueError("key lookups need a database connection")
+            df = lookup_features(self.engine, payload["keys"])
+        else:
+            raise ValueError('body needs "rows" or "keys"')
+
+        thresholds = [float(k) for k in payload.get("thresholds", []) if float(k) not in THRESHOLDS]
+        # one handle for the whole request: a swap mid-request must not run these rows on a
+        # model with other features than the ones they were checked against
+        handle = self.handle
+        if df.empty:
+            return {"model_version": handle.version, "predictions": []}
+
+        # Validated here, in the request thread, so a bad request gets its own 400 instead of
+        # failing the batch it would have joined
+        features = handle.features
+        missing = [c for c in features if c not in df.columns]
+        if missing:
+            raise ValueError(f"rows are missing feature columns {missing}")
+        try:
+            X = df[features].astype(float)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"feature values must be numeric: {e}")
+
+        mu, sigma, handle = self.batcher.predict(X, handle)
+        return {
+            "model_version": handle.version,
+            "predictions": build_response(df, mu, sigma, handle, thresholds, bool(payload.get("pmf"))),
+        }
+
+    def health(self):
+        self.maybe_reload()
+        handle = self.handle
+        return {
+            "status": "ok",
+            "model_version": handle.version,
+            "backend": handle.backend,
+            "stats": handle.stats,
+            "model_swaps": self.swaps,
+            "uptime_s": round(time.time() - self.started, 1),
+            **self.batcher.stats,
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    service = None
+    verbose = False
+
+    def _send(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self._send(200, self.service.health())
+        else:
+            self._send(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/predict":
+            self._send(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            self._send(200, self.service.predict(payload))
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+
+    def address_string(self):
+        # Unix socket peers have no (host, port)
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+class TCPServer(ThreadingHTTPServer):
+    # the default listen backlog of 5 drops connections when many clients burst in at once
+    request_queue_size = 128
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_server(service, host=HOST, port=PORT, socket_path=None, verbose=False):
+    handler = type("BoundHandler", (Handler,), {"service": service, "verbose": verbose})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return UnixHTTPServer(socket_path, handler)
+    return TCPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve point distributions over HTTP or a Unix socket")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--socket", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--backend", choices=BACKENDS, help="Model backend (default: SCORING_BACKEND or auto)")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="rows per forward pass")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS, help="how long a batch waits to fill up")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    handle = load_model_handle(args.backend).load()
+    print(f"Loaded {handle.version} ({handle.backend}) in {time.perf_counter() - t0:.1f}s")
+
+    service = PredictionService(handle, get_engine(), args.max_batch, args.max_wait_ms, backend=args.backend)
+    server = make_server(service, args.host, args.port, args.socket, args.verbose)
+    where = args.socket or f"http://{args.host}:{args.port}"
+    print(f"Serving on {where} (max_batch={args.max_batch}, max_wait_ms={args.max_wait_ms})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.batcher.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+if __name__ == "__main__":
+    main()
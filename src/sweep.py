@@ -0,0 +1,210 @@
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+
+from src.distribution import CONF_THRESHOLDS, probs_ge
+
+# Trains a grid of configurations x seeds on a process pool. The parent loads and scales the
+# training data once and writes it as .npy files; every worker memory-maps those instead of
+# querying Postgres. Workers are spawned (not forked, TensorFlow doesn't survive a fork) and
+# pinned to a fixed number of threads so N workers don't oversubscribe the CPU.
+
+SWEEP_DIR = os.path.join("data", "cache", "sweep")
+OUTPUT_DIR = os.path.join("outputs", "sweep")
+INTERVALS = (0.5, 0.8, 0.9)
+
+_worker_data = None
+
+
+def pin_threads(threads):
+    # Runs in each fresh worker before TensorFlow is imported (also used by src.backtest)
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def _init_worker(data_dir, threads):
+    pin_threads(threads)
+
+    global _worker_data
+    _worker_data = {
+        name: np.load(os.path.join(data_dir, f"{name}.npy"), mmap_mode="r")
+        for name in ("X_train", "y_train", "X_val", "y_val")
+    }
+
+
+def calibration_metrics(y, mu, sigma):
+    # Central interval coverage from the PIT, plus Brier scores at the confidence thresholds
+    y, mu, sigma = (np.asarray(a, dtype=float).reshape(-1) for a in (y, mu, sigma))
+    pit = ndtr((y - mu) / sigma)
+
+    out = {}
+    errors = []
+    for c in INTERVALS:
+        cov = float(np.mean(np.abs(pit - 0.5) <= c / 2))
+        out[f"cov{int(c * 100)}"] = cov
+        errors.append(abs(cov - c))
+    out["calib_err"] = float(np.mean(errors))
+
+    probs = probs_ge(mu, sigma, CONF_THRESHOLDS)
+    hits = y.reshape(-1, 1) >= np.asarray(CONF_THRESHOLDS).reshape(1, -1)
+    for j, k in enumerate(CONF_THRESHOLDS):
+        out[f"brier{k}"] = float(np.mean((probs[:, j] - hits[:, j]) ** 2))
+    return out
+
+
+def run_config(cfg):
+    from src.train_model import train
+
+    d = _worker_data
+    t0 = time.perf_counter()
+    model, history = train(
+        np.asarray(d["X_train"]), np.asarray(d["y_train"]),
+        np.asarray(d["X_val"]), np.asarray(d["y_val"]),
+        epochs=cfg["epochs"],
+        batch_size=cfg["batch_size"],
+        learning_rate=cfg["learning_rate"],
+        patience=cfg["patience"],
+        hidden=tuple(cfg["hidden"]),
+        seed=cfg["seed"],
+        verbose=False,
+    )
+    fit_seconds = time.perf_counter() - t0
+
+    # metrics for the points head (column 0)
+    mu, log_var = model.predict(np.asarray(d["X_val"]), batch_size=4096, verbose=0)
+    mu = mu[:, 0].astype(float)
+    sigma = np.sqrt(np.exp(log_var[:, 0])).astype(float)
+    y = np.asarray(d["y_val"])[:, 0]
+
+    best = min(history, key=lambda h: h["val_nll"])
+    row = dict(cfg)
+    row["hidden"] = "-".join(str(u) for u in cfg["hidden"])
+    row.update(
+        {
+            "val_nll": best["val_nll"],
+            "val_mae": float(np.mean(np.abs(y - mu))),
+            "best_epoch": best["epoch"],
+            "epochs_run": len(history),
+            "fit_seconds": round(fit_seconds, 1),
+        }
+    )
+    row.update(calibration_metrics(y, mu, sigma))
+    return row
+
+
+def prepare_data(data_dir, refresh=False):
+    # One scale pass over the materialized training set, shared by every run of the sweep
+    from sklearn.preprocessing import StandardScaler
+    from src.db import get_engine
+    from src.train_cache import load_training_set, materialize, time_split_index
+    from src.train_model import FEATURES, TARGETS
+
+    X, y, dates, _ = load_training_set(materialize(get_engine(), FEATURES, TARGETS, refresh=refresh))
+    y = np.asarray(y).reshape(len(y), -1)
+    split = time_split_index(dates)
+    scaler = StandardScaler()
+    arrays = {
+        "X_train": scaler.fit_transform(X[:split]).astype(np.float32),
+        "y_train": y[:split],
+        "X_val": scaler.transform(X[split:]).astype(np.float32),
+        "y_val": y[split:],
+    }
+    os.makedirs(data_dir, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(os.path.join(data_dir, f"{name}.npy"), arr)
+    print(f"training matrix: {arrays['X_train'].shape[0]} train / {arrays['X_val'].shape[0]} val rows -> {data_dir}")
+    return data_dir
+
+
+def build_grid(learning_rates, batch_sizes, hiddens, patiences, seeds, epochs):
+    return [
+        {
+            "learning_rate": lr,
+            "batch_size": bs,
+            "hidden": hidden,
+            "patience": patience,
+            "seed": seed,
+            "epochs": epochs,
+        }
+        for lr, bs, hidden, patience, seed in itertools.product(learning_rates, batch_sizes, hiddens, patiences, seeds)
+    ]
+
+
+def run_sweep(grid, data_dir, workers, threads_per_worker):
+    rows = []
+    ctx = mp.get_context("spawn")
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(data_dir, threads_per_worker),
+    ) as pool:
+        futures = {pool.submit(run_config, cfg): cfg for cfg in grid}
+        for i, fut in enumerate(as_completed(futures), start=1):
+            cfg = futures[fut]
+            try:
+                row = fut.result()
+                print(f"[{i}/{len(grid)}] val_nll={row['val_nll']:.4f} val_mae={row['val_mae']:.3f} "
+                      f"calib_err={row['calib_err']:.3f} {json.dumps(cfg)}")
+            except Exception as e:
+                row = dict(cfg, hidden="-".join(str(u) for u in cfg["hidden"]), error=str(e)[:300])
+                print(f"[{i}/{len(grid)}] FAILED {json.dumps(cfg)}: {e}")
+            rows.append(row)
+
+    print(f"{len(grid)} runs in {time.perf_counter() - t0:.0f}s with {workers} workers")
+    board = pd.DataFrame(rows)
+    if "val_nll" in board.columns:
+        board = board.sort_values("val_nll", na_position="last").reset_index(drop=True)
+    return board
+
+
+def _csv_list(cast):
+    return lambda s: [cast(v) for v in s.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hyperparameter / seed sweep for the hetero NLL model")
+    parser.add_argument("--learning-rates", type=_csv_list(float), default=[1e-3, 3e-4])
+    parser.add_argument("--batch-sizes", type=_csv_list(int), default=[256, 512])
+    parser.add_argument("--hidden", type=_csv_list(str), default=["128-64-64", "256-128-64"],
+                        help='comma separated layer stacks, e.g. "128-64-64,64-64"')
+    parser.add_argument("--patience", type=_csv_list(int), default=[6])
+    parser.add_argument("--seeds", type=_csv_list(int), default=[0, 1, 2])
+    parser.add_argument("--epochs", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--threads-per-worker", type=int, default=2)
+    parser.add_argument("--data-dir", help="reuse an already prepared training matrix")
+    args = parser.parse_args()
+
+    hiddens = [tuple(int(u) for u in h.split("-")) for h in args.hidden]
+    grid = build_grid(args.learning_rates, args.batch_sizes, hiddens, args.patience, args.seeds, args.epochs)
+
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    data_dir = args.data_dir or prepare_data(os.path.join(SWEEP_DIR, stamp))
+    board = run_sweep(grid, data_dir, args.workers, args.threads_per_worker)
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    out = os.path.join(OUTPUT_DIR, f"leaderboard_{stamp}.csv")
+    board.to_csv(out, index=False)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(board.head(10))
+    print(f"leaderboard written to {out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import argparse
+
+from sqlalchemy import text
+
+# Team-level aggregate layer: one team_game_stats row per (game, team) with points scored and
+# allowed, points allowed to opposing players by minutes tier (starter / rotation / bench, from
+# the minutes they played in that game) and team minutes. Rows are refreshed only for games
+# whose boxscores were ingested since the last feature build, by grouping just those games'
+# player_game_stats rows, so keeping it current never rescans the history.
+#
+# TEAM_WINDOW_SQL turns it into pre-game rolling features over each team's last WINDOW games
+# (the table is ~2.5k rows a season, so the window is cheap), and build_features joins them
+# onto every player row twice: as the opponent (defense, pace) and as the player's own team.
+#
+# Pace proxy: no possession-level stats are ingested, so pace is the combined score of both
+# teams per 240 team-minutes (overtime normalized away).
+
+WINDOW = 10
+STARTER_MIN = 28.0
+ROTATION_MIN = 15.0
+
+REFRESH_SQL = f"""
+    WITH per_team AS (
+        SELECT
+            pgs.game_id,
+            pgs.team_id,
+            g.game_date::date AS game_date,
+            CASE WHEN pgs.team_id = g.home_team_id THEN g.away_team_id ELSE g.home_team_id END AS opponent_team_id,
+            SUM(pgs.points) AS pts,
+            SUM(pgs.minutes) AS minutes,
+            COUNT(*) FILTER (WHERE pgs.minutes > 0) AS n_players,
+            SUM(pgs.points) FILTER (WHERE pgs.minutes >= {STARTER_MIN}) AS starter_pts,
+            COUNT(*) FILTER (WHERE pgs.minutes >= {STARTER_MIN}) AS starter_n,
+            SUM(pgs.points) FILTER (WHERE pgs.minutes >= {ROTATION_MIN} AND pgs.minutes < {STARTER_MIN}) AS rotation_pts,
+            COUNT(*) FILTER (WHERE pgs.minutes >= {ROTATION_MIN} AND pgs.minutes < {STARTER_MIN}) AS rotation_n,
+            SUM(pgs.points) FILTER (WHERE pgs.minutes > 0 AND pgs.minutes < {ROTATION_MIN}) AS bench_pts,
+            COUNT(*) FILTER (WHERE pgs.minutes > 0 AND pgs.minutes < {ROTATION_MIN}) AS bench_n
+        FROM player_game_stats pgs
+        JOIN games g ON g.game_id = pgs.game_id
+        WHERE g.game_date IS NOT NULL {{filter}}
+        GROUP BY pgs.game_id, pgs.team_id, g.game_date, g.home_team_id, g.away_team_id
+    )
+    INSERT INTO team_game_stats (
+        game_id, team_id, opponent_team_id, game_date,
+        pts_for, team_minutes, n_players,
+        pts_allowed, opp_minutes,
+        allowed_starter_pts, allowed_starter_n,
+        allowed_rotation_pts, allowed_rotation_n,
+        allowed_bench_pts, allowed_bench_n
+    )
+    SELECT
+        t.game_id, t.team_id, t.opponent_team_id, t.game_date,
+        t.pts, t.minutes, t.n_players,
+        o.pts, o.minutes,
+        COALESCE(o.starter_pts, 0), o.starter_n,
+        COALESCE(o.rotation_pts, 0), o.rotation_n,
+        COALESCE(o.bench_pts, 0), o.bench_n
+    FROM per_team t
+    JOIN per_team o ON o.game_id = t.game_id AND o.team_id = t.opponent_team_id
+    ON CONFLICT (game_id, team_id) DO UPDATE SET
+        opponent_team_id = EXCLUDED.opponent_team_id,
+        game_date = EXCLUDED.game_date,
+        pts_for = EXCLUDED.pts_for,
+        team_minutes = EXCLUDED.team_minutes,
+        n_players = EXCLUDED.n_players,
+        pts_allowed = EXCLUDED.pts_allowed,
+        opp_minutes = EXCLUDED.opp_minutes,
+        allowed_starter_pts = EXCLUDED.allowed_starter_pts,
+        allowed_starter_n = EXCLUDED.allowed_starter_n,
+        allowed_rotation_pts = EXCLUDED.allowed_rotation_pts,
+        allowed_rotation_n = EXCLUDED.allowed_rotation_n,
+        allowed_bench_pts = EXCLUDED.allowed_bench_pts,
+        allowed_bench_n = EXCLUDED.allowed_bench_n,
+        updated_ts = NOW()
+"""
+
+# Games with boxscore rows ingested in (watermark, high_watermark]
+CHANGED_GAMES_FILTER = """
+          AND pgs.game_id IN (
+              SELECT DISTINCT game_id FROM player_game_stats
+              WHERE ingested_ts > :watermark AND ingested_ts <= :high_watermark
+          )
+"""
+
+# CTE fragment (for a WITH ... chain): rolling team features for each team-game, using only
+# games before it. Allowed-by-tier is points per opposing player in that tier.
+TEAM_WINDOW_SQL = f"""
+    team_roll AS (
+        SELECT
+            game_id,
+            team_id,
+            AVG(pts_allowed) OVER tw AS pts_allowed_10,
+            SUM(allowed_starter_pts) OVER tw / NULLIF(SUM(allowed_starter_n) OVER tw, 0) AS allowed_starter_10,
+            SUM(allowed_rotation_pts) OVER tw / NULLIF(SUM(allowed_rotation_n) OVER tw, 0) AS allowed_rotation_10,
+            SUM(allowed_bench_pts) OVER tw / NULLIF(SUM(allowed_bench_n) OVER tw, 0) AS allowed_bench_10,
+            AVG((pts_for + pts_allowed) * 240.0 / NULLIF(team_minutes, 0)) OVER tw AS pace_10
+        FROM team_game_stats
+        WINDOW tw AS (PARTITION BY team_id ORDER BY game_date, game_id ROWS BETWEEN {WINDOW} PRECEDING AND 1 PRECEDING)
+    ),
+"""
+
+# Opponent allowed-by-tier for the player's own tier, from their rolling minutes
+TIER_CASE_SQL = f"""
+        CASE
+            WHEN w.rolling_min_10 >= {STARTER_MIN} THEN opp.allowed_starter_10
+            WHEN w.rolling_min_10 >= {ROTATION_MIN} THEN opp.allowed_rotation_10
+            ELSE opp.allowed_bench_10
+        END"""
+
+
+def refresh_team_aggregates(conn, watermark=None, high_watermark=None):
+    # Upserts team_game_stats for games ingested in (watermark, high_watermark], or for every
+    # game when watermark is None. Returns the number of team-game rows written.
+    if watermark is None:
+        return conn.execute(text(REFRESH_SQL.format(filter=""))).rowcount
+    return conn.execute(
+        text(REFRESH_SQL.format(filter=CHANGED_GAMES_FILTER)),
+        {"watermark": watermark, "high_watermark": high_watermark},
+    ).rowcount
+
+
+def main():
+    from src.db import get_engine
+
+    parser = argparse.ArgumentParser(description="Rebuild team_game_stats from player_game_stats")
+    parser.parse_args()
+
+    with get_engine().begin() as conn:
+        n = refresh_team_aggregates(conn)
+    print(f"team_game_stats: {n} team-game rows refreshed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+# Materializes player_model_train once per data version into a memory-mappable layout:
+#   <CACHE_DIR>/<version>/X.npy       float32 (n_rows, n_features), sorted by next_game_date
+#   <CACHE_DIR>/<version>/y.npy       float32 (n_rows,), or (n_rows, n_targets) for a target list
+#   <CACHE_DIR>/<version>/dates.npy   datetime64[D] (n_rows,)
+#   <CACHE_DIR>/<version>/index.json  features, target, row count, data version, content hash
+# The version is a hash of the feature/target lists and cheap fingerprints of the source
+# tables, so a new ingest or feature build produces a new directory and an unchanged
+# database reuses the existing one without reading the view at all.
+
+CACHE_DIR = os.path.join("data", "cache", "train")
+SOURCE_VIEW = "player_model_train"
+DATE_COLUMN = "next_game_date"
+
+
+def data_version(conn, features, target, source=SOURCE_VIEW):
+    fp = conn.execute(
+        text(
+            """
+            SELECT
+              (SELECT COUNT(*) FROM player_game_stats),
+              (SELECT MAX(ingested_ts) FROM player_game_stats),
+              (SELECT COUNT(*) FROM player_features_daily),
+              (SELECT MAX(as_of_date) FROM player_features_daily),
+              (SELECT pg_get_viewdef(CAST(:source AS regclass)))
+            """
+        ),
+        {"source": source},
+    ).fetchone()
+    blob = json.dumps({"features": features, "target": target, "source": source, "fp": list(fp)}, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+
+def _content_hash(*arrays):
+    h = hashlib.sha256()
+    for a in arrays:
+        h.update(np.ascontiguousarray(a).view(np.uint8).data)
+    return h.hexdigest()
+
+
+def _export(conn, features, target, source, out_dir):
+    # target is one column, or a list whose first entry is required and the rest may be NaN
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+
+    targets = [target] if isinstance(target, str) else list(target)
+    cols = features + targets + [DATE_COLUMN]
+    copy_sql = f"COPY (SELECT {', '.join(cols)} FROM {source}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+
+    with tempfile.NamedTemporaryFile(suffix=".csv", dir=out_dir, delete=False) as tmp:
+        cur = conn.connection.cursor()
+        try:
+            cur.copy_expert(copy_sql, tmp)
+        finally:
+            cur.close()
+        csv_path = tmp.name
+
+    # Arrow parses the CSV straight into typed columns, no pandas dtype coercion
+    try:
+        convert = pacsv.ConvertOptions(
+            column_types={c: pa.float32() for c in features + targets} | {DATE_COLUMN: pa.date32()}
+        )
+        table = pacsv.read_csv(csv_path, convert_options=convert)
+    finally:
+        os.remove(csv_path)
+
+    valid = None
+    for c in features + targets[:1] + [DATE_COLUMN]:
+        ok = pc.is_valid(table[c])
+        if c != DATE_COLUMN:
+            ok = pc.and_(ok, pc.invert(pc.is_nan(table[c])))
+        valid = ok if valid is None else pc.and_(valid, ok)
+    table = table.filter(valid)
+    table = table.take(pc.sort_indices(table, sort_keys=[(DATE_COLUMN, "ascending")]))
+
+    X = np.column_stack([table[c].to_numpy() for c in features]).astype(np.float32, copy=False)
+    if isinstance(target, str):
+        y = table[target].to_numpy().astype(np.float32, copy=False)
+    else:
+        y = np.column_stack([pc.fill_null(table[c], np.nan).to_numpy() for c in targets]).astype(np.float32)
+    dates = table[DATE_COLUMN].to_numpy().astype("datetime64[D]")
+    return np.ascontiguousarray(X), y, dates
+
+
+def materialize(engine, features, target, source=SOURCE_VIEW, cache_dir=CACHE_DIR, refresh=False):
+    # Returns the directory holding the current version, exporting it only if needed
+    with engine.connect() as conn:
+        version = data_version(conn, features, target, source)
+        out_dir = os.path.join(cache_dir, version)
+        if not refresh and os.path.exists(os.path.join(out_dir, "index.json")):
+            print(f"training set {version} already materialized in {out_dir}")
+            return out_dir
+
+        t0 = time.perf_counter()
+        os.makedirs(cache_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix=f".{version}.", dir=cache_dir)
+        X, y, dates = _export(conn, features, target, source, work_dir)
+
+    np.save(os.path.join(work_dir, "X.npy"), X)
+    np.save(os.path.join(work_dir, "y.npy"), y)
+    np.save(os.path.join(work_dir, "dates.npy"), dates)
+    index = {
+        "version": version,
+        "source": source,
+        "features": features,
+        "target": target,
+        "n_rows": int(len(y)),
+        "content_hash": _content_hash(X, y, dates.astype("int64")),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(work_dir, "index.json"), "w") as f:
+        json.dump(index, f, indent=2)
+
+    # publish atomically; a concurrent run may have won the race, which is fine
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(work_dir, out_dir)
+    print(f"materialized {len(y)} rows of {source} as {version} in {time.perf_counter() - t0:.1f}s -> {out_dir}")
+    return out_dir
+
+
+def load_training_set(path, verify=False):
+    # Memory-mapped views, nothing is read until it's touched. verify=True re-hashes the
+    # arrays against index.json (reads everything once).
+    with open(os.path.join(path, "index.json"), "r") as f:
+        index = json.load(f)
+    X = np.load(os.path.join(path, "X.npy"), mmap_mode="r")
+    y = np.load(os.path.join(path, "y.npy"), mmap_mode="r")
+    dates = np.load(os.path.join(path, "dates.npy"), mmap_mode="r")
+
+    if verify and _content_hash(X, y, dates.view("int64")) != index["content_hash"]:
+        raise ValueError(f"training set in {path} does not match its content hash")
+    return X, y, dates, index
+
+
+def time_split_index(dates, quantile=0.80):
+    # Rows are sorted by date, so the split is a prefix: rows up to the cutoff date train,
+    # later ones validate (the cutoff is the quantile of the dates, as in a pandas time split)
+    if len(dates) == 0:
+        return 0
+    days = np.asarray(dates).astype("int64")
+    cutoff = np.quantile(days, quantile)
+    return int(np.searchsorted(days, cutoff, side="right"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialize player_model_train to a memory-mapped cache")
+    parser.add_argument("--refresh", action="store_true", help="export again even if the version is unchanged")
+    parser.add_argument("--verify", action="store_true", help="check the content hash after loading")
+    args = parser.parse_args()
+
+    from src.db import get_engine
+    from src.train_model import FEATURES, TARGETS
+
+    path = materialize(get_engine(), FEATURES, TARGETS, refresh=args.refresh)
+    X, y, dates, index = load_training_set(path, verify=args.verify)
+    print(f"{index['n_rows']} rows x {len(index['features'])} features, "
+          f"{dates[0] if len(dates) else '-'} .. {dates[-1] if len(dates) else '-'}, hash {index['content_hash'][:12]}")
+
+if __name__ == "__main__":
+    main()
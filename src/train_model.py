@@ -1,11 +1,12 @@
+import argparse
 import os
 import json
+import time
 import numpy as np
-import pandas as pd
 
-from src.db import get_engine
+from src.distribution import STATS
+from src.numpy_model import LOG_VAR_MAX, LOG_VAR_MIN, export_npz
 
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 import joblib
 
@@ -15,9 +16,6 @@ import tensorflow as tf
 # ----------------------------
 # Config
 # ----------------------------
-MODEL_DIR = "artifacts"
-MODEL_VERSION = "v1_hetero_nll"
-
 FEATURES = [
     "home_flag",
     "rest_days",
@@ -29,10 +27,44 @@ FEATURES = [
     "min_std_10",
     "last_game_pts",
     "last_game_min",
+    "rolling_reb_10",
+    "reb_std_10",
+    "rolling_ast_10",
+    "ast_std_10",
+    "rolling_fg3m_10",
+    "fg3m_std_10",
+    "opp_pts_allowed_10",
+    "opp_pts_allowed_tier_10",
+    "opp_pace_10",
+    "team_pace_10",
+    "ew_pts_mean_3",
+    "ew_pts_std_3",
+    "ew_min_mean_3",
+    "ew_min_std_3",
+    "ew_pts_mean_7",
+    "ew_pts_std_7",
+    "ew_min_mean_7",
+    "ew_min_std_7",
+    "ew_pts_mean_15",
+    "ew_pts_std_15",
+    "ew_min_mean_15",
+    "ew_min_std_15",
 ]
 
 TARGET = "next_points"
 
+# One output head per stat, in STATS order (points first). Rows need TARGET; the other
+# targets may be missing (games ingested before they were kept) and are masked in the loss.
+TARGET_STATS = list(STATS)
+TARGETS = [f"next_{STATS[stat]['column']}" for stat in TARGET_STATS]
+
+HIDDEN = (128, 64, 64)
+EPOCHS = 60
+BATCH_SIZE = 256
+LEARNING_RATE = 1e-3
+PATIENCE = 6
+SHUFFLE_BUFFER = 8192
+
 
 # ----------------------------
 # Heteroscedastic Gaussian NLL
@@ -44,119 +76,250 @@ def gaussian_nll(y_true, mu, log_var):
     return 0.5 * (log_var + tf.square(y_true - mu) / (tf.exp(log_var) + 1e-6))
 
 
+@tf.function
+def masked_nll(y_true, mu, log_var):
+    # (sum, count) of the NLL over the targets that are present; NaN targets contribute nothing
+    y_true = tf.cast(y_true, mu.dtype)
+    present = tf.math.is_finite(y_true)
+    nll = gaussian_nll(tf.where(present, y_true, mu), mu, log_var)
+    w = tf.cast(present, mu.dtype)
+    return tf.reduce_sum(nll * w), tf.reduce_sum(w)
+
 
-def build_model(d_in: int) -> tf.keras.Model:
+def build_model(d_in: int, hidden=HIDDEN, n_out: int = 1) -> tf.keras.Model:
+    # Shared trunk, then a (mu, log_var) head per stat: column j of each output Dense is stat j's
+    # own linear head, so every stat comes out of the same forward pass
     x_in = tf.keras.Input(shape=(d_in,), name="x")
 
-    h = tf.keras.layers.Dense(128, activation="relu")(x_in)
-    h = tf.keras.layers.Dense(64, activation="relu")(h)
-    h = tf.keras.layers.Dense(64, activation="relu")(h)
+    h = x_in
+    for units in hidden:
+        h = tf.keras.layers.Dense(units, activation="relu")(h)
 
-    mu = tf.keras.layers.Dense(1, name="mu")(h)
-    raw_log_var = tf.keras.layers.Dense(1)(h)
-    log_var = tf.keras.layers.Lambda(
-        lambda t: tf.clip_by_value(t, 0.0, 6.44),
-        name="log_var"
-    )(raw_log_var)
+    mu = tf.keras.layers.Dense(n_out, name="mu")(h)
+    # clip to [LOG_VAR_MIN, LOG_VAR_MAX] as a capped ReLU over log_var - LOG_VAR_MIN, shifted back
+    # by a Rescaling offset; unlike a Lambda, both save and load without safe_mode=False. The raw
+    # head's bias starts at -LOG_VAR_MIN so an untrained head still starts at log_var = 0.
+    raw_log_var = tf.keras.layers.Dense(
+        n_out, name="log_var_raw", bias_initializer=tf.keras.initializers.Constant(-LOG_VAR_MIN)
+    )(h)
+    clipped = tf.keras.layers.ReLU(max_value=LOG_VAR_MAX - LOG_VAR_MIN, name="log_var_clip")(raw_log_var)
+    log_var = tf.keras.layers.Rescaling(1.0, offset=LOG_VAR_MIN, name="log_var")(clipped)
 
 
     return tf.keras.Model(inputs=x_in, outputs=[mu, log_var])
 
 
-def main():
-    os.makedirs(MODEL_DIR, exist_ok=True)
-
-    engine = get_engine()
-    df = pd.read_sql("SELECT * FROM player_model_train;", engine)
-
-    # Basic cleaning, just in case
-    for c in FEATURES + [TARGET]:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
-
-    df = df.dropna(subset=FEATURES + [TARGET]).copy()
-
-    # Time split to reduce leakage (train earlier dates, validate later dates)
-    df["next_game_date"] = pd.to_datetime(df["next_game_date"])
-    df = df.sort_values("next_game_date").reset_index(drop=True)
-
-    cutoff = df["next_game_date"].quantile(0.80)
-    train_df = df[df["next_game_date"] <= cutoff].copy()
-    val_df = df[df["next_game_date"] > cutoff].copy()
-
-    X_train = train_df[FEATURES].astype(np.float32).values
-    y_train = train_df[TARGET].astype(np.float32).values.reshape(-1, 1)
-
-    X_val = val_df[FEATURES].astype(np.float32).values
-    y_val = val_df[TARGET].astype(np.float32).values.reshape(-1, 1)
-
-
-    # Scale inputs
-    scaler = StandardScaler()
-    X_train_s = scaler.fit_transform(X_train).astype(np.float32)
-    X_val_s = scaler.transform(X_val).astype(np.float32)
-
-    model = build_model(X_train_s.shape[1])
-    optimizer = tf.keras.optimizers.Adam(learning_rate=1e-3)
-
-    # Datasets
-    batch_size = 256
-    train_ds = tf.data.Dataset.from_tensor_slices((X_train_s, y_train)).shuffle(8192).batch(batch_size)
-    val_ds = tf.data.Dataset.from_tensor_slices((X_val_s, y_val)).batch(batch_size)
+# ----------------------------
+# Training engine
+# ----------------------------
+def make_dataset(X, y, batch_size, shuffle=False, seed=None):
+    # Arrays are already in memory, cache() just keeps the sliced tensors around between
+    # epochs; prefetch overlaps the input pipeline with the train step.
+    ds = tf.data.Dataset.from_tensor_slices((X, y)).cache()
+    if shuffle:
+        ds = ds.shuffle(min(len(X), SHUFFLE_BUFFER), seed=seed, reshuffle_each_iteration=True)
+    return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def train(X_train_s, y_train, X_val_s, y_val, epochs=EPOCHS, batch_size=BATCH_SIZE,
+          learning_rate=LEARNING_RATE, patience=PATIENCE, hidden=HIDDEN, seed=None, verbose=True):
+    # Returns (model, history). The model ends up with the weights of the best val epoch.
+    # y is (n, n_stats) with NaN for missing targets, or (n, 1) for points only; val_mae and
+    # the printed sigma are for the first (points) head.
+    if seed is not None:
+        tf.keras.utils.set_random_seed(seed)
+
+    model = build_model(X_train_s.shape[1], hidden, n_out=y_train.shape[1])
+    optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+
+    train_ds = make_dataset(X_train_s, y_train, batch_size, shuffle=True, seed=seed)
+    val_ds = make_dataset(X_val_s, y_val, batch_size)
+
+    # Metrics live on-device; nothing is pulled back to the host until the end of the epoch
+    train_nll = tf.keras.metrics.Mean()
+    val_nll = tf.keras.metrics.Mean()
+    val_mae = tf.keras.metrics.Mean()
+    val_sigma = tf.keras.metrics.Mean()
+
+    @tf.function
+    def train_step(xb, yb):
+        with tf.GradientTape() as tape:
+            mu, log_var = model(xb, training=True)
+            total, n = masked_nll(yb, mu, log_var)
+            loss = total / tf.maximum(n, 1.0)
+        grads = tape.gradient(loss, model.trainable_variables)
+        optimizer.apply_gradients(zip(grads, model.trainable_variables))
+        train_nll.update_state(loss, sample_weight=n)
+
+    @tf.function
+    def eval_step(xb, yb):
+        mu, log_var = model(xb, training=False)
+        total, n = masked_nll(yb, mu, log_var)
+        val_nll.update_state(total / tf.maximum(n, 1.0), sample_weight=n)
+        val_mae.update_state(tf.abs(tf.cast(yb[:, :1], mu.dtype) - mu[:, :1]))
+        val_sigma.update_state(tf.exp(0.5 * log_var[:, :1]))
 
     best_val = float("inf")
-    patience = 6
+    best_weights = None
     bad = 0
+    history = []
+
+    for epoch in range(1, epochs + 1):
+        for m in (train_nll, val_nll, val_mae, val_sigma):
+            m.reset_state()
 
-    for epoch in range(1, 61):
-        tr_losses = []
         for xb, yb in train_ds:
-            with tf.GradientTape() as tape:
-                mu, log_var = model(xb, training=True)
-                loss = tf.reduce_mean(gaussian_nll(yb, mu, log_var))
-            grads = tape.gradient(loss, model.trainable_variables)
-            optimizer.apply_gradients(zip(grads, model.trainable_variables))
-            tr_losses.append(loss.numpy())
-
-        va_losses = []
+            train_step(xb, yb)
         for xb, yb in val_ds:
-            mu, log_var = model(xb, training=False)
-            loss = tf.reduce_mean(gaussian_nll(yb, mu, log_var))
-            va_losses.append(loss.numpy())
-
-        tr = float(np.mean(tr_losses))
-        va = float(np.mean(va_losses))
+            eval_step(xb, yb)
 
-        # Extra sanity metrics
-        mu_val, log_var_val = model(X_val_s, training=False)
-        mu_val = mu_val.numpy().reshape(-1)
-        sigma_val = np.sqrt(np.exp(log_var_val.numpy().reshape(-1)))
-        mae = float(np.mean(np.abs(y_val.reshape(-1) - mu_val)))
+        tr = float(train_nll.result())
+        va = float(val_nll.result())
+        mae = float(val_mae.result())
+        history.append({"epoch": epoch, "train_nll": tr, "val_nll": va, "val_mae": mae})
 
-        print(f"epoch {epoch:02d} train_nll={tr:.4f} val_nll={va:.4f} val_mae={mae:.4f} sigma_med={np.median(sigma_val):.3f}")
+        if verbose:
+            print(f"epoch {epoch:02d} train_nll={tr:.4f} val_nll={va:.4f} val_mae={mae:.4f} sigma_mean={float(val_sigma.result()):.3f}")
 
         if va < best_val - 1e-4:
             best_val = va
             bad = 0
-            model.save(os.path.join(MODEL_DIR, f"{MODEL_VERSION}.keras"))
+            best_weights = model.get_weights()
         else:
             bad += 1
             if bad >= patience:
-                print("early stopping")
+                if verbose:
+                    print("early stopping")
                 break
 
-    # Save scaler and feature list
-    joblib.dump(scaler, os.path.join(MODEL_DIR, f"{MODEL_VERSION}_scaler.joblib"))
-    with open(os.path.join(MODEL_DIR, f"{MODEL_VERSION}_features.json"), "w") as f:
+    if best_weights is not None:
+        model.set_weights(best_weights)
+    return model, history
+
+
+def benchmark(n_rows=200_000, epochs=3, batch_size=BATCH_SIZE):
+    # Samples/second of the training engine on synthetic data (no database needed)
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((n_rows, len(FEATURES))).astype(np.float32)
+    y = (15.0 + 5.0 * X[:, :1] + rng.standard_normal((n_rows, 1)) * 6.0).astype(np.float32)
+    n_val = n_rows // 5
+
+    print(f"devices: {[d.device_type for d in tf.config.list_physical_devices()]}")
+    t0 = time.perf_counter()
+    _, history = train(X[n_val:], y[n_val:], X[:n_val], y[:n_val], epochs=epochs,
+                       batch_size=batch_size, patience=epochs + 1, seed=0, verbose=False)
+    dt = time.perf_counter() - t0
+
+    samples = len(history) * (n_rows - n_val)
+    print(f"{samples} training samples in {dt:.2f}s -> {samples / dt:,.0f} samples/s "
+          f"(batch_size={batch_size}, epochs={len(history)}, includes tracing and validation)")
+    return samples / dt
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--learning-rate", type=float, default=LEARNING_RATE)
+    parser.add_argument("--patience", type=int, default=PATIENCE)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--version", help="model version to register (default: the next vN_hetero_nll)")
+    parser.add_argument("--promote", action="store_true", help="make it the champion right away")
+    parser.add_argument("--no-shadow", action="store_true", help="register it without shadow-scoring it nightly")
+    parser.add_argument("--refresh-data", action="store_true", help="re-export the training set even if unchanged")
+    parser.add_argument("--benchmark", action="store_true", help="time the training engine on synthetic data and exit")
+    parser.add_argument("--bench-rows", type=int, default=200_000)
+    parser.add_argument("--bench-epochs", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.bench_rows, args.bench_epochs, args.batch_size)
+        return
+
+    from src.registry import REGISTRY_DIR, artifact_paths, next_version, register
+
+    version = args.version or next_version()
+    paths = artifact_paths(version)
+    os.makedirs(REGISTRY_DIR, exist_ok=True)
+
+    # Training rows come from the materialized cache (re-exported only when the data changed)
+    from src.db import get_engine
+    from src.train_cache import load_training_set, materialize, time_split_index
+
+    path = materialize(get_engine(), FEATURES, TARGETS, refresh=args.refresh_data)
+    X_all, y_all, dates, index = load_training_set(path)
+    split = time_split_index(dates)
+
+    # prefix/suffix slices of the memmaps, nothing is copied until scaling
+    X_train, X_val = X_all[:split], X_all[split:]
+    y_train, y_val = y_all[:split], y_all[split:]
+
+    # Scale inputs
+    scaler = StandardScaler()
+    X_train_s = scaler.fit_transform(X_train).astype(np.float32)
+    X_val_s = scaler.transform(X_val).astype(np.float32)
+
+    model, history = train(
+        X_train_s, y_train, X_val_s, y_val,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        learning_rate=args.learning_rate,
+        patience=args.patience,
+        seed=args.seed,
+    )
+
+    # Save the best-epoch model, scaler, feature list and output stats
+    model.save(paths["model"])
+    joblib.dump(scaler, paths["scaler"])
+    with open(paths["features"], "w") as f:
         json.dump(FEATURES, f, indent=2)
+    with open(paths["stats"], "w") as f:
+        json.dump(TARGET_STATS, f, indent=2)
 
-    # Quick final sanity check on a few predictions
-    mu_all, log_var_all = model(scaler.transform(df[FEATURES].astype(float).values), training=False)
-    mu_all = mu_all.numpy().reshape(-1)
-    sigma_all = np.sqrt(np.exp(log_var_all.numpy().reshape(-1)))
+    # Flat weights + scaler for the TensorFlow-free scoring backend
+    export_npz(model, scaler, FEATURES, paths["npz"], stats=TARGET_STATS)
 
-    print("saved:", MODEL_VERSION)
-    print("mu range:", float(np.min(mu_all)), float(np.max(mu_all)))
-    print("sigma range:", float(np.min(sigma_all)), float(np.max(sigma_all)))
+    # Quick final sanity check on a few predictions
+    mu_all, log_var_all = model(scaler.transform(X_all).astype(np.float32), training=False)
+    mu_all = mu_all.numpy()
+    sigma_all = np.sqrt(np.exp(log_var_all.numpy()))
+
+    print("saved:", version)
+    for j, stat in enumerate(TARGET_STATS):
+        print(f"{stat}: mu range {float(np.min(mu_all[:, j])):.2f}..{float(np.max(mu_all[:, j])):.2f}, "
+              f"sigma range {float(np.min(sigma_all[:, j])):.2f}..{float(np.max(sigma_all[:, j])):.2f}")
+
+    # Confidence normalizers for the scorers: mean (clamped) sigma per stat on the validation
+    # split. python -m src.backtest --write-normalizer replaces the points one with a
+    # walk-forward estimate.
+    from src.distribution import clamp_sigma, save_avg_sigma
+
+    avg_sigma = {
+        stat: float(clamp_sigma(stat, sigma_all[split:, j]).mean())
+        for j, stat in enumerate(TARGET_STATS)
+    }
+    save_avg_sigma(paths["calibration"], avg_sigma["pts"],
+                   avg_sigma_by_stat={s: v for s, v in avg_sigma.items() if s != "pts"},
+                   source="train_model validation split", rows=int(len(sigma_all) - split))
+    print("confidence normalizers (mean val sigma):", {s: round(v, 3) for s, v in avg_sigma.items()})
+
+    # Register the version: a new model is shadow-scored next to the champion until promoted
+    # (python -m src.registry promote <version>); the first one becomes the champion
+    best = min(history, key=lambda h: h["val_nll"])
+    metrics = {
+        "val_nll": round(best["val_nll"], 4),
+        "val_mae": round(best["val_mae"], 4),
+        "best_epoch": best["epoch"],
+        "train_rows": int(split),
+        "val_rows": int(len(y_all) - split),
+        "data_version": index["version"],
+        "avg_sigma": {s: round(v, 4) for s, v in avg_sigma.items()},
+        "config": {"epochs": args.epochs, "batch_size": args.batch_size, "learning_rate": args.learning_rate,
+                   "patience": args.patience, "seed": args.seed},
+    }
+    manifest = register(version, metrics, champion=args.promote, challenger=not args.no_shadow)
+    role = "champion" if manifest["champion"] == version else ("challenger" if version in manifest["challengers"] else "registered")
+    print(f"registered {version} ({role}, hash {manifest['versions'][version]['hash']})")
 
 if __name__ == "__main__":
     main()
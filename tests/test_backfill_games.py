@@ -0,0 +1,9 @@
+from datetime import date
+
+from src.backfill_games import backfill
+
+
+def test_empty_range(capsys):
+    # end before start: returns before touching the database
+    backfill(None, date(2025, 1, 2), date(2025, 1, 1))
+    assert "nothing to do" in capsys.readouterr().out
@@ -0,0 +1,59 @@
+import numpy as np
+from scipy.integrate import trapezoid
+from scipy.stats import norm
+
+from src.backtest import PIT_BINS, evaluate, row_metrics
+from src.distribution import CONF_THRESHOLDS
+
+
+def calibrated_sample(n=200_000, seed=0):
+    # integer outcomes drawn from the forecast itself: a calibrated model by construction
+    rng = np.random.default_rng(seed)
+    mu = rng.uniform(8, 30, n)
+    sigma = rng.uniform(3, 9, n)
+    y = np.round(rng.normal(mu, sigma))
+    return y, mu, sigma
+
+
+def test_row_metrics_closed_forms():
+    y, mu, sigma = np.array([20.0, 12.0]), np.array([18.0, 15.0]), np.array([5.0, 3.0])
+    m = row_metrics(y, mu, sigma)
+    np.testing.assert_allclose(m["nll"], -norm.logpdf(y, mu, sigma))
+    np.testing.assert_allclose(m["mae"], [2.0, 3.0])
+    # CRPS of a normal forecast, checked against numerical integration of (F - 1{x >= y})^2
+    x = np.linspace(-60, 100, 400_001)
+    for i in range(2):
+        f = norm.cdf(x, mu[i], sigma[i]) - (x >= y[i])
+        np.testing.assert_allclose(m["crps"][i], trapezoid(f ** 2, x), rtol=1e-4)
+
+
+def test_evaluate_calibrated_model():
+    y, mu, sigma = calibrated_sample()
+    folds = np.arange(len(y)) % 4
+    overall, per_fold, pit_hist, reliability = evaluate(y, mu, sigma, folds, 4)
+
+    assert len(pit_hist) == PIT_BINS
+    np.testing.assert_allclose(pit_hist, 1.0 / PIT_BINS, atol=0.005)
+    assert overall["pit_dev"] < 0.03
+    for c in (50, 80, 90):
+        assert abs(overall[f"cov{c}"] - c / 100) < 0.01
+    for k in CONF_THRESHOLDS:
+        assert overall[f"ece{k}"] < 0.01
+        for row in reliability[str(k)]:
+            if row["n"] > 2000:
+                assert abs(row["mean_p"] - row["hit_rate"]) < 0.02
+
+    assert list(per_fold["rows"]) == [len(y) // 4] * 4
+    np.testing.assert_allclose(per_fold["nll"].mean(), overall["nll"], rtol=1e-9)
+    np.testing.assert_allclose(overall["avg_sigma"], sigma.mean())
+
+
+def test_evaluate_flags_overconfident_model():
+    y, mu, sigma = calibrated_sample()
+    folds = np.zeros(len(y), dtype=int)
+    good, _, _, _ = evaluate(y, mu, sigma, folds, 1)
+    narrow, _, _, _ = evaluate(y, mu, sigma * 0.5, folds, 1)
+
+    assert narrow["nll"] > good["nll"]
+    assert narrow["pit_dev"] > 5 * good["pit_dev"]
+    assert narrow["cov80"] < 0.6
@@ -0,0 +1,87 @@
+import pandas as pd
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from src.bench.synth import generate, load
+from src.build_features import build_features, get_watermark
+from src.bulk_load import bulk_upsert
+from src.db import INGEST_APP, open_writer_cap, tag_transaction
+
+KEYS = ["as_of_date", "game_id", "player_id"]
+
+
+def features(engine):
+    return pd.read_sql("SELECT * FROM player_features_daily", engine).sort_values(KEYS, ignore_index=True)
+
+
+def test_incremental_matches_full_rebuild(pg_engine):
+    teams, players, games, stats = generate(n_teams=4, players_per_team=6, seed=3)
+    days = sorted(games["game_date"].unique())
+    day_of = stats["game_id"].map(games.set_index("game_id")["game_date"])
+    early, late_a, late_b = stats[day_of < days[-2]], stats[day_of == days[-2]], stats[day_of == days[-1]]
+    load(pg_engine, teams, players, games, early)
+    n_early = build_features(pg_engine, incremental=False)
+
+    # an untagged session idling in a transaction must not hold the watermark back
+    idle = pg_engine.connect()
+    idle.begin()
+    idle.execute(text("SELECT 1"))
+
+    # an ingest still open while a later one commits: its rows carry the older ingested_ts
+    ingest = pg_engine.connect()
+    ingest.begin()
+    tag_transaction(ingest, INGEST_APP)
+    started = ingest.execute(text("SELECT NOW()::timestamp")).scalar()
+    bulk_upsert(ingest, "player_game_stats", late_a, ["game_id", "player_id"], on_conflict="nothing")
+    load(pg_engine, teams.iloc[:0], players.iloc[:0], games.iloc[:0], late_b)
+    try:
+        build_features(pg_engine, incremental=True)
+        with pg_engine.connect() as conn:
+            assert get_watermark(conn) == started - pd.Timedelta(microseconds=1)
+        ingest.commit()
+    finally:
+        ingest.close()
+        idle.close()
+
+    build_features(pg_engine, incremental=True)
+    incremental = features(pg_engine)
+    build_features(pg_engine, incremental=False)
+    full = features(pg_engine)
+    assert len(incremental) > n_early
+    # atol: the EW std of a flat history is 0 up to float noise, either way round
+    pd.testing.assert_frame_equal(incremental, full, check_exact=False, rtol=1e-5, atol=1e-5)
+
+
+def test_hidden_writer_fails_loudly(pg_engine):
+    with pg_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        try:
+            conn.exec_driver_sql("DROP ROLE IF EXISTS nba_test_reader")
+            conn.exec_driver_sql("CREATE ROLE nba_test_reader")
+        except ProgrammingError:
+            pytest.skip("needs CREATEROLE")
+    try:
+        with pg_engine.connect() as writer, pg_engine.connect() as reader:
+            writer.begin()
+            tag_transaction(writer, INGEST_APP)
+            assert open_writer_cap(reader, INGEST_APP) is not None
+            reader.exec_driver_sql("SET ROLE nba_test_reader")
+            with pytest.raises(RuntimeError, match="pg_read_all_stats"):
+                open_writer_cap(reader, INGEST_APP)
+            reader.exec_driver_sql("RESET ROLE")
+    finally:
+        with pg_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("DROP ROLE IF EXISTS nba_test_reader")
+
+
+def test_no_missing_opponent_features(pg_engine):
+    # a team's first games have no points allowed / pace yet; those rows are not written.
+    # One team starts a month late, so its first opponents' players already have history.
+    teams, players, games, stats = generate(n_teams=4, players_per_team=6, seed=3)
+    late = teams["team_id"].iloc[0]
+    start = games["game_date"].min() + pd.Timedelta(days=30)
+    skip = ((games["home_team_id"] == late) | (games["away_team_id"] == late)) & (games["game_date"] < start)
+    load(pg_engine, teams, players, games[~skip], stats[~stats["game_id"].isin(games.loc[skip, "game_id"])])
+    assert build_features(pg_engine, incremental=False) > 0
+    df = features(pg_engine)
+    assert not df[["opp_pts_allowed_10", "opp_pts_allowed_tier_10", "opp_pace_10", "team_pace_10"]].isna().any().any()
@@ -0,0 +1,87 @@
+import pandas as pd
+import pytest
+
+from src.bulk_load import LoadResult, bulk_upsert, conflict_clause
+
+TABLES_SQL = """
+CREATE TABLE kv (k INTEGER PRIMARY KEY, v INTEGER, note TEXT);
+CREATE TABLE kv_part (d DATE NOT NULL, k INTEGER, v INTEGER, note TEXT, PRIMARY KEY (d, k))
+  PARTITION BY RANGE (d);
+CREATE TABLE kv_part_2025 PARTITION OF kv_part FOR VALUES FROM ('2025-01-01') TO ('2026-01-01');
+"""
+
+
+def test_conflict_clause():
+    cols = ["k", "v", "note"]
+    assert conflict_clause(cols, ["k"]) == "DO UPDATE SET v = EXCLUDED.v, note = EXCLUDED.note"
+    assert conflict_clause(cols, ["k"], ["v"], update_where="kv.v < EXCLUDED.v") == \
+        "DO UPDATE SET v = EXCLUDED.v WHERE kv.v < EXCLUDED.v"
+    assert conflict_clause(cols, ["k"], [], extra_set="note = 'x'") == "DO UPDATE SET note = 'x'"
+    assert conflict_clause(cols, ["k"], on_conflict="nothing") == "DO NOTHING"
+    # nothing to assign: "DO UPDATE SET" alone would be a syntax error
+    assert conflict_clause(cols, ["k"], []) == "DO NOTHING"
+    assert conflict_clause(["k"], ["k"]) == "DO NOTHING"
+
+
+def test_bad_on_conflict():
+    with pytest.raises(ValueError):
+        bulk_upsert(None, "kv", pd.DataFrame({"k": [1]}), ["k"], on_conflict="replace")
+
+
+@pytest.fixture
+def engine(pg_engine):
+    with pg_engine.begin() as conn:
+        conn.exec_driver_sql(TABLES_SQL)
+    return pg_engine
+
+
+def frame(keys, v, partitioned=False):
+    df = pd.DataFrame({"k": keys, "v": v, "note": "n"})
+    if partitioned:
+        df.insert(0, "d", "2025-03-01")
+    return df
+
+
+def rows(engine, table):
+    with engine.connect() as conn:
+        return dict(conn.exec_driver_sql(f"SELECT k, v FROM {table} ORDER BY k").fetchall())
+
+
+@pytest.mark.parametrize("table,partitioned", [("kv", False), ("kv_part", True)])
+def test_counts(engine, table, partitioned):
+    keys = ["d", "k"] if partitioned else ["k"]
+    with engine.begin() as conn:
+        assert bulk_upsert(conn, table, frame([1, 2, 3], [1, 1, 1], partitioned), keys) == LoadResult(3, 3, 0, 0)
+    with engine.begin() as conn:
+        # 2 and 3 exist, 4 is new; duplicate keys in the frame collapse to one row
+        res = bulk_upsert(conn, table, frame([2, 3, 4, 4], [5, 5, 5, 5], partitioned), keys)
+    assert res == LoadResult(4, 1, 2, 1)
+    assert rows(engine, table) == {1: 1, 2: 5, 3: 5, 4: 5}
+
+    with engine.begin() as conn:
+        res = bulk_upsert(conn, table, frame([1, 5], [9, 9], partitioned), keys, on_conflict="nothing")
+    assert res == LoadResult(2, 1, 0, 1)
+    with engine.begin() as conn:
+        res = bulk_upsert(conn, table, frame([1, 6], [9, 9], partitioned), keys, update_cols=[])
+    assert res == LoadResult(2, 1, 0, 1)
+    assert rows(engine, table) == {1: 1, 2: 5, 3: 5, 4: 5, 5: 9, 6: 9}
+
+
+def test_where_and_update_where(engine):
+    with engine.begin() as conn:
+        bulk_upsert(conn, "kv", frame([1, 2], [5, 5]), ["k"])
+    with engine.begin() as conn:
+        # k=3 filtered out before the merge, k=1 only updated when v grows
+        res = bulk_upsert(conn, "kv", frame([1, 2, 3], [4, 6, 6]), ["k"], update_cols=["v"],
+                          where="k < 3", update_where="kv.v < EXCLUDED.v")
+    assert res == LoadResult(3, 0, 1, 2)
+    assert rows(engine, "kv") == {1: 5, 2: 6}
+
+
+def test_extra_set(engine):
+    with engine.begin() as conn:
+        bulk_upsert(conn, "kv", frame([1], [1]), ["k"])
+        res = bulk_upsert(conn, "kv", frame([1], [2]), ["k"], update_cols=[], extra_set="note = 'touched'")
+        note = conn.exec_driver_sql("SELECT note FROM kv WHERE k = 1").scalar()
+    assert res == LoadResult(1, 0, 1, 0)
+    assert note == "touched"
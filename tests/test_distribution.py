@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from scipy.stats import norm
+
+from src.distribution import (
+    STATS, clamp_sigma, points_pmf, prediction_columns, probs_ge, probs_ge_from_pmf, stat_columns, threshold_label,
+)
+
+
+def test_probs_ge_continuity_correction():
+    mu = np.array([18.0, 25.0, 31.5])
+    sigma = np.array([5.0, 6.0, 8.0])
+    probs = probs_ge(mu, sigma, [20, 22.5, 30])
+
+    # integer line k -> P(X >= k - 0.5); 22.5 means 23+
+    expected = np.column_stack([
+        norm.sf(19.5, mu, sigma),
+        norm.sf(22.5, mu, sigma),
+        norm.sf(29.5, mu, sigma),
+    ])
+    assert probs.shape == (3, 3)
+    np.testing.assert_allclose(probs, expected, rtol=1e-10)
+
+
+def test_probs_ge_decreasing_in_threshold():
+    probs = probs_ge(np.linspace(5, 35, 7), np.full(7, 6.0), [10, 15, 20, 25, 30])
+    assert (np.diff(probs, axis=1) < 0).all()
+
+
+def test_probs_ge_zero_sigma_is_a_step():
+    probs = probs_ge([20.0, 20.0], [0.0, 0.0], [20, 21])
+    np.testing.assert_allclose(probs, [[1.0, 0.0], [1.0, 0.0]])
+
+
+def test_pmf_sums_to_one_and_matches_probs_ge():
+    mu = np.array([3.0, 22.0, 60.0])
+    sigma = np.array([4.0, 6.5, 12.0])
+    pmf = points_pmf(mu, sigma)
+    np.testing.assert_allclose(pmf.sum(axis=1), 1.0)
+    # the lines above 0 (mass below 0 is folded into 0) read the same off the PMF
+    thresholds = [15, 20, 25, 30]
+    np.testing.assert_allclose(probs_ge_from_pmf(pmf, thresholds), probs_ge(mu, sigma, thresholds), atol=1e-12)
+
+
+@pytest.mark.parametrize("stat", list(STATS))
+def test_stat_columns_match_prediction_columns(stat):
+    mu, sigma = np.array([1.0, 5.0]), np.array([1.0, 2.0])
+    cols = stat_columns(stat, mu, sigma)
+    assert list(cols) == prediction_columns([stat])
+    for k in STATS[stat]["conf_thresholds"]:
+        prefix = "" if stat == "pts" else f"{stat}_"
+        p = cols[f"{prefix}p{threshold_label(k)}"] if k in STATS[stat]["thresholds"] else probs_ge(mu, sigma, [k])[:, 0]
+        np.testing.assert_allclose(cols[f"{prefix}conf{threshold_label(k)}"],
+                                   100.0 * p * STATS[stat]["avg_sigma"] / sigma)
+
+
+def test_threshold_label():
+    assert threshold_label(20) == "20"
+    assert threshold_label(22.5) == "22_5"
+
+
+@pytest.mark.parametrize("stat", list(STATS))
+def test_clamp_sigma_per_stat(stat):
+    lo, hi = STATS[stat]["sigma_min"], STATS[stat]["sigma_max"]
+    sigma = np.array([0.0, lo / 2, lo, (lo + hi) / 2, hi, hi * 3])
+    np.testing.assert_array_equal(clamp_sigma(stat, sigma), [lo, lo, lo, (lo + hi) / 2, hi, hi])
+
+
+def test_clamp_sigma_floors_differ():
+    # a threes sigma of 0.4 is plausible, a points sigma of 0.4 is not
+    assert clamp_sigma("fg3m", 0.4) == 0.4
+    assert clamp_sigma("pts", 0.4) == STATS["pts"]["sigma_min"]
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+from src.bench.synth import generate, load
+from src.build_features import build_features
+from src.ewma import HALF_LIVES, STATS, ew_pass, feature_columns
+
+
+def make_logs(seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for player_id, n_games in ((1, 25), (2, 1), (3, 12)):
+        dates = pd.date_range("2025-10-21", periods=n_games, freq="2D")
+        for i, d in enumerate(dates):
+            rows.append({
+                "player_id": player_id,
+                "game_id": f"{player_id:03d}{i:04d}",
+                "game_date": d.date(),
+                "points": float(rng.integers(0, 40)),
+                "minutes": float(rng.uniform(5, 40)),
+            })
+    logs = pd.DataFrame(rows)
+    logs.loc[5, "minutes"] = np.nan  # a missing stat decays the others but adds nothing
+    return logs
+
+
+def pandas_ew(logs, column, half_life):
+    # Pre-game EW mean / std: pandas ewm over each player's earlier games
+    g = logs.groupby("player_id")[column]
+    mean = g.transform(lambda s: s.ewm(halflife=half_life).mean().shift())
+    std = g.transform(lambda s: s.ewm(halflife=half_life).std().shift())
+    return mean, std
+
+
+def test_ew_pass_matches_pandas_ewm():
+    logs = make_logs()
+    feats, _ = ew_pass(logs)
+    assert len(feats) == len(logs)
+    for h in HALF_LIVES:
+        for s, column in STATS:
+            mean, std = pandas_ew(logs, column, h)
+            np.testing.assert_allclose(feats[f"ew_{s}_mean_{h}"], mean, rtol=1e-9, atol=1e-9)
+            np.testing.assert_allclose(feats[f"ew_{s}_std_{h}"], std, rtol=1e-7, atol=1e-7)
+
+
+def test_ew_pass_first_game_has_no_history():
+    feats, _ = ew_pass(make_logs())
+    first = feats.groupby("player_id").head(1)
+    assert first.filter(like="ew_").isna().all().all()
+
+
+def test_ew_pass_resumes_from_state():
+    logs = make_logs()
+    full, full_states = ew_pass(logs)
+
+    cut = logs.groupby("player_id").cumcount() < 8
+    _, states = ew_pass(logs[cut].reset_index(drop=True))
+    rest, rest_states = ew_pass(logs[~cut].reset_index(drop=True), states)
+
+    np.testing.assert_allclose(
+        rest.drop(columns=["game_id", "player_id"]).to_numpy(),
+        full[~cut.to_numpy()].drop(columns=["game_id", "player_id"]).to_numpy(),
+        rtol=1e-9, atol=1e-9,
+    )
+    for p, st in full_states.items():
+        resumed = rest_states.get(p, states.get(p))
+        assert resumed.n_games == st.n_games
+        assert resumed.last_game_id == st.last_game_id
+        np.testing.assert_allclose(resumed.sums, st.sums, rtol=1e-9)
+
+
+def test_ew_pass_empty():
+    feats, states = ew_pass(make_logs().iloc[:0])
+    assert feats.empty and states == {}
+
+
+def test_build_skips_rows_without_ew_std(pg_engine):
+    # minutes missing from a player's first game: two games in, the EW minutes std still has
+    # a single observation while the rolling columns are already defined
+    teams, players, games, stats = generate(n_teams=2, players_per_team=5, seed=1)
+    pid = stats["player_id"].iloc[0]
+    stats.loc[stats.index[stats["player_id"] == pid][0], "minutes"] = np.nan
+    load(pg_engine, teams, players, games, stats)
+    assert build_features(pg_engine, incremental=False) > 0
+    df = pd.read_sql("SELECT * FROM player_features_daily", pg_engine)
+    assert not df[feature_columns()].isna().any().any()
+    assert (df["player_id"] == pid).any()
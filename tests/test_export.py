@@ -0,0 +1,57 @@
+import csv
+import json
+import os
+from datetime import date
+
+import pandas as pd
+from sqlalchemy import text
+
+from src.bulk_load import bulk_upsert
+from src.db import SCORE_APP, tag_transaction
+from src.export import export_predictions
+from src.partitions import ensure_partitions
+from src.score_today import write_predictions
+
+DAYS = [date(2025, 3, 1), date(2025, 3, 2), date(2025, 3, 3)]
+
+
+def predictions(day):
+    return pd.DataFrame({"as_of_date": day.isoformat(), "game_id": "0022400001", "player_id": [1, 2],
+                         "mu_pts": 20.0, "sigma_pts": 5.0, "conf20": 0.5, "model_version": "v1"})
+
+
+def history_dates(out_dir):
+    with open(os.path.join(out_dir, "nba_points_history.csv"), newline="") as f:
+        return [row["as_of_date"] for row in csv.DictReader(f)]
+
+
+def test_watermark_waits_for_open_scoring_run_only(pg_engine, tmp_path):
+    with pg_engine.begin() as conn:
+        conn.execute(text("INSERT INTO players VALUES (1, 'A'), (2, 'B')"))
+        # up front: creating a partition inside the open run would block the other writer
+        ensure_partitions(conn, "predictions_daily", DAYS)
+    # an untagged session idling in a transaction from before the first scoring run
+    idle = pg_engine.connect()
+    idle.begin()
+    idle.execute(text("SELECT 1"))
+
+    write_predictions(pg_engine, predictions(DAYS[0]))
+    scoring = pg_engine.connect()
+    scoring.begin()
+    tag_transaction(scoring, SCORE_APP)
+    started = scoring.execute(text("SELECT NOW()::timestamp")).scalar()
+    bulk_upsert(scoring, "predictions_daily", predictions(DAYS[1]), ["as_of_date", "game_id", "player_id"])
+    write_predictions(pg_engine, predictions(DAYS[2]))
+    try:
+        assert export_predictions(pg_engine, out_dir=str(tmp_path)) == 4
+        with open(tmp_path / "manifest.json") as f:
+            assert json.load(f)["watermark_ts"] == str(started - pd.Timedelta(microseconds=1))
+        scoring.commit()
+    finally:
+        scoring.close()
+        idle.close()
+
+    # the late run is picked up; DAYS[2] is rewritten but not appended to the history again
+    assert export_predictions(pg_engine, out_dir=str(tmp_path)) == 4
+    assert export_predictions(pg_engine, out_dir=str(tmp_path)) == 0
+    assert sorted(history_dates(str(tmp_path))) == sorted(d.isoformat() for d in DAYS for _ in range(2))
@@ -0,0 +1,113 @@
+import time
+
+import pandas as pd
+import pytest
+import requests
+
+from src.fake_nba_api import BoxScoreTraditionalV3, FakeServer, fake_game_ids
+from src.fetch import TokenBucket, call_with_retry, fetch_many
+
+
+def fetch_fn(server):
+    return lambda gid: BoxScoreTraditionalV3(gid, server=server).get_data_frames()[0]
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=20.0, capacity=2)
+    t0 = time.monotonic()
+    for _ in range(10):
+        bucket.acquire()
+    # the burst of 2 is free, the other 8 tokens refill at 20/s
+    assert time.monotonic() - t0 >= 8 / 20.0 - 0.02
+
+
+def test_token_bucket_rejects_bad_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_fetch_many_under_server_limit():
+    server = FakeServer(latency=0.01, jitter=0.0, max_per_second=10.0)
+    game_ids = fake_game_ids(12)
+    results, errors = fetch_many(game_ids, fetch_fn(server), limiter=TokenBucket(rate=8.0, capacity=2),
+                                 max_workers=4)
+
+    assert errors == {}
+    assert sorted(results) == game_ids
+    assert server.throttled == 0
+    df = results[game_ids[0]]
+    assert isinstance(df, pd.DataFrame)
+    assert (df["gameId"] == game_ids[0]).all()
+    assert {"reboundsTotal", "assists", "threePointersMade"} <= set(df.columns)
+
+
+def test_call_with_retry_recovers_from_throttling():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise requests.exceptions.ReadTimeout("throttled")
+        return "ok"
+
+    assert call_with_retry(flaky, max_retries=4, backoff_base=0.001) == "ok"
+    assert len(calls) == 3
+
+
+def test_call_with_retry_gives_up_after_max_retries():
+    calls = []
+
+    def always_throttled():
+        calls.append(1)
+        raise requests.exceptions.ReadTimeout("throttled")
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        call_with_retry(always_throttled, max_retries=2, backoff_base=0.001)
+    assert len(calls) == 3
+
+
+def test_call_with_retry_does_not_retry_other_errors():
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError("bad payload")
+
+    with pytest.raises(ValueError):
+        call_with_retry(broken, max_retries=4, backoff_base=0.001)
+    assert len(calls) == 1
+
+
+def test_fetch_many_retries_throttled_requests():
+    # no client-side limit against a server that allows 3 requests/s: some calls time out
+    # and go through the backoff, and every game still arrives
+    server = FakeServer(latency=0.01, jitter=0.0, max_per_second=3.0)
+    game_ids = fake_game_ids(6)
+    results, errors = fetch_many(game_ids, fetch_fn(server), limiter=TokenBucket(rate=1000.0, capacity=100),
+                                 max_workers=6, max_retries=8)
+
+    assert errors == {}
+    assert sorted(results) == game_ids
+    assert server.throttled > 0
+    assert server.calls == len(game_ids) + server.throttled
+
+
+def test_fetch_many_collects_errors():
+    server = FakeServer(latency=0.0, jitter=0.0, max_per_second=100.0)
+    fetch = fetch_fn(server)
+
+    def fetch_or_fail(gid):
+        if gid.endswith("3"):
+            raise KeyError(f"no boxscore for {gid}")
+        return fetch(gid)
+
+    game_ids = fake_game_ids(5)
+    results, errors = fetch_many(game_ids, fetch_or_fail, limiter=TokenBucket(rate=100.0, capacity=10))
+
+    assert sorted(errors) == [game_ids[3]]
+    assert isinstance(errors[game_ids[3]], KeyError)
+    assert sorted(results) == [g for g in game_ids if g != game_ids[3]]
+
+
+def test_fetch_many_empty():
+    assert fetch_many([], lambda k: k) == ({}, {})
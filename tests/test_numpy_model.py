@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.numpy_model import NumpyHeteroModel
+
+ARTIFACTS = os.path.join("artifacts", "v1_hetero_nll")
+
+
+@pytest.mark.skipif(not os.path.exists(f"{ARTIFACTS}.npz"), reason="no v1 artifacts")
+def test_matches_keras_on_v1_artifacts():
+    tf = pytest.importorskip("tensorflow")
+    import joblib
+
+    np_model = NumpyHeteroModel.load(f"{ARTIFACTS}.npz")
+    keras_model = tf.keras.models.load_model(f"{ARTIFACTS}.keras", compile=False)
+    scaler = joblib.load(f"{ARTIFACTS}_scaler.joblib")
+    assert np_model.stats == ["pts"]
+
+    # feature rows around the training distribution, a few far outside it to reach the clip
+    rng = np.random.default_rng(0)
+    X = scaler.mean_ + scaler.scale_ * rng.normal(size=(2000, len(np_model.features)))
+    X[:20] *= 8.0
+
+    Xs = np_model.transform(X)
+    np.testing.assert_allclose(Xs, scaler.transform(X).astype(np.float32), rtol=1e-6, atol=1e-6)
+    mu, log_var = np_model.forward(Xs)
+    k_mu, k_log_var = (np.asarray(o).reshape(len(X), -1) for o in keras_model(Xs, training=False))
+    # a few 1e-6 apart at typical values; rtol covers float32 rounding of the far-out mu
+    np.testing.assert_allclose(mu, k_mu, rtol=1e-6, atol=1e-5)
+    np.testing.assert_allclose(log_var, k_log_var, rtol=1e-6, atol=1e-5)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import norm
+
+from src.parlay import Leg, SlateSimulator, parse_leg, standard_normals
+
+
+def slate(rows):
+    return pd.DataFrame(rows, columns=["game_id", "player_id", "team_id", "mu_pts", "sigma_pts"])
+
+
+def over_prob(mu, sigma, line):
+    # closed form with the simulator's continuity correction (25 means 25+ points)
+    return norm.sf((np.ceil(line) - 0.5 - mu) / sigma)
+
+
+@pytest.mark.parametrize("method", ["sobol", "antithetic", "mc"])
+def test_independent_legs_match_closed_form(method):
+    # two players of one game with zero correlation, and a third in another game
+    s = slate([("g1", 1, 10, 20.0, 6.0), ("g1", 2, 11, 12.0, 4.0), ("g2", 3, 12, 25.0, 7.0)])
+    sim = SlateSimulator(s, np.eye(3), n_samples=2 ** 15, method=method)
+    legs = [Leg(1, 22, True), Leg(2, 10, True), Leg(3, 20, False)]
+    expected = [over_prob(20, 6, 22), over_prob(12, 4, 10), 1 - over_prob(25, 7, 20)]
+    for leg, p in zip(legs, expected):
+        assert sim.marginal(leg) == pytest.approx(p, abs=8e-3)
+    board = sim.evaluate([legs])
+    assert board.at[0, "p_joint"] == pytest.approx(np.prod(expected), abs=5e-3)
+    for pair in ([legs[0], legs[1]], [legs[0], legs[2]], [legs[1], legs[2]]):
+        assert sim.evaluate([pair]).at[0, "corr_lift"] == pytest.approx(1.0, abs=0.05)
+
+
+def test_correlated_teammates_lift_the_joint():
+    s = slate([("g1", 1, 10, 20.0, 6.0), ("g1", 2, 10, 20.0, 6.0)])
+    corr = np.array([[1.0, 0.5], [0.5, 1.0]])
+    board = SlateSimulator(s, corr).evaluate([[Leg(1, 25, True), Leg(2, 25, True)]])
+    assert board.at[0, "corr_lift"] > 1.3
+
+
+@pytest.mark.parametrize("n_samples", [1, 63, 65, 100])
+def test_bit_padding_never_counts(n_samples):
+    # hit vectors are padded to whole 64-bit words; the padding must stay zero
+    s = slate([("g1", 1, 10, 20.0, 6.0)])
+    sim = SlateSimulator(s, np.eye(1), n_samples=n_samples, method="mc")
+    assert sim.marginal(Leg(1, -100, True)) == 1.0
+    assert sim.marginal(Leg(1, -100, False)) == 0.0
+    assert sim.marginal(Leg(1, 20, True)) + sim.marginal(Leg(1, 20, False)) == 1.0
+    assert all(len(b) == -(-n_samples // 64) for b in sim._bits)
+
+
+def test_antithetic_rounds_odd_counts_up():
+    Z = standard_normals(101, 3, "antithetic")
+    assert Z.shape == (102, 3)
+    np.testing.assert_array_equal(Z[:51], -Z[51:])
+    sim = SlateSimulator(slate([("g1", 1, 10, 20.5, 6.0)]), np.eye(1), n_samples=101, method="antithetic")
+    assert sim.n_samples == 102
+    # symmetric draws: a cut at the mean (21+ points, i.e. >= 20.5) splits them exactly in half
+    assert sim.marginal(Leg(1, 21, True)) == 0.5
+
+
+def test_player_with_several_games():
+    s = slate([("g1", 1, 10, 10.0, 3.0), ("g2", 1, 10, 30.0, 3.0), ("g2", 2, 11, 15.0, 3.0)])
+    sim = SlateSimulator(s, np.eye(3))
+    with pytest.raises(ValueError, match="give the leg a game_id"):
+        sim.marginal(Leg(1, 20, True))
+    assert sim.marginal(Leg(1, 20, True, "g1")) < 0.01
+    assert sim.marginal(Leg(1, 20, True, "g2")) > 0.99
+    assert sim.marginal(Leg(2, 20, False)) > 0.9
+    with pytest.raises(KeyError):
+        sim.marginal(Leg(2, 20, True, "g1"))
+
+
+def test_parse_leg():
+    assert parse_leg("203999>=25") == Leg(203999, 25.0, True)
+    assert parse_leg(" 203999 < 10 ") == Leg(203999, 10.0, False)
+    assert parse_leg("0022400123:203999>=25") == Leg(203999, 25.0, True, "0022400123")
+    with pytest.raises(ValueError):
+        parse_leg("203999>25")
@@ -0,0 +1,154 @@
+import gc
+import json
+import os
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.prediction_cache as prediction_cache
+from src.prediction_cache import PredictionCache, get_prediction_cache, row_keys
+
+FEATURES = ["a", "b"]
+
+
+class FakeHandle:
+    # Artifact files plus a model that's cheap to call; the cache never needs to load it
+    loaded = False
+
+    def __init__(self, root, stats=("pts", "reb"), version="v1"):
+        self.version = version
+        for name in ("m.keras", "m_scaler.joblib", "m.npz"):
+            with open(root / name, "w") as f:
+                f.write("x")
+        with open(root / "m_features.json", "w") as f:
+            json.dump(FEATURES, f)
+        if stats is not None:
+            with open(root / "m_stats.json", "w") as f:
+                json.dump(list(stats), f)
+        self.model_path, self.scaler_path = str(root / "m.keras"), str(root / "m_scaler.joblib")
+        self.feat_path, self.npz_path = str(root / "m_features.json"), str(root / "m.npz")
+        self.stats_path, self.calibration_path = str(root / "m_stats.json"), str(root / "m_calibration.json")
+        self.n_stats = len(stats) if stats is not None else 1
+        self.scored = 0
+
+    def predict(self, df):
+        self.scored += len(df)
+        a = df["a"].to_numpy(float)
+        return np.tile(a[:, None], self.n_stats), np.ones((len(df), self.n_stats))
+
+    def wait(self):
+        raise AssertionError("the cache loaded the model")
+
+
+def frame(n, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"a": rng.integers(0, 10 ** 9, n).astype(float), "b": rng.normal(size=n)})
+
+
+@pytest.fixture
+def handle(tmp_path):
+    (tmp_path / "model").mkdir()
+    return FakeHandle(tmp_path / "model")
+
+
+def test_hits_after_flush(handle, tmp_path):
+    cache = PredictionCache(handle, cache_dir=str(tmp_path / "cache"))
+    df = frame(200, 0)
+    mu, sigma = cache.predict(df)
+    assert mu.shape == (200, 2) and handle.scored == 200
+    cache.flush()
+
+    # a new process: nothing in memory, every row comes off disk without scoring
+    again = PredictionCache(handle, cache_dir=str(tmp_path / "cache"), lru_rows=10)
+    mu2, sigma2 = again.predict(df)
+    assert handle.scored == 200 and again.hits == 200
+    np.testing.assert_array_equal(mu2, mu)
+    np.testing.assert_array_equal(sigma2, sigma)
+
+
+def test_v1_artifacts_without_stats_file(tmp_path):
+    # points only, read without loading the model, from the single mu / sigma pair layout
+    (tmp_path / "model").mkdir()
+    handle = FakeHandle(tmp_path / "model", stats=None)
+    cache = PredictionCache(handle, cache_dir=str(tmp_path / "cache"))
+    df = frame(20, 1)
+    os.makedirs(cache.dir)
+    pd.DataFrame({"key": row_keys(df, FEATURES), "mu": 3.0, "sigma": 4.0}).to_parquet(
+        os.path.join(cache.dir, f"{time.time_ns()}.parquet"), index=False)
+    mu, sigma = cache.predict(df)
+    assert cache.stats == ["pts"] and handle.scored == 0
+    assert (mu == 3.0).all() and (sigma == 4.0).all()
+
+
+def test_newest_segment_wins(handle, tmp_path):
+    cache = PredictionCache(handle, cache_dir=str(tmp_path / "cache"))
+    df = frame(50, 2)
+    cache.predict(df)
+    cache.flush()
+    newer = pd.DataFrame({"key": row_keys(df, FEATURES), "mu_0": -1.0, "mu_1": -1.0, "sigma_0": 1.0, "sigma_1": 1.0})
+    path = cache._write_segment(newer)
+    cache._index_segment(path, newer["key"].to_numpy(dtype=np.uint64))
+    cache._lru.clear()
+    mu, _ = cache.predict(df)
+    assert (mu == -1.0).all()
+
+
+def test_segments_merge_and_keep_every_row(handle, tmp_path, monkeypatch):
+    monkeypatch.setattr(prediction_cache, "MAX_SEGMENTS", 4)
+    cache = PredictionCache(handle, cache_dir=str(tmp_path / "cache"), lru_rows=10)
+    frames = [frame(30, seed) for seed in range(10)]
+    for df in frames:
+        cache.predict(df)
+        cache.flush()
+    assert len(cache._segments) <= 4
+    assert len(os.listdir(cache.dir)) == len(cache._segments)
+
+    fresh = PredictionCache(handle, cache_dir=str(tmp_path / "cache"), lru_rows=10)
+    fresh.predict(pd.concat(frames, ignore_index=True))
+    assert fresh.misses == 0
+
+
+def test_size_and_age_eviction(handle, tmp_path):
+    cache = PredictionCache(handle, cache_dir=str(tmp_path / "cache"))
+    for seed in range(5):
+        cache.predict(frame(500, seed))
+        cache.flush()
+    sizes = [os.path.getsize(p) for p in cache._segments]
+
+    small = PredictionCache(handle, cache_dir=str(tmp_path / "cache"), max_bytes=sum(sizes[-2:]))
+    small.predict(frame(1, 99))
+    assert list(small._segments) == list(cache._segments)[-2:]
+
+    expired = PredictionCache(handle, cache_dir=str(tmp_path / "cache"), max_age_days=0)
+    expired.predict(frame(1, 99))
+    assert not expired._segments and not os.listdir(expired.dir)
+
+
+def test_stale_fingerprints_are_removed(handle, tmp_path):
+    cache = PredictionCache(handle, cache_dir=str(tmp_path / "cache"))
+    cache.predict(frame(5, 0))
+    cache.flush()
+    os.utime(handle.npz_path, ns=(1, 1))  # re-exported model
+    retrained = PredictionCache(handle, cache_dir=str(tmp_path / "cache"))
+    assert retrained.dir != cache.dir
+    assert not os.path.exists(cache.dir)
+
+
+def test_cache_lives_on_the_handle(tmp_path, monkeypatch):
+    monkeypatch.setattr(PredictionCache.__init__, "__defaults__",
+                        (None, str(tmp_path / "cache"), 100, 1 << 30, 60.0))
+    (tmp_path / "model").mkdir()
+    handle = FakeHandle(tmp_path / "model")
+    cache = get_prediction_cache(handle)
+    assert cache.dir.startswith(str(tmp_path))
+    assert get_prediction_cache(handle) is cache
+    assert get_prediction_cache(handle, "v1_other") is not cache
+
+    # dropping the handle (a hot swap) frees it along with its cache
+    ref = weakref.ref(handle)
+    del handle, cache
+    gc.collect()
+    assert ref() is None
@@ -0,0 +1,120 @@
+import gc
+import json
+import os
+import weakref
+
+import pytest
+
+import src.serve as serve
+from src.model_handle import ModelHandle
+from src.registry import (
+    artifact_paths, content_hash, load_manifest, model_handle, promote, register, scoring_handles,
+    set_shadow, verify,
+)
+
+
+def write_artifacts(model_dir, version, mtime, payload="weights"):
+    paths = artifact_paths(version, str(model_dir))
+    for kind in ("npz", "scaler"):
+        with open(paths[kind], "w") as f:
+            f.write(f"{version} {kind} {payload}")
+    with open(paths["features"], "w") as f:
+        json.dump(["rolling_pts_10"], f)
+    os.utime(paths["features"], (mtime, mtime))
+    return paths
+
+
+@pytest.fixture
+def manifest_path(tmp_path):
+    write_artifacts(tmp_path, "v1_hetero_nll", 1_000)
+    write_artifacts(tmp_path, "v2_hetero_nll", 2_000)
+    return str(tmp_path / "manifest.json")
+
+
+def test_fallback_manifest(manifest_path):
+    # artifacts from before the registry: every version registered on the fly, newest champion
+    m = load_manifest(manifest_path)
+    assert m["champion"] == "v2_hetero_nll" and m["challengers"] == []
+    assert m["versions"]["v1_hetero_nll"]["hash"] == content_hash("v1_hetero_nll", os.path.dirname(manifest_path))
+    assert not os.path.exists(manifest_path)
+    assert load_manifest(manifest_path, exclude=("v2_hetero_nll",))["champion"] == "v1_hetero_nll"
+
+
+def test_register_promote_shadow(manifest_path):
+    # registering the newest artifacts doesn't make them champion over the existing ones
+    m = register("v2_hetero_nll", metrics={"val_nll": 1.5}, challenger=True, path=manifest_path)
+    assert (m["champion"], m["challengers"]) == ("v1_hetero_nll", ["v2_hetero_nll"])
+    assert load_manifest(manifest_path)["versions"]["v2_hetero_nll"]["metrics"] == {"val_nll": 1.5}
+
+    m = promote("v2_hetero_nll", path=manifest_path)
+    assert (m["champion"], m["challengers"]) == ("v2_hetero_nll", [])
+    assert set_shadow("v1_hetero_nll", path=manifest_path)["challengers"] == ["v1_hetero_nll"]
+    assert set_shadow("v2_hetero_nll", path=manifest_path)["challengers"] == ["v1_hetero_nll"]
+    assert set_shadow("v1_hetero_nll", on=False, path=manifest_path)["challengers"] == []
+    with pytest.raises(ValueError):
+        promote("v9_hetero_nll", path=manifest_path)
+    with pytest.raises(FileNotFoundError):
+        register("v9_hetero_nll", path=manifest_path)
+
+
+def test_content_hash_and_verify(manifest_path):
+    model_dir = os.path.dirname(manifest_path)
+    register("v1_hetero_nll", path=manifest_path)  # adopts v2 too, as it was already on disk
+    before = content_hash("v1_hetero_nll", model_dir)
+    assert verify(manifest_path) == {"v1_hetero_nll": True, "v2_hetero_nll": True}
+
+    # the calibration file is rewritten in place by the backtest and isn't hashed
+    with open(artifact_paths("v1_hetero_nll", model_dir)["calibration"], "w") as f:
+        f.write("{}")
+    assert content_hash("v1_hetero_nll", model_dir) == before
+
+    write_artifacts(model_dir, "v1_hetero_nll", 1_000, payload="retrained")
+    assert content_hash("v1_hetero_nll", model_dir) != before
+    assert verify(manifest_path) == {"v1_hetero_nll": False, "v2_hetero_nll": True}
+
+
+def test_handles_shared_and_dropped_when_stale(manifest_path):
+    register("v1_hetero_nll", path=manifest_path)
+    h = model_handle("v1_hetero_nll", "numpy", manifest_path)
+    assert model_handle("v1_hetero_nll", "numpy", manifest_path) is h
+    assert not h.loaded
+
+    # re-registered artifacts get a new handle; the registry lets go of the old one
+    write_artifacts(os.path.dirname(manifest_path), "v1_hetero_nll", 1_000, payload="retrained")
+    register("v1_hetero_nll", path=manifest_path)
+    assert model_handle("v1_hetero_nll", "numpy", manifest_path) is not h
+    ref = weakref.ref(h)
+    del h
+    gc.collect()
+    assert ref() is None
+
+
+def test_service_swaps_to_promoted_champion(manifest_path, monkeypatch):
+    register("v1_hetero_nll", champion=True, path=manifest_path)
+    monkeypatch.setattr(ModelHandle, "load", lambda self: self)
+    monkeypatch.setattr(serve, "manifest_mtime", lambda: os.stat(manifest_path).st_mtime_ns)
+    monkeypatch.setattr(serve, "load_model_handle",
+                        lambda backend: scoring_handles(backend, shadow=False, path=manifest_path)[0])
+
+    service = serve.PredictionService(serve.load_model_handle("numpy"), reload_check_s=60, backend="numpy")
+    try:
+        assert service.handle.version == "v1_hetero_nll"
+        service._next_check = 0
+        assert not service.maybe_reload()  # manifest unchanged
+
+        promote("v2_hetero_nll", path=manifest_path)
+        os.utime(manifest_path, ns=(1, 1))
+        assert not service.maybe_reload()  # checked at most every reload_check_s
+        service._next_check = 0
+        assert service.maybe_reload()
+        assert service.handle.version == service.batcher.handle.version == "v2_hetero_nll"
+        assert service.swaps == 1
+
+        # a broken manifest keeps the current model serving
+        with open(manifest_path, "w") as f:
+            f.write("{")
+        service._next_check = 0
+        assert not service.maybe_reload()
+        assert service.handle.version == "v2_hetero_nll"
+    finally:
+        service.batcher.close()
@@ -0,0 +1,45 @@
+import threading
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+from src.rolling_state import load_states, update_rolling_state
+
+
+def game_row(game_id, points):
+    return pd.DataFrame({"game_id": [game_id], "player_id": [7], "team_id": [1], "minutes": [30.0], "points": [points]})
+
+
+def test_concurrent_ingests_of_a_new_player(pg_engine):
+    with pg_engine.begin() as conn:
+        conn.execute(text("INSERT INTO games (game_id, game_date) VALUES ('g1', '2025-01-01'), ('g2', '2025-01-03')"))
+
+    first = pg_engine.connect()
+    first.begin()
+    update_rolling_state(first, game_row("g1", 10))
+
+    # the second ingest has to wait on the player's row instead of writing its own copy
+    def second():
+        with pg_engine.begin() as conn:
+            update_rolling_state(conn, game_row("g2", 20))
+
+    t = threading.Thread(target=second)
+    t.start()
+    time.sleep(0.5)
+    assert t.is_alive()
+    first.commit()
+    first.close()
+    t.join(10)
+    assert not t.is_alive()
+
+    with pg_engine.connect() as conn:
+        st = load_states(conn, [7])[7]
+    assert (st.n_games, st.last_game_id, st.mean("pts")) == (2, "g2", 15.0)
+
+
+def test_placeholder_rows_start_empty(pg_engine):
+    with pg_engine.begin() as conn:
+        st = load_states(conn, [3, 1, 3], for_update=True)
+        assert sorted(st) == [1, 3]
+        assert st[1].n_games == 0 and st[1].last("pts") is None and st[1].mean("pts") is None
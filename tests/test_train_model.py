@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from src.numpy_model import LOG_VAR_MAX, LOG_VAR_MIN, NumpyHeteroModel, export_npz
+from src.train_model import build_model, gaussian_nll, masked_nll
+
+
+def test_masked_nll_skips_missing_targets():
+    y = np.array([[10.0, np.nan], [np.nan, np.nan], [20.0, 4.0]], dtype=np.float32)
+    mu = tf.constant([[12.0, 3.0], [5.0, 5.0], [18.0, 5.0]])
+    log_var = tf.constant([[1.0, 0.0], [2.0, 2.0], [3.0, -1.0]])
+    total, n = masked_nll(tf.constant(y), mu, log_var)
+
+    present = ~np.isnan(y)
+    expected = 0.5 * (log_var.numpy() + (np.nan_to_num(y) - mu.numpy()) ** 2 / (np.exp(log_var.numpy()) + 1e-6))
+    assert float(n) == present.sum()
+    assert float(total) == pytest.approx(expected[present].sum(), rel=1e-6)
+    np.testing.assert_allclose(gaussian_nll(y[2], mu[2], log_var[2]).numpy(), expected[2], rtol=1e-6)
+
+
+def test_masked_nll_gradients_stay_finite():
+    # a head with no targets in the batch gets a zero gradient, not NaN
+    y = tf.constant([[10.0, np.nan], [12.0, np.nan]])
+    mu = tf.Variable([[11.0, 3.0], [11.0, 3.0]])
+    log_var = tf.Variable([[0.5, 0.5], [0.5, 0.5]])
+    with tf.GradientTape() as tape:
+        total, n = masked_nll(y, mu, log_var)
+        loss = total / n
+    g_mu, g_log_var = tape.gradient(loss, [mu, log_var])
+    assert np.isfinite(g_mu.numpy()).all() and np.isfinite(g_log_var.numpy()).all()
+    np.testing.assert_array_equal(g_mu.numpy()[:, 1], 0.0)
+    np.testing.assert_array_equal(g_log_var.numpy()[:, 1], 0.0)
+
+
+def test_build_model_log_var_range():
+    tf.keras.utils.set_random_seed(0)
+    model = build_model(5, hidden=(16,), n_out=4)
+    mu, log_var = model(np.zeros((3, 5), dtype=np.float32), training=False)
+    assert mu.shape == (3, 4) and log_var.shape == (3, 4)
+    # an untrained head starts at log_var = 0 (unit variance)
+    np.testing.assert_allclose(log_var.numpy(), 0.0, atol=1e-6)
+
+    # inputs far out push the raw head both ways; the output stays inside the clip
+    x = np.random.default_rng(0).normal(scale=1e3, size=(500, 5)).astype(np.float32)
+    _, log_var = model(x, training=False)
+    log_var = log_var.numpy()
+    assert log_var.min() == pytest.approx(LOG_VAR_MIN) and log_var.max() == pytest.approx(LOG_VAR_MAX)
+
+
+def test_export_npz_matches_build_model(tmp_path):
+    # the exported NumPy model folds the clip offset into the bias and reproduces the net
+    from sklearn.preprocessing import StandardScaler
+
+    tf.keras.utils.set_random_seed(1)
+    model = build_model(3, hidden=(8, 8), n_out=2)
+    X = np.random.default_rng(1).normal(scale=50, size=(300, 3))
+    scaler = StandardScaler().fit(X[:100])
+    path = export_npz(model, scaler, ["a", "b", "c"], str(tmp_path / "m.npz"), stats=("pts", "reb"))
+
+    np_model = NumpyHeteroModel.load(path)
+    assert np_model.stats == ["pts", "reb"]
+    Xs = np_model.transform(X)
+    mu, log_var = np_model.forward(Xs)
+    k_mu, k_log_var = model(Xs, training=False)
+    np.testing.assert_allclose(mu, k_mu.numpy(), rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(log_var, k_log_var.numpy(), rtol=1e-5, atol=1e-5)